@@ -0,0 +1,297 @@
+"""Training-load analytics over columnar NumPy arrays.
+
+A user's (or a batch of users') logged sets are flattened once into parallel
+arrays; every metric is then a handful of vectorized bincount/cumsum passes
+instead of a Python loop per set. Load is measured as volume (reps x weight).
+"""
+import itertools
+from datetime import datetime, timedelta
+
+import numpy as np
+from pymongo import ReplaceOne
+
+from catalog import get_catalog
+from database import db
+
+ACUTE_DAYS = 7
+CHRONIC_DAYS = 28
+REPORT_WEEKS = 12
+
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+
+def day_number(value):
+    """Days since 1970-01-01 for a naive UTC datetime or date"""
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return (value - UNIX_EPOCH).days
+
+
+def day_date(number):
+    return (UNIX_EPOCH + timedelta(days=int(number))).date()
+
+
+class SetTable:
+    """Completed sets as columns, with per-session columns alongside.
+
+    Per set: `session`, `exercise` (codes into `sessions`/`exercises`),
+    `reps`, `weight`, `volume`, and the derived `user` and `day`. Per
+    session: `session_user`, `session_day` (day of end_time) and
+    `session_minutes`.
+    """
+
+    def __init__(self, users, exercises, session_user, session_day, session_minutes,
+                 session, exercise, reps, weight):
+        self.users = users
+        self.exercises = exercises
+        self.session_user = session_user
+        self.session_day = session_day
+        self.session_minutes = session_minutes
+        self.session = session
+        self.exercise = exercise
+        self.reps = reps
+        self.weight = weight
+        self.volume = reps * weight
+        self.user = session_user[session]
+        self.day = session_day[session]
+
+    @classmethod
+    def from_sessions(cls, sessions):
+        """Flatten workout session documents; unfinished sessions are skipped"""
+        user_codes = {}
+        exercise_codes = {}
+        session_user, session_day, session_minutes = [], [], []
+        set_session, set_exercise, reps, weight = [], [], [], []
+
+        for session_data in sessions:
+            end_time = session_data.get('end_time')
+            if not end_time:
+                continue
+            code = len(session_user)
+            start_time = session_data.get('start_time') or end_time
+            session_user.append(user_codes.setdefault(session_data['user_id'], len(user_codes)))
+            session_day.append(day_number(end_time))
+            session_minutes.append((end_time - start_time).total_seconds() / 60)
+
+            for exercise in session_data.get('exercises_completed', []):
+                exercise_code = exercise_codes.setdefault(exercise.get('exercise_key'), len(exercise_codes))
+                for s in exercise.get('sets', []):
+                    set_session.append(code)
+                    set_exercise.append(exercise_code)
+                    reps.append(s.get('reps') or 0)
+                    weight.append(s.get('weight') or 0)
+
+        return cls(
+            users=list(user_codes),
+            exercises=list(exercise_codes),
+            session_user=np.array(session_user, dtype=np.int64),
+            session_day=np.array(session_day, dtype=np.int64),
+            session_minutes=np.array(session_minutes, dtype=np.float64),
+            session=np.array(set_session, dtype=np.int64),
+            exercise=np.array(set_exercise, dtype=np.int64),
+            reps=np.array(reps, dtype=np.float64),
+            weight=np.array(weight, dtype=np.float64)
+        )
+
+    @classmethod
+    def load(cls, user_ids, since=None):
+        """One query for all the given users' completed sessions ending on or after `since`"""
+        end_time = {"$ne": None}
+        if since:
+            end_time["$gte"] = since
+        cursor = db.workout_sessions.find(
+            {"user_id": {"$in": list(user_ids)}, "end_time": end_time},
+            {"user_id": 1, "start_time": 1, "end_time": 1,
+             "exercises_completed.exercise_key": 1, "exercises_completed.sets": 1}
+        )
+        from models import SessionArchive
+        if SessionArchive.reaches(since):
+            # Report windows stay within the hot horizon; longer reads also decompress archived months
+            archived = (
+                session_data for user_id in user_ids
+                for session_data in SessionArchive.sessions(user_id, after=since)
+                if session_data.get('end_time') and (since is None or session_data['end_time'] >= since)
+            )
+            cursor = itertools.chain(cursor, archived)
+        return cls.from_sessions(cursor)
+
+    def muscle_matrix(self, catalog=None):
+        """(exercises x muscle groups) 0/1 matrix from the catalog, and the muscle names"""
+        catalog = catalog or get_catalog()
+        muscles = sorted(catalog.by_muscle)
+        column = {muscle: i for i, muscle in enumerate(muscles)}
+        matrix = np.zeros((len(self.exercises), len(muscles)))
+        for row, exercise_key in enumerate(self.exercises):
+            for muscle in (catalog.get(exercise_key) or {}).get('muscle_groups', []):
+                matrix[row, column[muscle]] = 1
+        return matrix, muscles
+
+    def weekly_muscle_volume(self, today, weeks=REPORT_WEEKS, catalog=None):
+        """(users x weeks x muscles) volume for the last `weeks` Monday-start weeks, oldest first.
+
+        An exercise counts its full volume towards each muscle group it
+        trains. Returns the array, the week start dates and the muscle names.
+        """
+        matrix, muscles = self.muscle_matrix(catalog)
+        # 1970-01-01 was a Thursday, so (day + 3) % 7 is the weekday with Monday = 0
+        week_start = self.day - (self.day + 3) % 7
+        today_number = day_number(today)
+        current_week = today_number - (today_number + 3) % 7
+        slot = weeks - 1 - (current_week - week_start) // 7
+        mask = (slot >= 0) & (slot < weeks)
+
+        n_users, n_exercises = len(self.users), len(self.exercises)
+        index = (self.user[mask] * weeks + slot[mask]) * n_exercises + self.exercise[mask]
+        per_exercise = np.bincount(index, weights=self.volume[mask], minlength=n_users * weeks * n_exercises)
+        per_muscle = per_exercise.reshape(n_users * weeks, n_exercises) @ matrix
+        week_starts = [day_date(current_week - 7 * (weeks - 1 - i)) for i in range(weeks)]
+        return per_muscle.reshape(n_users, weeks, len(muscles)), week_starts, muscles
+
+    def daily_load(self, first_day, last_day):
+        """(users x days) volume per day for day numbers first_day..last_day"""
+        span = last_day - first_day + 1
+        mask = (self.day >= first_day) & (self.day <= last_day)
+        index = self.user[mask] * span + (self.day[mask] - first_day)
+        return np.bincount(index, weights=self.volume[mask], minlength=len(self.users) * span).reshape(-1, span)
+
+    def acute_chronic(self, today, days=CHRONIC_DAYS, acute_days=ACUTE_DAYS, chronic_days=CHRONIC_DAYS):
+        """Rolling acute and chronic average daily load for the last `days` days.
+
+        Returns (acute, chronic, ratio), each (users x days) and oldest first;
+        the ratio is NaN where there is no chronic load.
+        """
+        last_day = day_number(today)
+        first_day = last_day - days - chronic_days + 2
+        daily = self.daily_load(first_day, last_day)
+        totals = np.concatenate([np.zeros((daily.shape[0], 1)), np.cumsum(daily, axis=1)], axis=1)
+
+        end = np.arange(totals.shape[1] - days, totals.shape[1])
+        acute = (totals[:, end] - totals[:, end - acute_days]) / acute_days
+        chronic = (totals[:, end] - totals[:, end - chronic_days]) / chronic_days
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(chronic > 0, acute / chronic, np.nan)
+        return acute, chronic, ratio
+
+    def session_density(self):
+        """Volume per minute of each session (NaN when the duration is unknown)"""
+        volume = np.bincount(self.session, weights=self.volume, minlength=len(self.session_user))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.session_minutes > 0, volume / self.session_minutes, np.nan)
+
+    def mean_density(self, since_day=None):
+        """Per-user mean session density over sessions ending on or after `since_day`"""
+        density = self.session_density()
+        mask = ~np.isnan(density)
+        if since_day is not None:
+            mask &= self.session_day >= since_day
+        n_users = len(self.users)
+        total = np.bincount(self.session_user[mask], weights=density[mask], minlength=n_users)
+        count = np.bincount(self.session_user[mask], minlength=n_users)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+
+
+def _number(value):
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+def training_reports(table, today, weeks=REPORT_WEEKS, catalog=None):
+    """{user_id: report} for every user in the table, computed in one vectorized pass"""
+    acute, chronic, ratio = table.acute_chronic(today)
+    muscle_volume, week_starts, muscles = table.weekly_muscle_volume(today, weeks, catalog)
+    density = table.mean_density(since_day=day_number(today) - CHRONIC_DAYS + 1)
+
+    reports = {}
+    for code, user_id in enumerate(table.users):
+        reports[user_id] = {
+            'date': today.isoformat(),
+            'acute_load': _number(acute[code, -1]),
+            'chronic_load': _number(chronic[code, -1]),
+            'acute_chronic_ratio': _number(ratio[code, -1]),
+            'daily_ratio': [_number(value) for value in ratio[code]],
+            'weekly_muscle_volume': {
+                week_start.isoformat(): {
+                    muscle: round(float(volume), 2)
+                    for muscle, volume in zip(muscles, muscle_volume[code, i]) if volume
+                }
+                for i, week_start in enumerate(week_starts)
+            },
+            'session_density': _number(density[code])
+        }
+    return reports
+
+
+def report_window_start(today, weeks=REPORT_WEEKS):
+    """Earliest end_time a report needs: the chronic window behind the oldest ratio, or the oldest week"""
+    days = max(2 * CHRONIC_DAYS, 7 * (weeks + 1))
+    return datetime(today.year, today.month, today.day) - timedelta(days=days)
+
+
+def user_report(user_id, today=None):
+    today = today or datetime.utcnow().date()
+    table = SetTable.load([user_id], since=report_window_start(today))
+    return training_reports(table, today).get(user_id)
+
+
+def write_user_report(user_id, today=None):
+    """Store one user's report, tagged with the data version it was computed from"""
+    from models import DataVersion
+    today = today or datetime.utcnow().date()
+    # Read before computing: a write landing meanwhile leaves the stored report stale, not wrong
+    version, _ = DataVersion.get(user_id)
+    report = user_report(user_id, today)
+    # Replace rather than $set, so a report without sessions drops the previous day's metrics
+    db.training_reports.replace_one(
+        {"_id": user_id},
+        dict(report or {'date': today.isoformat()}, data_version=version, computed_at=datetime.utcnow()),
+        upsert=True
+    )
+    return report
+
+
+def stored_user_report(user_id, version, today=None):
+    """The stored report if it was computed today from the user's current data version, else None"""
+    today = today or datetime.utcnow().date()
+    report = db.training_reports.find_one({"_id": user_id, "date": today.isoformat(), "data_version": version},
+                                          {"_id": 0, "data_version": 0, "computed_at": 0})
+    if report is not None and 'acute_load' not in report:
+        return None
+    return report
+
+
+def write_nightly_reports(batch_size=500, today=None, progress=None):
+    """Compute every user's report in batches of `batch_size` users into `training_reports`.
+
+    `progress(done, total)` is called after each batch (see jobs.py).
+    """
+    today = today or datetime.utcnow().date()
+    since = report_window_start(today)
+    total = db.users.estimated_document_count() if progress else None
+    count = 0
+    batch = []
+    for user_data in db.users.find({}, {"_id": 1}):
+        batch.append(user_data['_id'])
+        if len(batch) >= batch_size:
+            count += _write_batch(batch, since, today)
+            batch = []
+            if progress:
+                progress(count, total)
+    if batch:
+        count += _write_batch(batch, since, today)
+    return count
+
+
+def _write_batch(user_ids, since, today):
+    # Versions are read before computing, as in write_user_report
+    versions = {version_data['_id']: version_data.get('version', 0)
+                for version_data in db.data_versions.find({"_id": {"$in": user_ids}}, {"version": 1})}
+    reports = training_reports(SetTable.load(user_ids, since=since), today)
+    computed_at = datetime.utcnow()
+    requests = [
+        ReplaceOne({"_id": user_id}, dict(reports.get(user_id) or {'date': today.isoformat()},
+                                          data_version=versions.get(user_id, 0), computed_at=computed_at),
+                   upsert=True)
+        for user_id in user_ids
+    ]
+    db.training_reports.bulk_write(requests, ordered=False)
+    return len(user_ids)
@@ -3,108 +3,89 @@ import logging
 from flask import Flask
 from flask_login import LoginManager
 from flask_cors import CORS
-from flask_pymongo import PyMongo
-from flask_session import Session
+from database import DATABASE_NAME
+from session_store import CachedMongoDBSessionInterface
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure Flask-Login
+login_manager = LoginManager()
+login_manager.login_view = 'main_routes.index'
 
-app = Flask(__name__)
+@login_manager.user_loader
+def load_user(user_id):
+    from models import User
+    return User.get(user_id)
 
-# Ensure SESSION_SECRET is set for security
-if not os.environ.get("SESSION_SECRET"):
-    raise ValueError("SESSION_SECRET environment variable must be set for security")
-app.secret_key = os.environ.get("SESSION_SECRET")
+def create_app(config=None):
+    """Build the Flask app; `config` (a mapping) overrides the settings read from the environment.
 
-# Enable CORS for PWA functionality
-CORS(app)
+    Nothing here connects or does I/O beyond hashing static/: the MongoDB
+    client (database.get_client), the OAuth client (google_auth.oauth_client)
+    and the exercise catalog (catalog.get_catalog) are all created on first
+    use, in the process that uses them. Building the app in gunicorn's
+    master before it forks (preload_app, see gunicorn.conf.py) is therefore
+    safe, and tests can build as many apps as they like.
+    """
+    # Configure logging (DEBUG logs every pymongo and urllib3 call; use it locally only).
+    # A no-op when the host process has configured logging already.
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 
-# Configure MongoDB
-app.config["MONGO_URI"] = os.environ.get("MONGODB_URI")
+    app = Flask(__name__)
+    app.config.from_mapping(
+        SECRET_KEY=os.environ.get("SESSION_SECRET"),
+        # Configure Flask-Session to use MongoDB
+        SESSION_TYPE='mongodb',
+        SESSION_PERMANENT=False,
+        SESSION_USE_SIGNER=True,
+        SESSION_KEY_PREFIX='fittracker:',
+        SESSION_MONGODB_DB=DATABASE_NAME,
+        SESSION_MONGODB_COLLECT='sessions',
+        SESSION_CACHE_TTL=float(os.environ.get('SESSION_CACHE_TTL', 0))
+    )
+    if config:
+        app.config.from_mapping(config)
 
-# Configure Flask-Session to use MongoDB
-app.config['SESSION_TYPE'] = 'mongodb'
-app.config['SESSION_MONGODB'] = None  # Will be set after mongo initialization
-app.config['SESSION_PERMANENT'] = False
-app.config['SESSION_USE_SIGNER'] = True
-app.config['SESSION_KEY_PREFIX'] = 'fittracker:'
-app.config['SESSION_MONGODB_DB'] = 'fittracker'
-app.config['SESSION_MONGODB_COLLECT'] = 'sessions'
+    # Ensure SESSION_SECRET is set for security
+    if not app.config['SECRET_KEY']:
+        raise ValueError("SESSION_SECRET environment variable must be set for security")
 
-# Initialize MongoDB
-mongo = PyMongo(app)
+    # Enable CORS for PWA functionality
+    CORS(app)
 
-# Set MongoDB for sessions
-app.config['SESSION_MONGODB'] = mongo.cx
+    # gzip/brotli for large HTML and JSON responses, and no-store for pages showing flashes (see http_cache.py)
+    from http_cache import compress_response, no_store_flashes
+    app.after_request(compress_response)
+    app.after_request(no_store_flashes)
 
-# Initialize Flask-Session
-Session(app)
+    # Content-hashed /assets/ URLs for static files and the generated /sw.js (see static_assets.py)
+    from static_assets import AssetManifest
+    AssetManifest(app)
 
-# Configure Flask-Login
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'main_routes.index'
+    # Per-endpoint timing and MongoDB query metrics at /metrics (see metrics.py)
+    from metrics import RequestMetrics
+    RequestMetrics(app)
 
-@login_manager.user_loader
-def load_user(user_id):
-    from models import User
-    return User.get(user_id)
+    # Initialize server-side sessions, skipping writes for unchanged sessions and
+    # optionally caching reads in process (see session_store.py)
+    app.session_interface = CachedMongoDBSessionInterface(
+        app,
+        key_prefix=app.config['SESSION_KEY_PREFIX'],
+        use_signer=app.config['SESSION_USE_SIGNER'],
+        permanent=app.config['SESSION_PERMANENT'],
+        db=app.config['SESSION_MONGODB_DB'],
+        collection=app.config['SESSION_MONGODB_COLLECT'],
+        cache_ttl=app.config['SESSION_CACHE_TTL']
+    )
+
+    login_manager.init_app(app)
+
+    import commands
+    commands.init_app(app)
+
+    # Register blueprints
+    from google_auth import google_auth
+    app.register_blueprint(google_auth)
+
+    from routes import main_routes
+    app.register_blueprint(main_routes)
 
-# Register blueprints
-from google_auth import google_auth
-app.register_blueprint(google_auth)
-
-from routes import main_routes
-app.register_blueprint(main_routes)
-
-# Exercise library data - moved from storage to a simple dictionary
-EXERCISE_LIBRARY = {
-    'push_ups': {
-        'name': 'Push-ups',
-        'muscle_groups': ['Chest', 'Shoulders', 'Triceps'],
-        'description': 'Classic bodyweight exercise for upper body strength',
-        'equipment': 'Bodyweight'
-    },
-    'squats': {
-        'name': 'Squats',
-        'muscle_groups': ['Quadriceps', 'Glutes', 'Hamstrings'],
-        'description': 'Fundamental lower body exercise',
-        'equipment': 'Bodyweight'
-    },
-    'deadlifts': {
-        'name': 'Deadlifts',
-        'muscle_groups': ['Hamstrings', 'Glutes', 'Back'],
-        'description': 'Compound movement for posterior chain',
-        'equipment': 'Barbell'
-    },
-    'bench_press': {
-        'name': 'Bench Press',
-        'muscle_groups': ['Chest', 'Shoulders', 'Triceps'],
-        'description': 'Classic upper body pressing movement',
-        'equipment': 'Barbell'
-    },
-    'pull_ups': {
-        'name': 'Pull-ups',
-        'muscle_groups': ['Back', 'Biceps'],
-        'description': 'Bodyweight pulling exercise',
-        'equipment': 'Pull-up bar'
-    },
-    'lunges': {
-        'name': 'Lunges',
-        'muscle_groups': ['Quadriceps', 'Glutes'],
-        'description': 'Single-leg strength exercise',
-        'equipment': 'Bodyweight'
-    },
-    'planks': {
-        'name': 'Planks',
-        'muscle_groups': ['Core', 'Shoulders'],
-        'description': 'Isometric core strengthening exercise',
-        'equipment': 'Bodyweight'
-    },
-    'rows': {
-        'name': 'Rows',
-        'muscle_groups': ['Back', 'Biceps'],
-        'description': 'Horizontal pulling movement',
-        'equipment': 'Dumbbells'
-    }
-}
\ No newline at end of file
+    return app
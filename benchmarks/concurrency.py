@@ -0,0 +1,232 @@
+"""Sync vs gevent gunicorn workers under slow logins (gunicorn.conf.py).
+
+Starts a stand-in OpenID Connect provider whose token and userinfo
+endpoints answer after --idp-latency ms, then for each worker class boots
+gunicorn against the database in MONGODB_URI and runs two client groups at
+once for --duration seconds:
+
+- loggers-in repeatedly complete the OAuth callback (two slow provider calls)
+- readers, logged in up front, repeatedly load /dashboard and /api/activity
+
+and prints throughput and latency percentiles per group.
+
+    SESSION_SECRET=bench MONGODB_URI=mongodb://localhost:27017/fittracker \\
+        python benchmarks/concurrency.py --logins 8 --readers 16 --idp-latency 500
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def identity_provider(port, latency):
+    """Minimal provider: discovery is instant, token and userinfo sleep `latency` seconds.
+
+    The access token is the authorization code, and userinfo answers with
+    <code>@bench.test, so each client logs in as its own user.
+    """
+    base = f'http://127.0.0.1:{port}'
+
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, document, delay=0):
+            time.sleep(delay)
+            body = json.dumps(document).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'max-age=3600')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.startswith('/.well-known/openid-configuration'):
+                self.reply({
+                    'issuer': base,
+                    'authorization_endpoint': f'{base}/authorize',
+                    'token_endpoint': f'{base}/token',
+                    'userinfo_endpoint': f'{base}/userinfo',
+                    'jwks_uri': f'{base}/jwks'
+                })
+            elif self.path.startswith('/userinfo'):
+                code = self.headers.get('Authorization', '').split()[-1]
+                self.reply({'sub': code, 'email': f'{code}@bench.test', 'email_verified': True,
+                            'given_name': code}, latency)
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+            code = form.get('code', ['bench'])[0]
+            self.reply({'access_token': code, 'token_type': 'Bearer', 'expires_in': 3600}, latency)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_gunicorn(worker_class, port, idp_port, workers, connections):
+    env = dict(
+        os.environ,
+        GUNICORN_WORKER_CLASS=worker_class,
+        GUNICORN_BIND=f'127.0.0.1:{port}',
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_WORKER_CONNECTIONS=str(connections),
+        GOOGLE_OAUTH_CLIENT_ID='bench',
+        GOOGLE_OAUTH_CLIENT_SECRET='bench',
+        # The stand-in provider speaks plain HTTP
+        OAUTHLIB_INSECURE_TRANSPORT='1',
+        GOOGLE_DISCOVERY_URL=f'http://127.0.0.1:{idp_port}/.well-known/openid-configuration'
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--log-level', 'warning', 'main:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/health', timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'gunicorn ({worker_class}) did not start')
+
+
+def login(http, base, code):
+    """Complete the callback as the provider would redirect to it; returns the response time"""
+    started = time.perf_counter()
+    response = http.get(f'{base}/google_login/callback', params={'code': code},
+                        allow_redirects=False, timeout=60)
+    elapsed = time.perf_counter() - started
+    if response.status_code != 302 or '/dashboard' not in response.headers.get('Location', ''):
+        raise RuntimeError(f'login failed: {response.status_code} {response.headers.get("Location")}')
+    return elapsed
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else float('nan')
+
+
+def run(base, logins, readers, duration):
+    samples = {'login': [], 'read': []}
+    errors = {'login': 0, 'read': 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def record(group, elapsed=None):
+        with lock:
+            if elapsed is None:
+                errors[group] += 1
+            else:
+                samples[group].append(elapsed)
+
+    def login_loop(i):
+        http = requests.Session()
+        n = 0
+        while not stop.is_set():
+            try:
+                record('login', login(http, base, f'login{i}x{n}'))
+            except Exception:
+                record('login')
+            n += 1
+
+    def read_loop(http):
+        paths = ['/dashboard', '/api/activity']
+        n = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                response = http.get(base + paths[n % len(paths)], timeout=60)
+                response.raise_for_status()
+                record('read', time.perf_counter() - started)
+            except Exception:
+                record('read')
+            n += 1
+
+    reader_sessions = []
+    for i in range(readers):
+        http = requests.Session()
+        login(http, base, f'reader{i}')
+        reader_sessions.append(http)
+
+    threads = [threading.Thread(target=login_loop, args=(i,)) for i in range(logins)]
+    threads += [threading.Thread(target=read_loop, args=(http,)) for http in reader_sessions]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return {
+        group: {
+            'requests': len(values),
+            'errors': errors[group],
+            'per_second': round(len(values) / duration, 1),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 1)
+        }
+        for group, values in samples.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=8, help='clients logging in concurrently')
+    parser.add_argument('--readers', type=int, default=16, help='logged-in clients loading pages')
+    parser.add_argument('--idp-latency', type=float, default=500, help='provider response time (ms)')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per worker class')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--connections', type=int, default=100, help='greenlets per gevent worker')
+    parser.add_argument('--worker-class', action='append', choices=['sync', 'gevent'],
+                        help='repeatable; default both')
+    args = parser.parse_args()
+
+    idp_port = free_port()
+    idp = identity_provider(idp_port, args.idp_latency / 1000)
+    results = {}
+    try:
+        for worker_class in args.worker_class or ['sync', 'gevent']:
+            port = free_port()
+            process = start_gunicorn(worker_class, port, idp_port, args.workers, args.connections)
+            try:
+                results[worker_class] = run(f'http://127.0.0.1:{port}', args.logins, args.readers, args.duration)
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        idp.shutdown()
+
+    print(f"{args.workers} workers, {args.logins} logging in, {args.readers} reading, "
+          f"provider latency {args.idp_latency:.0f} ms")
+    print(f"{'':<8}{'group':<8}{'req/s':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for worker_class, groups in results.items():
+        for group, stats in groups.items():
+            print(f"{worker_class:<8}{group:<8}{stats['per_second']:>8}{stats['p50_ms']:>10}"
+                  f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Leaderboard read latency (leaderboard.py) as the number of ranked users grows.
+
+Fills one synthetic weekly board (a week in 2001, so real boards are left
+alone) to each --sizes step, with a long-tailed spread of volumes, then
+times top-10 and "my rank" for random users on every metric and prints
+latency percentiles per size. Ranks are checked against a count of higher
+scores on the first few queries. The board is removed at the end.
+
+    MONGODB_URI=mongodb://localhost:27017/fittracker \\
+        python benchmarks/leaderboard_reads.py --sizes 1000 10000 100000 --queries 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import leaderboard  # noqa: E402
+from database import db  # noqa: E402
+from models import ensure_indexes  # noqa: E402
+
+LEVEL = 'intermediate'
+START = datetime(2001, 1, 1)
+KEY = leaderboard.period_key('week', START)
+BATCH = 5000
+
+
+def score(rng, n):
+    return {
+        "_id": f"{KEY}:bench-{n}",
+        "period": KEY,
+        "level": LEVEL,
+        "user_id": f"bench-{n}",
+        "username": f"Bench {n}",
+        "volume": round(rng.lognormvariate(8.5, 0.9) / 2.5) * 2.5,
+        "workouts": rng.randint(1, 7),
+        "streak": min(int(rng.expovariate(1 / 6)) + 1, 60),
+    }
+
+
+def fill(rng, have, size):
+    for first in range(have, size, BATCH):
+        db.leaderboard_scores.insert_many([score(rng, n) for n in range(first, min(first + BATCH, size))],
+                                          ordered=False)
+    leaderboard.rebuild_histogram(KEY, LEVEL, leaderboard.period_end('week', START))
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - started) * 1000, result
+
+
+def measure(rng, size, queries, checks):
+    timings = {}
+    for metric in leaderboard.METRICS:
+        timings[f'top {metric}'] = [timed(lambda: leaderboard.top(KEY, LEVEL, metric, 10))[0] for _ in range(queries)]
+        ranks = []
+        for i in range(queries):
+            user_id = f"bench-{rng.randrange(size)}"
+            elapsed, mine = timed(lambda: leaderboard.rank(KEY, LEVEL, metric, user_id))
+            ranks.append(elapsed)
+            if i < checks:
+                expected = 1 + db.leaderboard_scores.count_documents(
+                    {"period": KEY, "level": LEVEL, metric: {"$gt": mine['score']}})
+                if mine['rank'] != expected:
+                    raise AssertionError(f"{user_id} {metric}: rank {mine['rank']}, expected {expected}")
+        timings[f'rank {metric}'] = ranks
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='ranked users')
+    parser.add_argument('--queries', type=int, default=200, help='queries per metric and size')
+    parser.add_argument('--checks', type=int, default=5, help='ranks verified against a full count')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    ensure_indexes(['leaderboard_scores', 'leaderboard_histograms'])
+    rng = random.Random(args.seed)
+    db.leaderboard_scores.delete_many({"period": KEY, "level": LEVEL})
+    results = {}
+    have = 0
+    try:
+        for size in sorted(args.sizes):
+            started = time.perf_counter()
+            fill(rng, have, size)
+            have = size
+            print(f"{size} users loaded in {time.perf_counter() - started:.1f}s")
+            results[size] = measure(rng, size, args.queries, args.checks)
+    finally:
+        db.leaderboard_scores.delete_many({"period": KEY, "level": LEVEL})
+        db.leaderboard_histograms.delete_one({"_id": f"{KEY}:{LEVEL}"})
+
+    print(f"{'users':>8}  {'query':<16}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for size, timings in results.items():
+        for name, samples in timings.items():
+            print(f"{size:>8}  {name:<16}{percentile(samples, 0.5):>9.2f}{percentile(samples, 0.95):>9.2f}"
+                  f"{percentile(samples, 0.99):>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
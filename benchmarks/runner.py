@@ -0,0 +1,305 @@
+"""Latency, throughput and MongoDB commands per request for the main user flows.
+
+Each synthetic user (benchmarks/synthetic.py) repeatedly loads /dashboard,
+/progress and /api/progress, starts a workout, logs every exercise of the
+plan through /complete_exercise and finishes it through /finish_workout.
+
+--mode client drives the app in process through the Flask test client;
+--mode http boots gunicorn (gunicorn.conf.py) and logs in through the
+stand-in identity provider from benchmarks/concurrency.py. Both run
+against the database in MONGODB_URI. Commands per request come from the
+Server-Timing header (metrics.py), so they count everything up to the
+response but not the session save after it.
+
+Results are written as JSON tagged with the git commit; --baseline prints
+the change against an earlier file, and --compare only compares two files.
+
+    SESSION_SECRET=bench MONGODB_URI=mongodb://localhost:27017/fittracker \\
+        python benchmarks/runner.py --generate --users 10 --mode client --output before.json
+    python benchmarks/runner.py --mode http --concurrency 8 --baseline before.json --output after.json
+    python benchmarks/runner.py --compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Must be set before metrics.py is imported (client mode imports the app)
+os.environ['SERVER_TIMING'] = '1'
+
+SERVER_TIMING_DB = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+SESSION_ID = re.compile(r'name="session_id" value="([^"]+)"')
+
+
+class ClientTransport:
+    """One Flask test client per user, logged in by writing the session directly"""
+
+    def __init__(self):
+        from main import app
+        self.app = app
+
+    def connect(self, user):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = user['_id']
+            session['_fresh'] = True
+        return client
+
+    def request(self, client, method, path, data=None):
+        response = client.open(path, method=method, data=data)
+        return response.status_code, response.get_data(as_text=True), response.headers.get_all('Server-Timing')
+
+    def close(self):
+        pass
+
+
+class HttpTransport:
+    """gunicorn on a free port; users log in through the stand-in provider's OAuth callback"""
+
+    def __init__(self, worker_class, workers, connections, idp_latency):
+        import concurrency
+        self.concurrency = concurrency
+        idp_port = concurrency.free_port()
+        self.idp = concurrency.identity_provider(idp_port, idp_latency)
+        port = concurrency.free_port()
+        self.base = f'http://127.0.0.1:{port}'
+        self.process = concurrency.start_gunicorn(worker_class, port, idp_port, workers, connections)
+
+    def connect(self, user):
+        import requests
+        http = requests.Session()
+        # The provider answers for <code>@bench.test, the synthetic users' addresses
+        self.concurrency.login(http, self.base, user['email'].split('@')[0])
+        return http
+
+    def request(self, http, method, path, data=None):
+        response = http.request(method, self.base + path, data=data, allow_redirects=False, timeout=60)
+        timing = response.headers.get('Server-Timing')
+        return response.status_code, response.text, [timing] if timing else []
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+        self.idp.shutdown()
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, name, seconds, ok, timings):
+        queries = db_ms = None
+        for value in timings:
+            match = SERVER_TIMING_DB.search(value)
+            if match:
+                db_ms, queries = float(match.group(1)), int(match.group(2))
+        with self.lock:
+            self.samples.setdefault(name, []).append((seconds, ok, queries, db_ms))
+
+
+def user_flow(transport, connection, user, plan, iterations, recorder):
+    def call(name, method, path, data=None, expect=(200,)):
+        started = time.perf_counter()
+        status, body, timings = transport.request(connection, method, path, data)
+        recorder.add(name, time.perf_counter() - started, status in expect, timings)
+        return body
+
+    for _ in range(iterations):
+        call('GET /dashboard', 'GET', '/dashboard')
+        call('GET /progress', 'GET', '/progress')
+        call('GET /api/progress', 'GET', '/api/progress')
+
+        page = call('GET /start_workout', 'GET', f"/start_workout/{plan['_id']}")
+        match = SESSION_ID.search(page)
+        if not match:
+            continue
+        session_id = match.group(1)
+        for exercise in plan['exercises']:
+            sets = exercise['sets']
+            call('POST /complete_exercise', 'POST', '/complete_exercise', {
+                'session_id': session_id,
+                'exercise_key': exercise['exercise_key'],
+                'sets_completed[]': ['true'] * sets,
+                'reps_completed[]': [str(exercise['reps'])] * sets,
+                'weights_used[]': ['50'] * sets
+            })
+        call('POST /finish_workout', 'POST', '/finish_workout', {'session_id': session_id, 'notes': 'bench'},
+             expect=(302,))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(samples, wall_seconds):
+    results = {}
+    for name, rows in sorted(samples.items()):
+        seconds = [row[0] for row in rows]
+        queries = [row[2] for row in rows if row[2] is not None]
+        db_ms = [row[3] for row in rows if row[3] is not None]
+        results[name] = {
+            'requests': len(rows),
+            'errors': sum(1 for row in rows if not row[1]),
+            'throughput_rps': round(len(rows) / wall_seconds, 2),
+            'mean_ms': round(sum(seconds) / len(seconds) * 1000, 2),
+            'p50_ms': round(percentile(seconds, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(seconds, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(seconds, 0.99) * 1000, 2),
+            'mongo_ops_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+            'mongo_ms_per_request': round(sum(db_ms) / len(db_ms), 2) if db_ms else None
+        }
+    return results
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def print_results(results):
+    print(f"{'endpoint':<26}{'req':>6}{'err':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ops/req':>9}")
+    for name, stats in results['endpoints'].items():
+        ops = stats['mongo_ops_per_request']
+        print(f"{name:<26}{stats['requests']:>6}{stats['errors']:>5}{stats['throughput_rps']:>9}"
+              f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}{ops if ops is not None else '-':>9}")
+
+
+def compare(baseline, current):
+    """Percent change per endpoint for the latency percentiles, throughput and ops per request"""
+    print(f"baseline {str(baseline['meta'].get('commit'))[:10]} ({baseline['meta']['mode']}) -> "
+          f"current {str(current['meta'].get('commit'))[:10]} ({current['meta']['mode']})")
+    fields = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'mongo_ops_per_request')
+    print(f"{'endpoint':<26}" + ''.join(f' {field:>27}' for field in fields))
+    for name, stats in current['endpoints'].items():
+        before = baseline['endpoints'].get(name)
+        if not before:
+            continue
+        cells = []
+        for field in fields:
+            old, new = before.get(field), stats.get(field)
+            if old is None or new is None:
+                cells.append(f" {'-':>27}")
+                continue
+            change = f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+            cells.append(f' {f"{old} -> {new} ({change})":>27}')
+        print(f'{name:<26}' + ''.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['client', 'http'], default='client')
+    parser.add_argument('--users', type=int, default=10, help='synthetic users to drive')
+    parser.add_argument('--iterations', type=int, default=20, help='workflow repetitions per user')
+    parser.add_argument('--concurrency', type=int, default=4, help='users driven at once (http mode)')
+    parser.add_argument('--worker-class', choices=['sync', 'gevent'], default='sync', help='http mode')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers (http mode)')
+    parser.add_argument('--connections', type=int, default=100, help='greenlets per gevent worker')
+    parser.add_argument('--generate', action='store_true',
+                        help='replace the synthetic dataset first (benchmarks/synthetic.py)')
+    parser.add_argument('--years', type=float, default=2.0, help='history per generated user')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='only compare two results files')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            compare(json.load(f), json.load(g))
+        return
+
+    import synthetic
+    from database import db
+
+    dataset = None
+    if args.generate:
+        synthetic.remove_synthetic()
+        dataset = synthetic.generate(args.users, args.years, seed=args.seed, log=lambda line: None)
+    users = list(db.users.find({"email": {"$regex": synthetic.EMAIL_PATTERN}}).sort("email", 1).limit(args.users))
+    if not users:
+        sys.exit("No synthetic users; run benchmarks/synthetic.py or pass --generate")
+    plans = {}
+    for plan in db.workout_plans.find({"user_id": {"$in": [u['_id'] for u in users]}}).sort("_id", 1):
+        plans.setdefault(plan['user_id'], plan)
+
+    if args.mode == 'client':
+        transport = ClientTransport()
+        concurrency = 1
+    else:
+        transport = HttpTransport(args.worker_class, args.workers, args.connections, idp_latency=0)
+        concurrency = args.concurrency
+
+    recorder = Recorder()
+    try:
+        connections = [(transport.connect(user), user) for user in users if user['_id'] in plans]
+        # Each thread drives its own users one after another, so no two threads share a session
+        groups = [connections[i::concurrency] for i in range(concurrency)]
+
+        def drive(group):
+            for connection, user in group:
+                user_flow(transport, connection, user, plans[user['_id']], args.iterations, recorder)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=drive, args=(group,)) for group in groups if group]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_seconds = time.perf_counter() - started
+    finally:
+        transport.close()
+
+    commit, dirty = git_commit()
+    results = {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'created_at': datetime.utcnow().isoformat() + 'Z',
+            'mode': args.mode,
+            'worker_class': args.worker_class if args.mode == 'http' else None,
+            'workers': args.workers if args.mode == 'http' else None,
+            'concurrency': concurrency,
+            'users': len(connections),
+            'iterations': args.iterations,
+            'seed': args.seed,
+            'dataset': dataset,
+            'wall_seconds': round(wall_seconds, 3),
+            'python': platform.python_version()
+        },
+        'endpoints': summarize(recorder.samples, wall_seconds)
+    }
+    total = sum(stats['requests'] for stats in results['endpoints'].values())
+    print(f"{args.mode}: {len(connections)} users x {args.iterations} iterations, {total} requests "
+          f"in {wall_seconds:.1f}s ({total / wall_seconds:.1f} req/s)")
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"wrote {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
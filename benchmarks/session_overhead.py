@@ -0,0 +1,105 @@
+"""Per-request cost of the session layer on /dashboard and /complete_exercise.
+
+Runs the same requests through the Flask test client with the stock
+Flask-Session MongoDB interface and with CachedMongoDBSessionInterface,
+against the database in MONGODB_URI, and prints latency percentiles.
+
+    SESSION_SECRET=bench MONGODB_URI=mongodb://localhost:27017/fittracker \
+        python benchmarks/session_overhead.py --requests 500
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_session.mongodb import MongoDBSessionInterface  # noqa: E402
+
+from main import app  # noqa: E402
+from database import get_client  # noqa: E402
+from models import User, WorkoutPlan, WorkoutSession, db  # noqa: E402
+from session_store import CachedMongoDBSessionInterface  # noqa: E402
+
+
+def build_interfaces():
+    options = dict(
+        key_prefix='bench:',
+        use_signer=app.config['SESSION_USE_SIGNER'],
+        permanent=app.config['SESSION_PERMANENT'],
+        db=app.config['SESSION_MONGODB_DB'],
+        collection=app.config['SESSION_MONGODB_COLLECT'],
+    )
+    return {
+        'flask-session': MongoDBSessionInterface(app, client=get_client(), **options),
+        'skip-unchanged': CachedMongoDBSessionInterface(app, **options),
+        'skip-unchanged+cache': CachedMongoDBSessionInterface(app, cache_ttl=5, **options),
+    }
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(interface, user, plan, requests):
+    app.session_interface = interface
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = user.id
+        sess['_fresh'] = True
+
+    session = WorkoutSession(plan_id=plan.id, user_id=user.id).save()
+    form = {
+        'session_id': session.id,
+        'exercise_key': 'squats',
+        'sets_completed[]': ['true', 'true', 'true'],
+        'reps_completed[]': ['5', '5', '5'],
+        'weights_used[]': ['100', '100', '100'],
+    }
+
+    timings = {'/dashboard': [], '/complete_exercise': []}
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get('/dashboard')
+        timings['/dashboard'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        client.post('/complete_exercise', data=form)
+        timings['/complete_exercise'].append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=300, help='requests per endpoint and variant')
+    args = parser.parse_args()
+
+    user = User(email=f'bench-{time.time_ns()}@example.com', username='bench').save()
+    plan = WorkoutPlan(name='Bench plan', user_id=user.id,
+                       exercises=[{'exercise_key': 'squats', 'sets': 3, 'reps': 5, 'weight': 100}]).save()
+    try:
+        print(f"{'variant':<22}{'endpoint':<22}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        baseline = {}
+        for name, interface in build_interfaces().items():
+            for endpoint, samples in run(interface, user, plan, args.requests).items():
+                mean = statistics.mean(samples) * 1000
+                baseline.setdefault(endpoint, mean)
+                saved = baseline[endpoint] - mean
+                print(f"{name:<22}{endpoint:<22}{mean:>10.2f}{percentile(samples, 0.5) * 1000:>10.2f}"
+                      f"{percentile(samples, 0.95) * 1000:>10.2f}   saved {saved:.2f} ms/request")
+            if hasattr(interface, 'stats'):
+                print(f"{'':<22}session store: {interface.stats()}")
+    finally:
+        db.workout_sessions.delete_many({"user_id": user.id})
+        db.workout_plans.delete_many({"user_id": user.id})
+        db.user_stats.delete_many({"_id": user.id})
+        db.activity_days.delete_many({"user_id": user.id})
+        db.users.delete_one({"_id": user.id})
+        get_client()[app.config['SESSION_MONGODB_DB']][app.config['SESSION_MONGODB_COLLECT']].delete_many(
+            {"id": {"$regex": "^bench:"}})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Cold-start cost: import time, app build time and time to first request.
+
+In-process mode (the default) runs each sample in a fresh interpreter and
+times `import app`, `create_app()` and the first /health request through the
+Flask test client. Add --gunicorn to also boot gunicorn (sync workers)
+with and without GUNICORN_PRELOAD and time launch to first /health
+response. Both use the database in MONGODB_URI.
+
+    SESSION_SECRET=bench MONGODB_URI=mongodb://localhost:27017/fittracker \\
+        python benchmarks/startup.py --samples 10 --gunicorn
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from concurrency import ROOT, free_port, start_gunicorn  # noqa: E402
+
+# Runs in a fresh interpreter; prints one JSON line of timings in seconds
+PROBE = '''
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+built = time.perf_counter()
+response = application.test_client().get('/health')
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+print(json.dumps({"import": imported - started, "create_app": built - imported,
+                  "first_request": served - built, "total": served - started}))
+'''
+
+
+def probe():
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def boot_gunicorn(preload, workers):
+    os.environ['GUNICORN_PRELOAD'] = '1' if preload else '0'
+    started = time.perf_counter()
+    # The provider port is unused: nothing logs in
+    process = start_gunicorn('sync', free_port(), free_port(), workers, 1)
+    elapsed = time.perf_counter() - started
+    process.terminate()
+    process.wait()
+    return elapsed
+
+
+def summary(samples):
+    return f"{statistics.median(samples) * 1000:>10.1f}{max(samples) * 1000:>10.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=10, help='fresh processes per measurement')
+    parser.add_argument('--gunicorn', action='store_true', help='also time gunicorn boot to first /health')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    runs = [probe() for _ in range(args.samples)]
+    print(f"{args.samples} samples{'':<14}{'p50 ms':>10}{'max ms':>10}")
+    for phase in ('import', 'create_app', 'first_request', 'total'):
+        print(f"{phase:<24}{summary([run[phase] for run in runs])}")
+
+    if args.gunicorn:
+        for preload in (False, True):
+            boots = [boot_gunicorn(preload, args.workers) for _ in range(args.samples)]
+            label = f"gunicorn {'preload' if preload else 'no preload'}"
+            print(f"{label:<24}{summary(boots)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""Seeded synthetic users, plans and years of workout history.
+
+The same --seed and --end always produce the same documents (ids
+included). Lifts progress over time with noise and deload weeks, and a few
+sessions are left unfinished, so the history looks like real logging. The
+derived collections (stats, activity days, personal records, data versions)
+are rebuilt from it with the models' own rebuild functions.
+
+Users are synthetic-<n>@bench.test; benchmarks/runner.py logs in as them.
+
+    MONGODB_URI=mongodb://localhost:27017/fittracker \\
+        python benchmarks/synthetic.py --users 50 --years 3 --seed 1 --replace
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import get_catalog  # noqa: E402
+from database import db  # noqa: E402
+from models import ActivityIndex, PersonalRecords, UserStats  # noqa: E402
+
+EMAIL_DOMAIN = 'bench.test'
+EMAIL_PATTERN = rf'^synthetic-\d+@{EMAIL_DOMAIN}$'
+LEVELS = ['beginner', 'intermediate', 'advanced']
+# Starting working weight (kg) by equipment, before the user's strength factor
+BASE_WEIGHT = {'Barbell': 60, 'Dumbbells': 14}
+
+
+def synthetic_email(n):
+    return f'synthetic-{n}@{EMAIL_DOMAIN}'
+
+
+def round_weight(weight, step=2.5):
+    return round(weight / step) * step
+
+
+class Generator:
+    def __init__(self, seed, end, catalog=None):
+        self.rng = random.Random(seed)
+        self.end = datetime(end.year, end.month, end.day)
+        self.catalog = catalog or get_catalog()
+
+    def new_id(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def user(self, n):
+        level = self.rng.choice(LEVELS)
+        return {
+            "_id": self.new_id(),
+            "email": synthetic_email(n),
+            "username": f"Synthetic {n}",
+            "google_id": None,
+            "fitness_level": level,
+            "created_at": self.end - timedelta(days=self.rng.randint(400, 1500)),
+            "version": 1
+        }
+
+    def plans(self, user):
+        keys = list(self.catalog.exercises)
+        plans = []
+        for i in range(self.rng.randint(2, 4)):
+            exercises = [
+                {'exercise_key': key, 'sets': self.rng.randint(3, 5), 'reps': self.rng.choice([5, 8, 10, 12]),
+                 'weight': 0}
+                for key in self.rng.sample(keys, min(len(keys), self.rng.randint(3, 6)))
+            ]
+            plans.append({
+                "_id": self.new_id(),
+                "name": f"Plan {chr(ord('A') + i)}",
+                "user_id": user["_id"],
+                "exercises": exercises,
+                "level": user["fitness_level"],
+                "created_at": user["created_at"] + timedelta(days=i)
+            })
+        return plans
+
+    def sessions(self, user, plans, years, per_week):
+        """A user's sessions over the last `years`, oldest first"""
+        strength = {'beginner': 0.6, 'intermediate': 1.0, 'advanced': 1.5}[user["fitness_level"]]
+        # Working weight per exercise, grown a little after every session that trains it
+        working = {}
+        days = int(years * 365)
+        start = self.end - timedelta(days=days)
+        day = 0
+        sessions = []
+        while day < days:
+            day += max(1, round(self.rng.expovariate(per_week / 7)))
+            if day >= days:
+                break
+            begin = start + timedelta(days=day, hours=self.rng.randint(6, 20), minutes=self.rng.randint(0, 59))
+            plan = self.rng.choice(plans)
+            deload = begin.isocalendar()[1] % 6 == 0
+
+            exercises = []
+            minutes = 0
+            for planned in plan["exercises"]:
+                if self.rng.random() < 0.1:
+                    continue
+                key = planned['exercise_key']
+                exercise = self.catalog.get(key) or {}
+                base = BASE_WEIGHT.get(exercise.get('equipment'), 0)
+                weight = working.setdefault(key, base * strength)
+                if weight:
+                    working[key] = weight * (1 + self.rng.uniform(0, 0.012))
+                    weight = round_weight(weight * (0.8 if deload else 1) * self.rng.uniform(0.95, 1.03))
+                sets = []
+                for _ in range(planned['sets']):
+                    reps = max(1, planned['reps'] + self.rng.randint(-2, 1) - len(sets) // 2)
+                    sets.append({'reps': reps, 'weight': weight})
+                exercises.append({'exercise_key': key, 'sets': sets})
+                minutes += len(sets) * self.rng.uniform(2.5, 4.5)
+
+            # About 1% of sessions were abandoned without finishing
+            unfinished = self.rng.random() < 0.01
+            end_time = None if unfinished else begin + timedelta(minutes=max(15, minutes))
+            sessions.append({
+                "_id": self.new_id(),
+                "plan_id": plan["_id"],
+                "user_id": user["_id"],
+                "start_time": begin,
+                "end_time": end_time,
+                "exercises_completed": exercises,
+                "notes": "",
+                "volume_by_exercise": {
+                    e['exercise_key']: PersonalRecords.volume(e['sets'])
+                    for e in exercises if PersonalRecords.is_trackable(e['exercise_key'])
+                }
+            })
+        return sessions
+
+
+def remove_synthetic():
+    user_ids = [u["_id"] for u in db.users.find({"email": {"$regex": EMAIL_PATTERN}}, {"_id": 1})]
+    for collection in ('workout_sessions', 'workout_plans', 'activity_days'):
+        db[collection].delete_many({"user_id": {"$in": user_ids}})
+    for collection in ('user_stats', 'personal_records', 'data_versions', 'training_reports', 'users'):
+        db[collection].delete_many({"_id": {"$in": user_ids}})
+    return len(user_ids)
+
+
+def generate(users=20, years=2.0, per_week=3.5, seed=1, end=None, log=print):
+    """Insert `users` synthetic users with their history; returns document counts"""
+    generator = Generator(seed, end or date.today())
+    counts = {'users': 0, 'plans': 0, 'sessions': 0, 'sets': 0}
+    for n in range(users):
+        user = generator.user(n)
+        plans = generator.plans(user)
+        sessions = generator.sessions(user, plans, years, per_week)
+        db.users.insert_one(user)
+        db.workout_plans.insert_many(plans)
+        if sessions:
+            db.workout_sessions.insert_many(sessions)
+        UserStats.rebuild(user["_id"])
+        ActivityIndex.rebuild(user["_id"])
+        PersonalRecords.rebuild(user["_id"])
+
+        counts['users'] += 1
+        counts['plans'] += len(plans)
+        counts['sessions'] += len(sessions)
+        counts['sets'] += sum(len(e['sets']) for s in sessions for e in s['exercises_completed'])
+        log(f"{user['email']}: {len(sessions)} sessions")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--years', type=float, default=2.0, help='history length per user')
+    parser.add_argument('--per-week', type=float, default=3.5, help='average sessions per week')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--end', type=date.fromisoformat, default=date.today(),
+                        help='last day of history (YYYY-MM-DD); fix it to reproduce a dataset exactly')
+    parser.add_argument('--replace', action='store_true', help='remove existing synthetic users first')
+    args = parser.parse_args()
+
+    if args.replace:
+        print(f"Removed {remove_synthetic()} synthetic users")
+    started = time.perf_counter()
+    counts = generate(args.users, args.years, args.per_week, args.seed, args.end, log=lambda line: None)
+    print(f"Generated {counts['users']} users, {counts['plans']} plans, {counts['sessions']} sessions, "
+          f"{counts['sets']} sets in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Vectorized training-load analytics (analytics.py) against per-set Python loops.
+
+Generates synthetic session histories in memory (no database needed),
+computes weekly volume per muscle group, 7/28-day acute:chronic load and
+session density both ways, checks that the results agree and prints timings.
+
+    python benchmarks/training_load.py --users 200 --sessions 100 --sets 8
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import (ACUTE_DAYS, CHRONIC_DAYS, REPORT_WEEKS, SetTable,  # noqa: E402
+                       day_number, training_reports)
+from catalog import ExerciseCatalog  # noqa: E402
+
+
+def synthetic_catalog(size=200):
+    muscles = ['Chest', 'Back', 'Shoulders', 'Quadriceps', 'Hamstrings', 'Glutes', 'Core', 'Biceps', 'Triceps']
+    rng = random.Random(1)
+    return ExerciseCatalog({
+        f'exercise_{i}': {
+            'name': f'Exercise {i}',
+            'muscle_groups': rng.sample(muscles, rng.randint(1, 3)),
+            'equipment': 'Barbell',
+            'description': ''
+        }
+        for i in range(size)
+    })
+
+
+def synthetic_sessions(users, sessions_per_user, sets_per_session, catalog, today, seed=42):
+    rng = random.Random(seed)
+    keys = list(catalog.exercises)
+    end = datetime(today.year, today.month, today.day, 20)
+    for u in range(users):
+        for s in range(sessions_per_user):
+            end_time = end - timedelta(days=rng.randint(0, 180), minutes=rng.randint(0, 600))
+            exercises = []
+            for _ in range(max(1, sets_per_session // 4)):
+                exercises.append({
+                    'exercise_key': rng.choice(keys),
+                    'sets': [{'reps': rng.randint(1, 12), 'weight': rng.choice([0, 20, 45, 60, 100, 135])}
+                             for _ in range(4)]
+                })
+            yield {
+                '_id': f'{u}-{s}',
+                'user_id': f'user-{u}',
+                'start_time': end_time - timedelta(minutes=rng.randint(20, 90)),
+                'end_time': end_time,
+                'exercises_completed': exercises
+            }
+
+
+def loop_reports(sessions, catalog, today, weeks=REPORT_WEEKS):
+    """The same metrics the way the routes computed volume: Python loops over every set"""
+    today_number = day_number(today)
+    current_week = today_number - (today_number + 3) % 7
+    daily = {}
+    muscle_volume = {}
+    density = {}
+
+    for session in sessions:
+        user_id = session['user_id']
+        day = day_number(session['end_time'])
+        volume = sum(s['reps'] * s['weight'] for exercise in session['exercises_completed'] for s in exercise['sets'])
+        daily.setdefault(user_id, {})
+        daily[user_id][day] = daily[user_id].get(day, 0) + volume
+
+        minutes = (session['end_time'] - session['start_time']).total_seconds() / 60
+        if minutes > 0 and day > today_number - CHRONIC_DAYS:
+            density.setdefault(user_id, []).append(volume / minutes)
+
+        week = (current_week - (day - (day + 3) % 7)) // 7
+        if 0 <= week < weeks:
+            for exercise in session['exercises_completed']:
+                exercise_volume = sum(s['reps'] * s['weight'] for s in exercise['sets'])
+                for muscle in catalog.get(exercise['exercise_key'])['muscle_groups']:
+                    key = (user_id, week, muscle)
+                    muscle_volume[key] = muscle_volume.get(key, 0) + exercise_volume
+
+    reports = {}
+    for user_id, days in daily.items():
+        acute = sum(days.get(today_number - i, 0) for i in range(ACUTE_DAYS)) / ACUTE_DAYS
+        chronic = sum(days.get(today_number - i, 0) for i in range(CHRONIC_DAYS)) / CHRONIC_DAYS
+        values = density.get(user_id)
+        reports[user_id] = {
+            'acute_load': acute,
+            'chronic_load': chronic,
+            'session_density': sum(values) / len(values) if values else None,
+            'muscle_volume': {(w, m): v for (u, w, m), v in muscle_volume.items() if u == user_id}
+        }
+    return reports
+
+
+def check(vectorized, looped):
+    for user_id, expected in looped.items():
+        report = vectorized[user_id]
+        assert np.isclose(report['acute_load'], expected['acute_load'], atol=0.01), user_id
+        assert np.isclose(report['chronic_load'], expected['chronic_load'], atol=0.01), user_id
+        if expected['session_density'] is not None:
+            assert np.isclose(report['session_density'], expected['session_density'], atol=0.01), user_id
+        total = sum(sum(week.values()) for week in report['weekly_muscle_volume'].values())
+        assert np.isclose(total, sum(expected['muscle_volume'].values()), rtol=1e-6), user_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--sessions', type=int, default=100, help='sessions per user')
+    parser.add_argument('--sets', type=int, default=8, help='sets per session')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    catalog = synthetic_catalog()
+    today = datetime.utcnow().date()
+    sessions = list(synthetic_sessions(args.users, args.sessions, args.sets, catalog, today))
+    total_sets = sum(len(e['sets']) for s in sessions for e in s['exercises_completed'])
+    print(f"{args.users} users, {len(sessions)} sessions, {total_sets} sets")
+
+    def best_of(fn):
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = fn()
+            timings.append(time.perf_counter() - start)
+        return min(timings), result
+
+    flatten_time, table = best_of(lambda: SetTable.from_sessions(sessions))
+    numpy_time, vectorized = best_of(lambda: training_reports(table, today, catalog=catalog))
+    loop_time, looped = best_of(lambda: loop_reports(sessions, catalog, today))
+    check(vectorized, looped)
+
+    print(f"{'python loops':<28}{loop_time * 1000:>10.1f} ms")
+    print(f"{'numpy (metrics only)':<28}{numpy_time * 1000:>10.1f} ms   {loop_time / numpy_time:.1f}x")
+    print(f"{'numpy (flatten + metrics)':<28}{(flatten_time + numpy_time) * 1000:>10.1f} ms   "
+          f"{loop_time / (flatten_time + numpy_time):.1f}x")
+    print("results match")
+
+
+if __name__ == '__main__':
+    main()
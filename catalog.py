@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import Counter
+
+from database import db
+
+# Where the exercise catalog is loaded from: "file" (CATALOG_PATH) or "mongo"
+# (the `exercises` collection, keyed by _id)
+CATALOG_SOURCE = os.environ.get("CATALOG_SOURCE", "file")
+CATALOG_PATH = os.environ.get(
+    "CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'exercises.json'))
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return WORD_PATTERN.findall((text or '').lower())
+
+
+class ExerciseCatalog:
+    """Read-only exercise catalog with precomputed inverted indexes.
+
+    Built once per process; lookups by muscle group, equipment and name
+    prefix are set intersections, so a search costs roughly the size of the
+    result rather than the size of the catalog. `version` is a hash of the
+    catalog contents and changes whenever an exercise does, so clients and
+    templates can key their caches on it.
+    """
+
+    def __init__(self, exercises):
+        # key -> {'name', 'description', 'equipment', 'muscle_groups', 'image'}, ordered by name
+        self.exercises = dict(sorted(exercises.items(), key=lambda item: (item[1]['name'].lower(), item[0])))
+        self.version = hashlib.sha1(
+            json.dumps(self.exercises, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+        self._rank = {key: i for i, key in enumerate(self.exercises)}
+        self.by_muscle = {}
+        self.by_equipment = {}
+        self.by_prefix = {}
+        for key, exercise in self.exercises.items():
+            for muscle in exercise.get('muscle_groups', []):
+                self.by_muscle.setdefault(muscle, set()).add(key)
+            if exercise.get('equipment'):
+                self.by_equipment.setdefault(exercise['equipment'], set()).add(key)
+            for word in set(tokenize(exercise['name'])):
+                for end in range(1, len(word) + 1):
+                    self.by_prefix.setdefault(word[:end], set()).add(key)
+        self._all_facets = {
+            'muscle_groups': {muscle: len(matches) for muscle, matches in sorted(self.by_muscle.items())},
+            'equipment': {name: len(matches) for name, matches in sorted(self.by_equipment.items())}
+        }
+
+    @classmethod
+    def from_file(cls, path=CATALOG_PATH):
+        with open(path) as f:
+            items = json.load(f)
+        return cls({item['key']: {k: v for k, v in item.items() if k != 'key'} for item in items})
+
+    @classmethod
+    def from_mongo(cls):
+        return cls({
+            document.pop('_id'): document
+            for document in db.exercises.find()
+        })
+
+    def __contains__(self, key):
+        return key in self.exercises
+
+    def __len__(self):
+        return len(self.exercises)
+
+    def get(self, key):
+        return self.exercises.get(key)
+
+    def subset(self, keys):
+        """The exercises for the given keys, e.g. just the ones in a workout plan"""
+        return {key: self.exercises[key] for key in keys if key in self.exercises}
+
+    def facets(self, keys=None):
+        """Muscle group and equipment counts, over `keys` or the whole catalog"""
+        if keys is None:
+            return self._all_facets
+
+        muscles = Counter()
+        equipment = Counter()
+        for key in keys:
+            exercise = self.exercises[key]
+            muscles.update(exercise.get('muscle_groups', []))
+            if exercise.get('equipment'):
+                equipment[exercise['equipment']] += 1
+        return {'muscle_groups': dict(sorted(muscles.items())), 'equipment': dict(sorted(equipment.items()))}
+
+    def search(self, q=None, muscles=(), equipment=(), page=1, per_page=24):
+        """Filter by name prefix, muscle groups and equipment, ordered by name.
+
+        Every word of `q` must prefix a word of the exercise name. Several
+        muscles or equipment values match any of them; different filters
+        must all match. Facet counts are computed over the full result set.
+        """
+        candidates = None
+        for word in tokenize(q):
+            candidates = self._intersect(candidates, self.by_prefix.get(word, ()))
+        if muscles:
+            candidates = self._intersect(candidates, set().union(*(self.by_muscle.get(m, ()) for m in muscles)))
+        if equipment:
+            candidates = self._intersect(candidates, set().union(*(self.by_equipment.get(e, ()) for e in equipment)))
+
+        if candidates is None:
+            keys, facets = list(self.exercises), self._all_facets
+        else:
+            keys = sorted(candidates, key=self._rank.__getitem__)
+            facets = self.facets(keys)
+
+        start = (page - 1) * per_page
+        return {
+            'version': self.version,
+            'total': len(keys),
+            'page': page,
+            'per_page': per_page,
+            'results': [dict(self.exercises[key], key=key) for key in keys[start:start + per_page]],
+            'facets': facets
+        }
+
+    @staticmethod
+    def _intersect(candidates, matches):
+        if candidates is None:
+            return set(matches)
+        return candidates.intersection(matches)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """The process-wide catalog, loaded on first use"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = ExerciseCatalog.from_mongo() if CATALOG_SOURCE == "mongo" else ExerciseCatalog.from_file()
+    return _catalog
+
+
+def reload_catalog():
+    """Drop the loaded catalog so the next get_catalog() reads the source again"""
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
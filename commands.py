@@ -0,0 +1,209 @@
+"""`flask` commands for maintenance and background work, added to the app by create_app()."""
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+@click.command('ensure-indexes')
+@with_appcontext
+def ensure_indexes_command():
+    """Create the MongoDB indexes declared in models.py, jobs.py and leaderboard.py (idempotent)."""
+    from models import INDEXES, ensure_indexes
+    created = ensure_indexes()
+    for collection in INDEXES:
+        names = created.get(collection)
+        click.echo(f"{collection}: {'created ' + ', '.join(names) if names else 'up to date'}")
+
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans():
+    """Explain every query a scripted session runs and fail on collection scans or in-memory sorts.
+
+    Creates and removes its own user; run it against a scratch database.
+    """
+    from query_plans import run_check
+    problems = run_check(current_app._get_current_object(), log=click.echo)
+    if problems:
+        raise SystemExit(1)
+
+@click.command('rebuild-stats')
+@click.option('--user-id', help='Only rebuild stats for this user.')
+@with_appcontext
+def rebuild_stats(user_id):
+    """Recompute dashboard stats from raw plans and sessions."""
+    from models import UserStats
+    if user_id:
+        UserStats.rebuild(user_id)
+        click.echo(f"Rebuilt stats for user {user_id}")
+    else:
+        count = UserStats.rebuild_all()
+        click.echo(f"Rebuilt stats for {count} users")
+
+@click.command('rebuild-records')
+@click.option('--user-id', help='Only rebuild records for this user.')
+@with_appcontext
+def rebuild_records(user_id):
+    """Backfill the personal record index from logged sessions."""
+    from models import PersonalRecords
+    if user_id:
+        PersonalRecords.rebuild(user_id)
+        click.echo(f"Rebuilt records for user {user_id}")
+    else:
+        count = PersonalRecords.rebuild_all()
+        click.echo(f"Rebuilt records for {count} users")
+
+@click.command('training-report')
+@click.option('--batch-size', default=500, show_default=True, help='Users loaded and computed per batch.')
+@with_appcontext
+def training_report(batch_size):
+    """Nightly job: write every user's training-load report to `training_reports`."""
+    from analytics import write_nightly_reports
+    count = write_nightly_reports(batch_size=batch_size)
+    click.echo(f"Wrote training reports for {count} users")
+
+@click.command('import-exercises')
+@click.option('--path', help='Catalog JSON file (defaults to CATALOG_PATH).')
+@with_appcontext
+def import_exercises(path):
+    """Load the exercise catalog file into the `exercises` collection (for CATALOG_SOURCE=mongo)."""
+    from pymongo import ReplaceOne
+    from catalog import CATALOG_PATH, ExerciseCatalog
+    from database import db
+    catalog = ExerciseCatalog.from_file(path or CATALOG_PATH)
+    db.exercises.bulk_write([
+        ReplaceOne({"_id": key}, exercise, upsert=True) for key, exercise in catalog.exercises.items()
+    ])
+    click.echo(f"Imported {len(catalog)} exercises (catalog version {catalog.version})")
+
+@click.command('export-history')
+@click.option('--user-id', help='Export this user only (default: every user, with a user_id column).')
+@click.option('--email', help='Export the user with this email.')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson', show_default=True)
+@click.option('--output', '-o', default='-', help='File to write (default: stdout).')
+@with_appcontext
+def export_history(user_id, email, fmt, output):
+    """Stream workout history as NDJSON (a session per line) or CSV (a set per row)."""
+    import time
+    import history
+    from models import User
+    if email:
+        user = User.get_by_email(email)
+        if not user:
+            raise click.BadParameter(f"no user with email {email}", param_hint='--email')
+        user_id = user.id
+    started = time.perf_counter()
+    written = 0
+    with click.open_file(output, 'w', encoding='utf-8') as f:
+        for chunk in history.export(fmt, user_id):
+            f.write(chunk)
+            written += len(chunk)
+    click.echo(f"Exported {written / 1e6:.1f} MB in {time.perf_counter() - started:.1f}s", err=True)
+
+@click.command('import-history')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--user-id', help='Import into this user.')
+@click.option('--email', help='Import into the user with this email.')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']),
+              help='Input format (default: from the file extension, else ndjson).')
+@click.option('--batch-size', type=int, help='Sessions per insert_many (default: IMPORT_BATCH_SIZE).')
+@with_appcontext
+def import_history(path, user_id, email, fmt, batch_size):
+    """Validate and bulk insert sessions from an export-history file, reporting throughput."""
+    import history
+    from models import User
+    user = User.get_by_email(email) if email else User.get(user_id) if user_id else None
+    if not user:
+        raise click.UsageError("pass --user-id or --email of an existing user")
+    fmt = fmt or ('csv' if path.endswith('.csv') else 'ndjson')
+
+    def progress(report):
+        click.echo(f"  {report['imported']} sessions imported, {report['invalid']} invalid", err=True)
+
+    with click.open_file(path, 'r', encoding='utf-8-sig') as f:
+        report = history.import_sessions(user.id, history.read(fmt, f),
+                                         batch_size=batch_size or history.IMPORT_BATCH_SIZE, progress=progress)
+    click.echo(f"Imported {report['imported']} sessions ({report['sets']} sets) in {report['seconds']}s "
+               f"({report['sessions_per_second']} sessions/s); {report['duplicates']} already present, "
+               f"{report['invalid']} invalid of {report['read']} read")
+    for error in report['errors']:
+        click.echo(f"  line {error['line']}: {error['error']}")
+
+@click.command('archive-sessions')
+@click.option('--older-than-days', type=int,
+              help='Archive sessions started before the month this many days ago (default: ARCHIVE_AFTER_DAYS).')
+@click.option('--user-id', help='Only archive this user\'s sessions.')
+@with_appcontext
+def archive_sessions(older_than_days, user_id):
+    """Compact old sessions into per-user monthly buckets in `workout_archive`."""
+    import time
+    from models import SessionArchive
+    started = time.perf_counter()
+    try:
+        totals = SessionArchive.archive(older_than_days, user_id=user_id)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--older-than-days')
+    click.echo(f"Archived {totals['sessions']} sessions started before {totals['cutoff'][:10]} into "
+               f"{totals['buckets']} buckets for {totals['users']} users in {time.perf_counter() - started:.1f}s")
+    stats = SessionArchive.stats(user_id)
+    if stats['raw_bytes']:
+        click.echo(f"Archive: {stats['sessions']} sessions in {stats['buckets']} buckets, "
+                   f"{stats['raw_bytes'] / 1e6:.2f} MB of sessions stored in {stats['compressed_bytes'] / 1e6:.2f} MB")
+
+@click.command('restore-sessions')
+@click.option('--user-id', required=True, help='Restore this user\'s archived sessions.')
+@with_appcontext
+def restore_sessions(user_id):
+    """Move a user's archived sessions back into `workout_sessions`."""
+    from models import SessionArchive
+    click.echo(f"Restored {SessionArchive.restore(user_id)} sessions for user {user_id}")
+
+@click.command('compact-leaderboards')
+@click.option('--keep-days', type=int,
+              help='Compact boards that ended more than this many days ago (default: LEADERBOARD_KEEP_DAYS).')
+@with_appcontext
+def compact_leaderboards(keep_days):
+    """Replace finished leaderboards with their final top entries in `leaderboard_results`."""
+    import leaderboard
+    totals = leaderboard.compact(keep_days, log=click.echo)
+    click.echo(f"Compacted {totals['boards']} boards, removing {totals['scores']} score documents")
+
+@click.command('jobs-worker')
+@click.option('--processes', default=2, show_default=True, help='Jobs run in parallel (one process each).')
+@click.option('--burst', is_flag=True, help='Exit once the queue is empty instead of polling.')
+@with_appcontext
+def jobs_worker(processes, burst):
+    """Run queued background jobs from the `jobs` collection (see jobs.py)."""
+    import jobs
+    jobs.run_worker(processes=processes, burst=burst, log=click.echo)
+
+@click.command('enqueue-job')
+@click.argument('name')
+@click.option('--user-id', help='Run the job for this user only.')
+@with_appcontext
+def enqueue_job(name, user_id):
+    """Queue a background job: rebuild_stats, rebuild_records, training_report, archive_sessions or compact_leaderboards."""
+    import jobs
+    if name not in jobs.HANDLERS:
+        raise click.BadParameter(f"choose from {', '.join(sorted(jobs.HANDLERS))}", param_hint='NAME')
+    payload = {'user_id': user_id} if user_id else {}
+    job_id = jobs.enqueue(name, payload, user_id=user_id)
+    click.echo(f"Queued {name} as job {job_id}")
+
+COMMANDS = [
+    ensure_indexes_command,
+    check_query_plans,
+    rebuild_stats,
+    rebuild_records,
+    training_report,
+    import_exercises,
+    export_history,
+    import_history,
+    archive_sessions,
+    restore_sessions,
+    compact_leaderboards,
+    jobs_worker,
+    enqueue_job,
+]
+
+def init_app(app):
+    for command in COMMANDS:
+        app.cli.add_command(command)
@@ -0,0 +1,250 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+from pymongo import MongoClient, monitoring
+
+DATABASE_NAME = os.environ.get("MONGODB_DB", "fittracker")
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool counters fed by pymongo's CMAP events.
+
+    Checkout wait times show whether requests queue for a connection
+    (maxPoolSize too small for the worker's concurrency); `in_use` and
+    `open` show how many connections each worker actually needs.
+    """
+
+    # Upper bounds (seconds) of the checkout wait histogram buckets
+    WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checkout_started = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.open = 0
+            self.in_use = 0
+            self.max_in_use = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+            self.wait_buckets = [0] * (len(self.WAIT_BUCKETS) + 1)
+            self.pool_clears = 0
+
+    def connection_check_out_started(self, event):
+        self._checkout_started.value = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._checkout_started, 'value', None)
+        waited = time.perf_counter() - started if started is not None else 0.0
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            for i, bound in enumerate(self.WAIT_BUCKETS):
+                if waited <= bound:
+                    self.wait_buckets[i] += 1
+                    break
+            else:
+                self.wait_buckets[-1] += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self):
+        with self._lock:
+            buckets = {f'le_{bound}': count for bound, count in zip(self.WAIT_BUCKETS, self.wait_buckets)}
+            buckets['le_inf'] = self.wait_buckets[-1]
+            return {
+                'open': self.open,
+                'in_use': self.in_use,
+                'max_in_use': self.max_in_use,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'wait_seconds_total': round(self.wait_seconds_total, 6),
+                'wait_seconds_max': round(self.wait_seconds_max, 6),
+                'wait_buckets': buckets,
+                'pool_clears': self.pool_clears
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+Query = namedtuple('Query', 'command collection shape seconds documents ok')
+
+
+class QueryTracker(monitoring.CommandListener):
+    """Records the commands pymongo runs on behalf of the current request.
+
+    `start()` begins a trace for the calling thread (or greenlet, under
+    gevent) and `stop()` returns it as a list of Query tuples. Commands
+    outside a trace, e.g. from the jobs worker, are not recorded. The
+    `shape` is the command's filter keys, so repeated lookups that differ
+    only in their values (an N+1 pattern) compare equal.
+    """
+
+    IGNORED = {'hello', 'isMaster', 'ismaster', 'ping', 'buildInfo', 'endSessions',
+               'saslStart', 'saslContinue', 'killCursors'}
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def start(self):
+        self._local.pending = {}
+        self._local.queries = []
+
+    def current(self):
+        """The calling request's commands so far"""
+        return list(getattr(self._local, 'queries', None) or [])
+
+    def stop(self):
+        queries = getattr(self._local, 'queries', None) or []
+        self._local.pending = None
+        self._local.queries = None
+        return queries
+
+    @staticmethod
+    def _filter(command_name, command):
+        if command_name in ('find', 'count', 'distinct'):
+            return command.get('filter') or command.get('query')
+        if command_name == 'findAndModify':
+            return command.get('query')
+        if command_name == 'aggregate':
+            first = (command.get('pipeline') or [{}])[0]
+            return first.get('$match')
+        if command_name in ('update', 'delete'):
+            statements = command.get(command_name + 's') or [{}]
+            return statements[0].get('q')
+        return None
+
+    @staticmethod
+    def _documents(command_name, reply):
+        cursor = reply.get('cursor')
+        if cursor:
+            return len(cursor.get('firstBatch') or cursor.get('nextBatch') or [])
+        if command_name == 'findAndModify':
+            return 1 if reply.get('value') else 0
+        return 0
+
+    def started(self, event):
+        pending = getattr(self._local, 'pending', None)
+        if pending is None or event.command_name in self.IGNORED:
+            return
+        command = event.command
+        collection = command.get(event.command_name)
+        if event.command_name == 'getMore':
+            collection = command.get('collection')
+        query_filter = self._filter(event.command_name, command)
+        shape = tuple(sorted(query_filter)) if isinstance(query_filter, dict) else ()
+        pending[event.request_id] = (event.command_name, collection if isinstance(collection, str) else None, shape)
+
+    def _finish(self, event, documents, ok):
+        pending = getattr(self._local, 'pending', None)
+        started = pending.pop(event.request_id, None) if pending is not None else None
+        if started is None:
+            return
+        command_name, collection, shape = started
+        self._local.queries.append(Query(command_name, collection, shape, event.duration_micros / 1e6, documents, ok))
+
+    def succeeded(self, event):
+        self._finish(event, self._documents(event.command_name, event.reply), True)
+
+    def failed(self, event):
+        self._finish(event, 0, False)
+
+query_tracker = QueryTracker()
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def client_options():
+    """MongoClient pool, timeout and read preference settings from the environment"""
+    return {
+        'maxPoolSize': int(os.environ.get("MONGO_MAX_POOL_SIZE", 50)),
+        'minPoolSize': int(os.environ.get("MONGO_MIN_POOL_SIZE", 0)),
+        'waitQueueTimeoutMS': int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000)),
+        'serverSelectionTimeoutMS': int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)),
+        'connectTimeoutMS': int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", 5000)),
+        'socketTimeoutMS': int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", 30000)),
+        'readPreference': os.environ.get("MONGO_READ_PREFERENCE", "primary"),
+    }
+
+
+def get_client():
+    """The process-wide MongoClient, created on first use.
+
+    The client is keyed on the process id, so a client created before
+    gunicorn forks is never shared with the workers: each worker builds its
+    own pool the first time it touches the database.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                if _client_pid != pid:
+                    pool_metrics.reset()
+                _client = MongoClient(
+                    os.environ.get("MONGODB_URI"),
+                    connect=False,
+                    event_listeners=[pool_metrics, query_tracker],
+                    **client_options()
+                )
+                _client_pid = pid
+    return _client
+
+
+def get_db():
+    return get_client()[DATABASE_NAME]
+
+
+class LazyDatabase:
+    """Module-level stand-in for the Database so `db.users` etc. resolve per process"""
+
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
+
+db = LazyDatabase()
@@ -1,45 +1,156 @@
 import json
+import logging
 import os
+import re
+import threading
+import time
 
+import jwt
 import requests
 from flask import Blueprint, redirect, request, url_for, flash
 from flask_login import login_user, logout_user, login_required
 from models import User
 from oauthlib.oauth2 import WebApplicationClient
 
+logger = logging.getLogger(__name__)
+
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_OAUTH_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_OAUTH_CLIENT_SECRET") 
-GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
+GOOGLE_DISCOVERY_URL = os.environ.get(
+    "GOOGLE_DISCOVERY_URL", "https://accounts.google.com/.well-known/openid-configuration"
+)
+
+# (connect, read) timeouts for every call to the identity provider
+HTTP_TIMEOUT = (3.05, 10)
+# Used when a provider response carries no Cache-Control max-age
+DEFAULT_CACHE_SECONDS = 3600
+# Allowed clock skew when checking ID token timestamps
+CLOCK_SKEW_SECONDS = 60
 
 # Make sure to use this redirect URL. It has to match the one in the whitelist
 DEV_REDIRECT_URL = f'https://{os.environ.get("REPLIT_DEV_DOMAIN", "localhost")}/google_login/callback'
 
-# ALWAYS display setup instructions to the user:
-print(f"""To make Google authentication work:
+
+def setup_instructions():
+    """How to register the OAuth client; shown by the dev server and when login isn't configured"""
+    return f"""To make Google authentication work:
 1. Go to https://console.cloud.google.com/apis/credentials
 2. Create a new OAuth 2.0 Client ID
 3. Add {DEV_REDIRECT_URL} to Authorized redirect URIs
 
 For detailed instructions, see:
 https://docs.replit.com/additional-resources/google-auth-in-flask#set-up-your-oauth-app--client
-""")
+"""
+
+
+_client = None
+
+
+def oauth_client():
+    """Client used to build login redirects, created on first use; None without GOOGLE_OAUTH_CLIENT_ID"""
+    global _client
+    if _client is None and GOOGLE_CLIENT_ID:
+        _client = WebApplicationClient(GOOGLE_CLIENT_ID)
+    return _client
 
-if GOOGLE_CLIENT_ID:
-    client = WebApplicationClient(GOOGLE_CLIENT_ID)
-else:
-    client = None
 
 google_auth = Blueprint("google_auth", __name__)
 
+_http = None
+_http_pid = None
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def http_session():
+    """Pooled HTTP session (one per process) so provider calls reuse TLS connections"""
+    global _http, _http_pid
+    if _http is None or _http_pid != os.getpid():
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=1)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _http, _http_pid = session, os.getpid()
+    return _http
+
+
+def cache_seconds(response):
+    """Freshness lifetime from Cache-Control (max-age minus Age), 0 for no-store/no-cache"""
+    cache_control = response.headers.get("Cache-Control", "").lower()
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return 0
+    match = re.search(r"max-age=(\d+)", cache_control)
+    if not match:
+        return DEFAULT_CACHE_SECONDS
+    return max(0, int(match.group(1)) - int(response.headers.get("Age", 0) or 0))
+
+
+def fetch_json(url, force=False):
+    """GET a provider document, served from the in-process cache while fresh"""
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(url)
+    if cached and not force and cached[1] > now:
+        return cached[0]
+
+    response = http_session().get(url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    document = response.json()
+    with _cache_lock:
+        _cache[url] = (document, now + cache_seconds(response))
+    return document
+
+
+def get_google_provider_cfg():
+    return fetch_json(GOOGLE_DISCOVERY_URL)
+
+
+def find_signing_key(jwks_uri, kid):
+    # Refetch once on an unknown kid, which is how key rotation shows up
+    for force in (False, True):
+        for key in fetch_json(jwks_uri, force=force).get("keys", []):
+            if key.get("kid") == kid and key.get("kty") == "RSA":
+                return key
+    return None
+
+
+def verify_id_token(id_token, provider_cfg):
+    """Verify an RS256 ID token against the provider's cached JWKS.
+
+    Returns the token claims, or None if the signature, issuer, audience or
+    lifetime does not check out (callers then fall back to userinfo).
+    """
+    issuer = provider_cfg.get("issuer")
+    if not issuer or not GOOGLE_CLIENT_ID:
+        return None
+    try:
+        key = find_signing_key(provider_cfg["jwks_uri"], jwt.get_unverified_header(id_token).get("kid"))
+        if not key:
+            return None
+        return jwt.decode(
+            id_token,
+            jwt.PyJWK(key, algorithm="RS256"),
+            algorithms=["RS256"],
+            audience=GOOGLE_CLIENT_ID,
+            # Google issues tokens with and without the scheme
+            issuer=[issuer, issuer.replace("https://", "")],
+            leeway=CLOCK_SKEW_SECONDS,
+            options={"require": ["iss", "aud", "exp", "iat"]},
+        )
+    except (jwt.PyJWTError, KeyError, requests.RequestException):
+        return None
+
 
 @google_auth.route("/google_login")
 def login():
+    client = oauth_client()
     if not client:
+        logger.warning(setup_instructions())
         flash("Google OAuth not configured. Please set up your credentials.", "error")
         return redirect(url_for("main_routes.index"))
         
     try:
-        google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL).json()
+        google_provider_cfg = get_google_provider_cfg()
         authorization_endpoint = google_provider_cfg["authorization_endpoint"]
 
         request_uri = client.prepare_request_uri(
@@ -55,35 +166,46 @@ def login():
 
 @google_auth.route("/google_login/callback")
 def callback():
-    if not client:
+    if not oauth_client():
         flash("Google OAuth not configured.", "error")
         return redirect(url_for("main_routes.index"))
         
     try:
         code = request.args.get("code")
-        google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL).json()
+        # parse_request_body_response stores the token on the client, so each
+        # callback needs its own; a shared one leaks tokens between concurrent logins
+        oauth = WebApplicationClient(GOOGLE_CLIENT_ID)
+        google_provider_cfg = get_google_provider_cfg()
         token_endpoint = google_provider_cfg["token_endpoint"]
 
-        token_url, headers, body = client.prepare_token_request(
+        token_url, headers, body = oauth.prepare_token_request(
             token_endpoint,
             authorization_response=request.url.replace("http://", "https://"),
             redirect_url=request.base_url.replace("http://", "https://"),
             code=code,
         )
-        token_response = requests.post(
+        token_response = http_session().post(
             token_url,
             headers=headers,
             data=body,
             auth=(GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET),
+            timeout=HTTP_TIMEOUT,
         )
 
-        client.parse_request_body_response(json.dumps(token_response.json()))
+        token = token_response.json()
+        oauth.parse_request_body_response(json.dumps(token))
 
-        userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
-        uri, headers, body = client.add_token(userinfo_endpoint)
-        userinfo_response = requests.get(uri, headers=headers, data=body)
+        # The verified ID token already carries the profile claims we need,
+        # which saves the userinfo round trip
+        userinfo = None
+        if token.get("id_token"):
+            userinfo = verify_id_token(token["id_token"], google_provider_cfg)
+        if not userinfo or not userinfo.get("given_name"):
+            userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
+            uri, headers, body = oauth.add_token(userinfo_endpoint)
+            userinfo_response = http_session().get(uri, headers=headers, data=body, timeout=HTTP_TIMEOUT)
+            userinfo = userinfo_response.json()
 
-        userinfo = userinfo_response.json()
         if userinfo.get("email_verified"):
             users_email = userinfo["email"]
             users_name = userinfo["given_name"]
@@ -0,0 +1,72 @@
+"""Gunicorn settings, read from the environment (`gunicorn -c gunicorn.conf.py main:app`).
+
+GUNICORN_WORKER_CLASS=sync (default) runs one request per worker process.
+GUNICORN_WORKER_CLASS=gevent runs up to GUNICORN_WORKER_CONNECTIONS requests
+per worker as greenlets: pymongo and requests (the OAuth calls) both yield on
+socket I/O once the standard library is monkey-patched, so a slow login or a
+large /progress load no longer holds a whole worker. Size
+MONGO_MAX_POOL_SIZE for the concurrent requests that actually hit the
+database; greenlets beyond it wait up to MONGO_WAIT_QUEUE_TIMEOUT_MS for a
+connection. CPU-bound work still blocks a gevent worker, which is why the
+heavy recomputations run in `flask jobs-worker` (see jobs.py).
+
+GUNICORN_PRELOAD=1 builds the app once in the master and forks workers
+from it, so they boot faster and share its memory. This is safe because
+create_app() opens nothing: each worker creates its own MongoClient on first
+use (database.get_client is keyed by pid). The master also loads the
+exercise catalog before forking, so workers inherit it instead of each
+reading it on their first request.
+"""
+import os
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "sync")
+
+if worker_class == "gevent":
+    # Patch before anything imports socket, threading or pymongo. Gunicorn's
+    # gevent worker patches again when it boots, which is a no-op by then.
+    from gevent import monkey
+    monkey.patch_all()
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 4))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 100))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+reuse_port = True
+preload_app = os.environ.get("GUNICORN_PRELOAD", "0") == "1"
+
+
+def when_ready(server):
+    """Apply the declared MongoDB indexes (and, with preload, load the catalog) in the master before forking"""
+    from database import get_client
+    try:
+        if os.environ.get("ENSURE_INDEXES", "1") != "0":
+            _ensure_indexes(server)
+        if preload_app:
+            from catalog import get_catalog
+            server.log.info("Loaded %s exercises before forking", len(get_catalog().exercises))
+    except Exception:
+        server.log.exception("Could not prepare the master; workers will load the catalog themselves")
+    finally:
+        # Workers build their own clients; don't leave this one's threads in the master
+        get_client().close()
+
+
+def _ensure_indexes(server):
+    from models import ensure_indexes
+    try:
+        created = ensure_indexes()
+        for collection, names in created.items():
+            server.log.info("Created indexes on %s: %s", collection, ", ".join(names))
+    except Exception:
+        server.log.exception("Could not apply MongoDB indexes; run `flask ensure-indexes`")
+
+
+def post_worker_init(worker):
+    """Refuse to serve from a gevent worker whose blocking I/O is not cooperative"""
+    if worker_class != "gevent":
+        return
+    from gevent import monkey
+    unpatched = [name for name in ("socket", "ssl", "select", "threading", "time") if not monkey.is_module_patched(name)]
+    if unpatched:
+        raise RuntimeError(f"gevent worker running with unpatched modules: {', '.join(unpatched)}")
+    worker.log.info("gevent worker ready (%s connections)", worker_connections)
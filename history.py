@@ -0,0 +1,386 @@
+"""Streaming export and bulk import of workout history.
+
+Exports walk a batched cursor over a user's sessions, oldest first, and
+yield the output in chunks of about CHUNK_BYTES: one JSON object per
+session for NDJSON, one row per set for CSV. Memory stays flat however long
+the history is. Archived months (models.SessionArchive) are merged in
+by start time, decompressed one bucket at a time. Only the logged
+exercises are exported, not the raw `set_log` or sync bookkeeping.
+
+Imports read the same formats a line at a time, validate every session and
+write each batch with one unordered insert_many. Imported ids are derived
+from the user and the record's id (or its start time), so importing the
+same file twice adds nothing the second time, even once the first copy
+has been archived. The user's stats, activity
+days and records are rebuilt once at the end. /api/import only stores the
+upload in GridFS; the `import_history` job (jobs.py) runs the import.
+"""
+import csv
+import heapq
+import io
+import json
+import math
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from gridfs import GridFSBucket
+from pymongo.errors import BulkWriteError
+
+import jobs
+from database import db, get_db
+from models import PersonalRecords, ProgressSeries, SessionArchive, UserStats
+
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+CSV_FIELDS = ['session_id', 'plan_id', 'start_time', 'end_time', 'notes', 'exercise_key', 'set', 'reps', 'weight']
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 500))
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", 500))
+# Output is yielded in chunks of roughly this size rather than per line
+CHUNK_BYTES = 64 * 1024
+EXPORT_PROJECTION = {"plan_id": 1, "user_id": 1, "start_time": 1, "end_time": 1, "notes": 1, "exercises_completed": 1}
+
+# Sanity bounds for imported values
+MAX_REPS = 1000
+MAX_WEIGHT = 2000
+MAX_NOTES = 10000
+MAX_EXERCISES = 100
+MAX_SETS = 100
+# Shown in an import report; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+# GridFS bucket holding uploads until their import job has run
+UPLOAD_BUCKET = 'history_uploads'
+
+IMPORT_NAMESPACE = uuid.UUID('5b0e4a4e-2f5c-4c55-9a43-5e9f1d7c2a10')
+DUPLICATE_KEY = 11000
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+# Export
+
+def iter_sessions(user_id, batch_size=EXPORT_BATCH_SIZE):
+    """A user's session documents, hot and archived, oldest first; hot ones fetched `batch_size` at a time"""
+    cursor = db.workout_sessions.find({"user_id": user_id}, EXPORT_PROJECTION) \
+        .sort([("start_time", 1), ("_id", 1)]).batch_size(batch_size)
+    try:
+        yield from heapq.merge(SessionArchive.sessions(user_id), cursor, key=lambda s: (s['start_time'], s['_id']))
+    finally:
+        # Release the server cursor when a download is abandoned
+        cursor.close()
+
+
+def export_records(user_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """Session records for one user, or for every user (with `user_id` set on each)"""
+    if user_id:
+        user_ids = [user_id]
+    else:
+        user_ids = (user_data['_id'] for user_data in
+                    db.users.find({}, {"_id": 1}).sort("_id", 1).batch_size(batch_size))
+    for uid in user_ids:
+        for session_data in iter_sessions(uid, batch_size):
+            yield to_record(session_data, include_user=not user_id)
+
+
+def to_record(session_data, include_user=False):
+    record = {'user_id': session_data['user_id']} if include_user else {}
+    record.update({
+        'id': session_data['_id'],
+        'plan_id': session_data.get('plan_id'),
+        'start_time': _format_time(session_data.get('start_time')),
+        'end_time': _format_time(session_data.get('end_time')),
+        'notes': session_data.get('notes', ''),
+        'exercises': [
+            {'exercise_key': exercise.get('exercise_key'),
+             'sets': [{'reps': s.get('reps', 0), 'weight': s.get('weight', 0)} for s in exercise.get('sets', [])]}
+            for exercise in session_data.get('exercises_completed', [])
+        ]
+    })
+    return record
+
+
+def _format_time(value):
+    return value.isoformat() + 'Z' if value else None
+
+
+def ndjson_chunks(records):
+    lines = []
+    size = 0
+    for record in records:
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_BYTES:
+            yield ''.join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield ''.join(lines)
+
+
+def csv_chunks(records, include_user=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow((['user_id'] if include_user else []) + CSV_FIELDS)
+    for record in records:
+        session = ([record['user_id']] if include_user else []) + [
+            record['id'], record['plan_id'] or '', record['start_time'] or '', record['end_time'] or '', record['notes']]
+        rows = [
+            session + [exercise['exercise_key'], number, s['reps'], s['weight']]
+            for exercise in record['exercises'] for number, s in enumerate(exercise['sets'], 1)
+        ]
+        # A session without sets still gets a row, so it survives a round trip
+        writer.writerows(rows or [session + ['', '', '', '']])
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export(fmt, user_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """Generator of text chunks of the history in `fmt` ('ndjson' or 'csv')"""
+    records = export_records(user_id, batch_size)
+    if fmt == 'csv':
+        return csv_chunks(records, include_user=not user_id)
+    return ndjson_chunks(records)
+
+
+# Import
+
+def read_ndjson(lines):
+    """(line number, record, error) per non-blank line"""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line), None
+        except json.JSONDecodeError as e:
+            yield number, None, f"Not valid JSON: {e.msg}"
+
+
+def read_csv(lines):
+    """(line number, record, error) per session, from one row per set.
+
+    Consecutive rows with the same session_id (or start_time, without ids)
+    form one session; consecutive rows with the same exercise_key one
+    exercise. Rows with an empty exercise_key add a session without sets.
+    """
+    reader = csv.DictReader(lines)
+    missing = {'start_time', 'exercise_key', 'reps', 'weight'} - set(reader.fieldnames or [])
+    if missing:
+        yield 1, None, f"Missing CSV columns: {', '.join(sorted(missing))}"
+        return
+
+    current = key = None
+    first_line = error = None
+    for row in reader:
+        row_key = row.get('session_id') or row.get('start_time')
+        if current is None or row_key != key:
+            if current is not None:
+                yield first_line, None if error else current, error
+            key = row_key
+            first_line = reader.line_num
+            error = None
+            current = {
+                'id': row.get('session_id') or None,
+                'plan_id': row.get('plan_id') or None,
+                'start_time': row.get('start_time') or None,
+                'end_time': row.get('end_time') or None,
+                'notes': row.get('notes') or '',
+                'exercises': []
+            }
+        exercise_key = row.get('exercise_key')
+        if not exercise_key or error:
+            continue
+        try:
+            logged = {'reps': int(row['reps']), 'weight': float(row['weight'])}
+        except (TypeError, ValueError):
+            error = f"Line {reader.line_num}: reps and weight must be numbers"
+            continue
+        if not current['exercises'] or current['exercises'][-1]['exercise_key'] != exercise_key:
+            current['exercises'].append({'exercise_key': exercise_key, 'sets': []})
+        current['exercises'][-1]['sets'].append(logged)
+    if current is not None:
+        yield first_line, None if error else current, error
+
+
+def read(fmt, lines):
+    return read_csv(lines) if fmt == 'csv' else read_ndjson(lines)
+
+
+def _parse_time(value, name, required=False):
+    if value in (None, ''):
+        if required:
+            raise InvalidRecord(f"{name} is required")
+        return None
+    if not isinstance(value, str):
+        raise InvalidRecord(f"{name} must be an ISO 8601 string")
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidRecord(f"{name} is not an ISO 8601 time: {value!r}") from None
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _number(value, name, limit, integer=False):
+    # bool is an int subclass; "true" is not a rep count
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise InvalidRecord(f"{name} must be a number")
+    if integer and value != int(value):
+        raise InvalidRecord(f"{name} must be a whole number")
+    if not 0 <= value <= limit:
+        raise InvalidRecord(f"{name} must be between 0 and {limit}")
+    return int(value) if integer else float(value)
+
+
+def session_document(user_id, record, plan_ids=(), now=None):
+    """Validate one imported record and build its workout_sessions document"""
+    if not isinstance(record, dict):
+        raise InvalidRecord("Expected a JSON object per line")
+    now = now or datetime.utcnow()
+    start_time = _parse_time(record.get('start_time'), 'start_time', required=True)
+    end_time = _parse_time(record.get('end_time'), 'end_time')
+    if start_time > now + timedelta(days=1):
+        raise InvalidRecord("start_time is in the future")
+    if end_time and end_time < start_time:
+        raise InvalidRecord("end_time is before start_time")
+    notes = record.get('notes') or ''
+    if not isinstance(notes, str) or len(notes) > MAX_NOTES:
+        raise InvalidRecord(f"notes must be a string of at most {MAX_NOTES} characters")
+
+    exercises = record.get('exercises') or []
+    if not isinstance(exercises, list) or len(exercises) > MAX_EXERCISES:
+        raise InvalidRecord(f"exercises must be a list of at most {MAX_EXERCISES}")
+    exercises_completed = []
+    for exercise in exercises:
+        exercise_key = exercise.get('exercise_key') if isinstance(exercise, dict) else None
+        if not PersonalRecords.is_trackable(exercise_key):
+            raise InvalidRecord(f"Invalid exercise_key: {exercise_key!r}")
+        sets = exercise.get('sets') or []
+        if not isinstance(sets, list) or len(sets) > MAX_SETS:
+            raise InvalidRecord(f"{exercise_key}: sets must be a list of at most {MAX_SETS}")
+        exercises_completed.append({'exercise_key': exercise_key, 'sets': [_parse_set(s) for s in sets]})
+
+    source_id = record.get('id') or start_time.isoformat()
+    if not isinstance(source_id, str):
+        raise InvalidRecord("id must be a string")
+    plan_id = record.get('plan_id')
+
+    volumes = {}
+    for exercise in exercises_completed:
+        volumes[exercise['exercise_key']] = (volumes.get(exercise['exercise_key'], 0)
+                                             + PersonalRecords.volume(exercise['sets']))
+    return {
+        "_id": str(uuid.uuid5(IMPORT_NAMESPACE, f"{user_id}:{source_id}")),
+        # Plans don't travel with the history; keep the link only to one of the user's own plans
+        "plan_id": plan_id if plan_id in plan_ids else None,
+        "user_id": user_id,
+        "start_time": start_time,
+        "end_time": end_time,
+        "exercises_completed": exercises_completed,
+        "notes": notes,
+        "volume_by_exercise": volumes,
+        "imported_at": now
+    }
+
+
+def _parse_set(logged):
+    if not isinstance(logged, dict):
+        raise InvalidRecord("Each set must be an object with reps and weight")
+    return {'reps': _number(logged.get('reps'), 'reps', MAX_REPS, integer=True),
+            'weight': _number(logged.get('weight'), 'weight', MAX_WEIGHT)}
+
+
+def _insert(documents, report):
+    # Earlier imports of old sessions may have been archived since
+    horizon = SessionArchive.horizon()
+    archived = SessionArchive.archived_ids(d['_id'] for d in documents if d['start_time'] < horizon)
+    if archived:
+        report['duplicates'] += len(archived)
+        documents = [document for document in documents if document['_id'] not in archived]
+        if not documents:
+            return
+    inserted = documents
+    try:
+        db.workout_sessions.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(error['code'] != DUPLICATE_KEY for error in errors):
+            raise
+        skipped = {error['index'] for error in errors}
+        inserted = [document for index, document in enumerate(documents) if index not in skipped]
+        report['duplicates'] += len(skipped)
+    report['imported'] += len(inserted)
+    report['sets'] += sum(len(e['sets']) for document in inserted for e in document['exercises_completed'])
+
+
+def import_sessions(user_id, records, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """Validate and insert (line number, record, error) tuples from read(); returns a report.
+
+    The report counts sessions read, imported, already present (duplicates)
+    and invalid, with the first MAX_REPORTED_ERRORS problems by line, and
+    the elapsed time and sessions per second.
+    """
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    plan_ids = {plan_data['_id'] for plan_data in db.workout_plans.find({"user_id": user_id}, {"_id": 1})}
+    report = {'read': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0, 'sets': 0, 'errors': []}
+    batch = []
+    try:
+        for number, record, error in records:
+            report['read'] += 1
+            if error is None:
+                try:
+                    batch.append(session_document(user_id, record, plan_ids, now))
+                except InvalidRecord as e:
+                    error = str(e)
+            if error is not None:
+                report['invalid'] += 1
+                if len(report['errors']) < MAX_REPORTED_ERRORS:
+                    report['errors'].append({'line': number, 'error': error})
+                continue
+            if len(batch) >= batch_size:
+                _insert(batch, report)
+                batch = []
+                if progress:
+                    progress(report)
+        if batch:
+            _insert(batch, report)
+    finally:
+        # Even when reading fails part way, what was inserted is counted everywhere
+        if report['imported']:
+            # Rebuilds the activity days and leaderboard scores too
+            UserStats.rebuild(user_id)
+            # Also bumps the data version, so cached pages and reports refresh
+            PersonalRecords.rebuild(user_id)
+            ProgressSeries.invalidate(user_id)
+            jobs.enqueue('training_report', {'user_id': user_id}, user_id=user_id,
+                         dedupe_key=f'training_report:{user_id}')
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    report['sessions_per_second'] = round(report['imported'] / report['seconds'], 1) if report['seconds'] else None
+    return report
+
+
+def store_upload(user_id, stream, fmt):
+    """Save an uploaded history file for the import job; returns its GridFS id"""
+    bucket = GridFSBucket(get_db(), bucket_name=UPLOAD_BUCKET)
+    return bucket.upload_from_stream(f'{user_id}.{fmt}', stream, metadata={'user_id': user_id, 'format': fmt})
+
+
+def import_upload(user_id, file_id, fmt, progress=None):
+    """Import a file saved by store_upload and delete it; returns the import report"""
+    bucket = GridFSBucket(get_db(), bucket_name=UPLOAD_BUCKET)
+    try:
+        with io.TextIOWrapper(bucket.open_download_stream(file_id), encoding='utf-8-sig', newline='') as lines:
+            return import_sessions(user_id, read(fmt, lines), progress=progress)
+    except UnicodeDecodeError:
+        return {'error': 'The file is not UTF-8 text'}
+    finally:
+        bucket.delete(file_id)
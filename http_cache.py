@@ -0,0 +1,148 @@
+import gzip
+import hashlib
+import os
+import threading
+from datetime import datetime, time as dt_time
+from functools import wraps
+
+from flask import current_app, g, request, session
+from flask.globals import request_ctx
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+
+from models import DataVersion
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+COMPRESS_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'application/json',
+    'application/javascript', 'text/javascript', 'application/x-ndjson', 'image/svg+xml'
+}
+
+_release = None
+_release_lock = threading.Lock()
+
+
+def release_stamp():
+    """Identifies the deployed templates, static files and exercise catalog file.
+
+    Part of every ETag, so a deploy that changes how a page renders (or the
+    exercises it names) doesn't leave browsers on 304s for the old markup.
+    APP_RELEASE overrides the content hash computed on first use.
+    """
+    global _release
+    if _release is None:
+        with _release_lock:
+            if _release is None:
+                from catalog import CATALOG_PATH, CATALOG_SOURCE
+                _release = os.environ.get("APP_RELEASE") or _hash_tree(
+                    current_app.template_folder, current_app.static_folder,
+                    files=[CATALOG_PATH] if CATALOG_SOURCE == "file" else [])
+    return _release
+
+
+def _hash_tree(*folders, files=()):
+    digest = hashlib.sha1()
+    for path in files:
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    for folder in folders:
+        folder = os.path.join(current_app.root_path, folder)
+        for root, dirs, files in sorted(os.walk(folder)):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, folder).encode())
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def conditional(*extra):
+    """Answer GETs for the current user's pages with 304 when nothing changed.
+
+    The ETag combines the user's DataVersion, the release stamp, today's date
+    (streaks and "this month" counts move at midnight) and any `extra`
+    values or callables, e.g. the catalog version. Validation costs one point
+    read; the view, and every query it makes, only runs on a miss. Requests
+    with pending flash messages always render, since the flash is consumed
+    by the render.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            version, updated_at = DataVersion.get(current_user.id)
+            # Views reuse it rather than reading it again (e.g. ProgressSeries)
+            g.data_version = version
+            today = datetime.utcnow().date()
+            parts = [current_user.id, version, release_stamp(), today.isoformat()]
+            parts.extend(value() if callable(value) else value for value in extra)
+            etag = hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+            last_modified = max(updated_at or datetime.min, datetime.combine(today, dt_time.min))
+
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
+
+
+def no_store_flashes(response):
+    """after_request hook: a response that rendered flash messages is never stored.
+
+    The flash is consumed by this render, so a copy kept by the browser or
+    the service worker's offline cache would show it again.
+    """
+    if getattr(request_ctx, 'flashes', None):
+        response.cache_control.no_store = True
+    return response
+
+
+def compress_response(response):
+    """after_request hook: brotli or gzip encode large text responses.
+
+    Brotli is used when the client accepts it and the `brotli` package is
+    installed, gzip otherwise. Strong ETags are weakened on the encoded
+    variant, as they no longer describe the exact bytes sent.
+    """
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    if brotli is not None and request.accept_encodings['br']:
+        encoding, data = 'br', brotli.compress(data, quality=5)
+    elif request.accept_encodings['gzip']:
+        encoding, data = 'gzip', gzip.compress(data, compresslevel=6)
+    else:
+        return response
+
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
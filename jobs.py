@@ -0,0 +1,302 @@
+"""Background jobs stored in the Mongo `jobs` collection.
+
+Requests enqueue work with `enqueue(...)`; `flask jobs-worker` claims due
+jobs and runs them in a process pool, so heavy recomputations never run
+inside a gunicorn request. No services beyond MongoDB are needed.
+
+- Claiming is a single find_one_and_update that marks the job running and
+  gives the worker a lease. While a job runs, its process renews the lease;
+  a job whose worker died is reclaimed once the lease expires.
+- Failed jobs are retried with exponential backoff until `max_attempts`,
+  then marked failed with the last error.
+- Handlers receive the job payload and a `progress(done, total, message)`
+  callback, which is stored on the job for clients to poll.
+"""
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+from models import declare_indexes, ensure_indexes
+
+LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 60))
+RETRY_BASE_SECONDS = int(os.environ.get("JOB_RETRY_BASE_SECONDS", 30))
+POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", 2))
+# Finished and failed jobs are removed by a TTL index after this long
+KEEP_FINISHED_SECONDS = 7 * 24 * 3600
+
+HANDLERS = {}
+
+
+class LeaseLost(Exception):
+    """Raised in a job when another worker reclaimed it (our lease expired)"""
+
+
+def job(name):
+    """Register a handler: def handler(payload, progress) -> JSON-able result"""
+    def decorator(handler):
+        HANDLERS[name] = handler
+        return handler
+    return decorator
+
+
+declare_indexes(
+    "jobs",
+    # claim(): due queued jobs, and running jobs whose lease has lapsed
+    ([("status", 1), ("run_at", 1)], {}),
+    ([("status", 1), ("lease_expires_at", 1)], {}),
+    ([("user_id", 1), ("created_at", -1)], {}),
+    # At most one queued job per dedupe key
+    ([("dedupe_key", 1)], {"unique": True,
+                          "partialFilterExpression": {"status": "queued", "dedupe_key": {"$exists": True}}}),
+    ([("finished_at", 1)], {"expireAfterSeconds": KEEP_FINISHED_SECONDS})
+)
+
+
+def enqueue(name, payload=None, user_id=None, dedupe_key=None, delay=0, max_attempts=3):
+    """Queue a job and return its id.
+
+    With `dedupe_key`, a job that is still queued under the same key absorbs
+    this one (its id is returned), so repeated triggers such as several
+    finished workouts collapse into one recomputation.
+    """
+    if name not in HANDLERS:
+        raise ValueError(f"Unknown job: {name}")
+    now = datetime.utcnow()
+    job_doc = {
+        "_id": str(uuid.uuid4()),
+        "name": name,
+        "payload": payload or {},
+        "user_id": user_id,
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "run_at": now + timedelta(seconds=delay),
+        "created_at": now,
+        "progress": None
+    }
+    if not dedupe_key:
+        db.jobs.insert_one(job_doc)
+        return job_doc["_id"]
+
+    job_doc["dedupe_key"] = dedupe_key
+    try:
+        existing = db.jobs.find_one_and_update(
+            {"dedupe_key": dedupe_key, "status": "queued"},
+            {"$setOnInsert": job_doc},
+            projection={"_id": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Lost an upsert race with an identical enqueue
+        existing = db.jobs.find_one({"dedupe_key": dedupe_key, "status": "queued"}, {"_id": 1})
+    return existing["_id"] if existing else job_doc["_id"]
+
+
+def get(job_id, user_id=None):
+    query = {"_id": job_id}
+    if user_id is not None:
+        query["user_id"] = user_id
+    return db.jobs.find_one(query, {"payload": 0})
+
+
+def claim(worker_id, lease_seconds=LEASE_SECONDS):
+    """Atomically take a job whose lease lapsed, else the next due one; None if there is neither.
+
+    A lapsed job that has used all its attempts (say its handler keeps
+    killing the worker process) is marked failed instead of run again.
+    """
+    now = datetime.utcnow()
+    lapsed = {"status": "running", "lease_expires_at": {"$lt": now}}
+    max_attempts = {"$ifNull": ["$max_attempts", 1]}
+    db.jobs.update_many(
+        dict(lapsed, **{"$expr": {"$gte": ["$attempts", max_attempts]}}),
+        {"$set": {"status": "failed", "finished_at": now,
+                  "last_error": "The worker stopped (lease expired) on the last attempt"},
+         "$unset": {"lease_expires_at": ""}}
+    )
+    update = {
+        "$set": {
+            "status": "running",
+            "worker": worker_id,
+            "started_at": now,
+            "lease_expires_at": now + timedelta(seconds=lease_seconds)
+        },
+        "$unset": {"dedupe_key": ""},
+        "$inc": {"attempts": 1}
+    }
+    # Two indexed queries rather than one $or, which would need an in-memory sort
+    for query, sort in (
+        (dict(lapsed, **{"$expr": {"$lt": ["$attempts", max_attempts]}}), "lease_expires_at"),
+        ({"status": "queued", "run_at": {"$lte": now}}, "run_at")
+    ):
+        job_doc = db.jobs.find_one_and_update(query, update, sort=[(sort, 1)],
+                                              return_document=ReturnDocument.AFTER)
+        if job_doc:
+            return job_doc
+    return None
+
+
+def renew(job_id, worker_id, lease_seconds=LEASE_SECONDS, progress=None):
+    """Extend our lease (and optionally record progress); raises LeaseLost if it was taken over"""
+    update = {"lease_expires_at": datetime.utcnow() + timedelta(seconds=lease_seconds)}
+    if progress is not None:
+        update["progress"] = progress
+    result = db.jobs.update_one({"_id": job_id, "worker": worker_id, "status": "running"}, {"$set": update})
+    if not result.matched_count:
+        raise LeaseLost(job_id)
+
+
+def finish(job_doc, worker_id, result=None):
+    db.jobs.update_one(
+        {"_id": job_doc["_id"], "worker": worker_id, "status": "running"},
+        {"$set": {"status": "done", "result": result, "finished_at": datetime.utcnow()},
+         "$unset": {"lease_expires_at": ""}}
+    )
+
+
+def fail(job_doc, worker_id, error):
+    """Requeue with exponential backoff, or mark failed once attempts run out"""
+    now = datetime.utcnow()
+    if job_doc["attempts"] < job_doc.get("max_attempts", 1):
+        update = {"status": "queued",
+                  "run_at": now + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (job_doc["attempts"] - 1))}
+    else:
+        update = {"status": "failed", "finished_at": now}
+    update["last_error"] = error
+    db.jobs.update_one(
+        {"_id": job_doc["_id"], "worker": worker_id, "status": "running"},
+        {"$set": update, "$unset": {"lease_expires_at": ""}}
+    )
+
+
+def execute(job_doc, worker_id, lease_seconds=LEASE_SECONDS):
+    """Run one claimed job in the current process, renewing its lease in the background"""
+    stop = threading.Event()
+    lost = threading.Event()
+
+    def keep_lease():
+        while not stop.wait(lease_seconds / 3):
+            try:
+                renew(job_doc["_id"], worker_id, lease_seconds)
+            except LeaseLost:
+                lost.set()
+                return
+
+    def progress(done, total=None, message=None):
+        if lost.is_set():
+            raise LeaseLost(job_doc["_id"])
+        renew(job_doc["_id"], worker_id, lease_seconds, progress={
+            "done": done, "total": total, "message": message, "updated_at": datetime.utcnow()
+        })
+
+    heartbeat = threading.Thread(target=keep_lease, daemon=True)
+    heartbeat.start()
+    try:
+        result = HANDLERS[job_doc["name"]](job_doc.get("payload") or {}, progress)
+    except LeaseLost:
+        return "lost"
+    except Exception:
+        fail(job_doc, worker_id, traceback.format_exc(limit=5))
+        return "failed"
+    finally:
+        stop.set()
+        heartbeat.join()
+    finish(job_doc, worker_id, result)
+    return "done"
+
+
+def run_worker(processes=2, lease_seconds=LEASE_SECONDS, poll_seconds=POLL_SECONDS, burst=False, log=print):
+    """Claim and run jobs with up to `processes` in flight; with `burst`, exit when the queue is empty"""
+    ensure_indexes(["jobs"])
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    # spawn: children start clean instead of inheriting this process's MongoClient threads
+    with ProcessPoolExecutor(max_workers=processes, mp_context=get_context("spawn")) as pool:
+        running = {}
+        while True:
+            while len(running) < processes:
+                job_doc = claim(worker_id, lease_seconds)
+                if job_doc is None:
+                    break
+                log(f"claimed {job_doc['name']} {job_doc['_id']} (attempt {job_doc['attempts']})")
+                running[pool.submit(execute, job_doc, worker_id, lease_seconds)] = job_doc
+
+            if not running:
+                if burst:
+                    return
+                time.sleep(poll_seconds)
+                continue
+
+            done, _ = wait(running, timeout=poll_seconds, return_when=FIRST_COMPLETED)
+            for future in done:
+                job_doc = running.pop(future)
+                try:
+                    log(f"{future.result()} {job_doc['name']} {job_doc['_id']}")
+                except Exception:
+                    # The child died mid-job; the expired lease hands it to the next claim
+                    log(f"crashed {job_doc['name']} {job_doc['_id']}: {traceback.format_exc(limit=1)}")
+
+
+# Job handlers
+
+@job("rebuild_stats")
+def rebuild_stats_job(payload, progress):
+    from models import UserStats
+    if payload.get("user_id"):
+        UserStats.rebuild(payload["user_id"])
+        return
+    return {"users": UserStats.rebuild_all()}
+
+
+@job("rebuild_records")
+def rebuild_records_job(payload, progress):
+    from models import PersonalRecords
+    if payload.get("user_id"):
+        PersonalRecords.rebuild(payload["user_id"])
+        return
+    return {"users": PersonalRecords.rebuild_all()}
+
+
+@job("training_report")
+def training_report_job(payload, progress):
+    """One user's training report (after a workout), or every user's (the nightly run)"""
+    from analytics import write_nightly_reports, write_user_report
+    if payload.get("user_id"):
+        write_user_report(payload["user_id"])
+        return
+    return {"users": write_nightly_reports(batch_size=payload.get("batch_size", 500), progress=progress)}
+
+
+@job("import_history")
+def import_history_job(payload, progress):
+    """Import a history file uploaded to /api/import (history.py); the result is the import report"""
+    import history
+
+    def import_progress(report):
+        progress(report['read'], None, f"{report['imported']} imported, {report['invalid']} invalid")
+
+    return history.import_upload(payload["user_id"], payload["file_id"], payload["format"], import_progress)
+
+
+@job("archive_sessions")
+def archive_sessions_job(payload, progress):
+    """Move old sessions into monthly archive buckets (models.SessionArchive)"""
+    from models import SessionArchive
+    return SessionArchive.archive(payload.get("older_than_days"), user_id=payload.get("user_id"), progress=progress)
+
+
+@job("compact_leaderboards")
+def compact_leaderboards_job(payload, progress):
+    """Store the final top entries of finished leaderboards and drop their scores (leaderboard.py)"""
+    import leaderboard
+    return leaderboard.compact(payload.get("keep_days"))
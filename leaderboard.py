@@ -0,0 +1,289 @@
+"""Weekly and monthly leaderboards per fitness level.
+
+Every finished workout updates its user's score document for the current
+week and month (`leaderboard_scores`, one per period and user), so reading a
+board never touches `workout_sessions`. Three metrics are ranked: total
+volume, workouts completed and the longest streak reached in the period.
+A user stays on the board of the fitness level they had when their first
+workout of the period finished.
+
+- Top N is an index walk on (period, level, metric): it reads N keys
+  however many users are ranked.
+- "My rank" uses a per-board histogram (`leaderboard_histograms`) of
+  scores truncated to two significant digits, kept in step with the
+  scores: the users ahead are the counts of the higher buckets plus an
+  index count inside the user's own bucket. Scores below 100 are bucketed
+  exactly, so workout and streak ranks come from the histogram alone.
+- Boards that ended more than KEEP_DAYS ago are compacted by
+  `flask compact-leaderboards` into one `leaderboard_results` document
+  holding the final top RESULT_SIZE per metric.
+
+Ranks are competition ranks: tied users share a rank, and the next rank
+skips past them.
+"""
+import os
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+from database import db
+from models import ActivityIndex, User, WorkoutSession, add_months, declare_indexes, truncate_time
+
+PERIODS = ('week', 'month')
+METRICS = ('volume', 'workouts', 'streak')
+LEVELS = ('beginner', 'intermediate', 'advanced', 'unspecified')
+# Finished boards stay live (with every user's rank) this long before compaction
+KEEP_DAYS = int(os.environ.get("LEADERBOARD_KEEP_DAYS", 35))
+RESULT_SIZE = 100
+
+declare_indexes(
+    "leaderboard_scores",
+    # Top N per metric, ties ordered by user; also counts a score range for ranks
+    *[([("period", 1), ("level", 1), (metric, -1), ("user_id", 1)], {}) for metric in METRICS]
+)
+declare_indexes(
+    "leaderboard_histograms",
+    ([("ends", 1)], {})
+)
+
+
+def period_start(period, when):
+    return truncate_time(when, period)
+
+
+def period_end(period, start):
+    return start + timedelta(days=7) if period == 'week' else add_months(start, 1)
+
+
+def period_key(period, start):
+    return f"{period}:{start.date().isoformat()}"
+
+
+def score_bounds(score):
+    """[low, high) of the histogram bucket holding `score`"""
+    whole = max(int(score), 0)
+    if whole < 100:
+        return whole, whole + 1
+    unit = 10 ** (len(str(whole)) - 2)
+    low = whole - whole % unit
+    return low, low + unit
+
+
+def session_volume(session_data):
+    return sum((session_data.get('volume_by_exercise') or {}).values())
+
+
+def _scores(score_data):
+    return {metric: (score_data or {}).get(metric, 0) for metric in METRICS}
+
+
+def _move(key, level, ends, old, new):
+    """Shift the board's histogram counts from the `old` scores (None for a new entry) to `new` (None to drop it)"""
+    increments = {}
+    for metric in METRICS:
+        before = score_bounds(old[metric])[0] if old else None
+        after = score_bounds(new[metric])[0] if new else None
+        if before == after:
+            continue
+        if before is not None:
+            increments[f"{metric}.{before}"] = -1
+        if after is not None:
+            increments[f"{metric}.{after}"] = 1
+    if increments:
+        db.leaderboard_histograms.update_one(
+            {"_id": f"{key}:{level}"},
+            {"$inc": increments, "$setOnInsert": {"period": key, "level": level, "ends": ends}},
+            upsert=True
+        )
+
+
+def record_workout(user_id, end_time, volume, streak):
+    """Add a finished workout to the user's scores for its week and month"""
+    user = User.get(user_id)
+    level = user.fitness_level if user else 'unspecified'
+    for period in PERIODS:
+        start = period_start(period, end_time)
+        key = period_key(period, start)
+        previous = db.leaderboard_scores.find_one_and_update(
+            {"_id": f"{key}:{user_id}"},
+            {
+                "$inc": {"volume": volume, "workouts": 1},
+                "$max": {"streak": streak},
+                "$set": {"username": user.username if user else None, "updated_at": datetime.utcnow()},
+                "$setOnInsert": {"period": key, "level": level, "user_id": user_id}
+            },
+            projection={"level": 1, **{metric: 1 for metric in METRICS}},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        old = _scores(previous) if previous else None
+        new = _scores(previous)
+        new['volume'] += volume
+        new['workouts'] += 1
+        new['streak'] = max(new['streak'], streak)
+        _move(key, previous['level'] if previous else level, period_end(period, start), old, new)
+
+
+def remove_workout(user_id, end_time, volume, now=None):
+    """Take a deleted workout back out of its week and month, if those boards are still live.
+
+    Call after the workout's day is unmarked in the activity index: the
+    period's streak is recomputed from it, and a user left with no workouts
+    in the period is dropped from that board.
+    """
+    now = now or datetime.utcnow()
+    activity = ActivityIndex.load(user_id)
+    for period in PERIODS:
+        start = period_start(period, end_time)
+        end = period_end(period, start)
+        key = period_key(period, start)
+        streak = period_streak(activity, start, end, now)
+        previous = db.leaderboard_scores.find_one_and_update(
+            {"_id": f"{key}:{user_id}"},
+            {"$inc": {"volume": -volume, "workouts": -1}, "$set": {"streak": streak, "updated_at": now}},
+            projection={"level": 1, **{metric: 1 for metric in METRICS}}
+        )
+        if not previous:
+            continue
+        new = _scores(previous)
+        new['volume'] -= volume
+        new['workouts'] -= 1
+        new['streak'] = streak
+        # Unless a workout was recorded in the meantime
+        if new['workouts'] <= 0 and db.leaderboard_scores.delete_one(
+                {"_id": previous['_id'], "workouts": {"$lte": 0}}).deleted_count:
+            new = None
+        _move(key, previous['level'], end, _scores(previous), new)
+
+
+def period_streak(activity, start, end, now):
+    """Longest streak reached on an active day of [start, end), counting only days up to `now`"""
+    day, streak = start.date(), 0
+    while day < min(end, now + timedelta(days=1)).date():
+        if activity.is_active(day):
+            streak = max(streak, activity.current_streak(day))
+        day += timedelta(days=1)
+    return streak
+
+
+def rebuild(user_id, now=None):
+    """Recompute the user's current week and month from their sessions and activity days"""
+    now = now or datetime.utcnow()
+    user = User.get(user_id)
+    activity = ActivityIndex.load(user_id)
+    for period in PERIODS:
+        start = period_start(period, now)
+        end = period_end(period, start)
+        key = period_key(period, start)
+        volume = workouts = 0
+        for session_data in db.workout_sessions.find(WorkoutSession.completed_query(user_id, start, end),
+                                                     {"volume_by_exercise": 1}):
+            volume += session_volume(session_data)
+            workouts += 1
+        streak = period_streak(activity, start, end, now)
+
+        previous = db.leaderboard_scores.find_one({"_id": f"{key}:{user_id}"})
+        level = previous['level'] if previous else (user.fitness_level if user else 'unspecified')
+        if not workouts:
+            if previous:
+                db.leaderboard_scores.delete_one({"_id": previous['_id']})
+                _move(key, level, end, _scores(previous), None)
+            continue
+        new = {'volume': volume, 'workouts': workouts, 'streak': streak}
+        db.leaderboard_scores.replace_one(
+            {"_id": f"{key}:{user_id}"},
+            dict(new, period=key, level=level, user_id=user_id, username=user.username if user else None,
+                 updated_at=datetime.utcnow()),
+            upsert=True
+        )
+        _move(key, level, end, _scores(previous) if previous else None, new)
+
+
+def rebuild_histogram(key, level, ends):
+    """Recount a board's histogram from its scores (repair, or after a bulk load)"""
+    counts = {metric: {} for metric in METRICS}
+    for score_data in db.leaderboard_scores.find({"period": key, "level": level}, {metric: 1 for metric in METRICS}):
+        for metric in METRICS:
+            bucket = str(score_bounds(score_data.get(metric, 0))[0])
+            counts[metric][bucket] = counts[metric].get(bucket, 0) + 1
+    db.leaderboard_histograms.replace_one({"_id": f"{key}:{level}"},
+                                          dict(counts, period=key, level=level, ends=ends), upsert=True)
+
+
+def top(key, level, metric, limit=10):
+    """The board's first `limit` entries as [{rank, user_id, username, score}]"""
+    entries = []
+    cursor = db.leaderboard_scores.find(
+        {"period": key, "level": level},
+        {"user_id": 1, "username": 1, metric: 1}
+    ).sort([(metric, -1), ("user_id", 1)]).limit(limit)
+    for position, score_data in enumerate(cursor, start=1):
+        score = score_data.get(metric, 0)
+        rank = entries[-1]['rank'] if entries and entries[-1]['score'] == score else position
+        entries.append({'rank': rank, 'user_id': score_data['user_id'],
+                        'username': score_data.get('username'), 'score': score})
+    return entries
+
+
+def rank(key, level, metric, user_id):
+    """{rank, score, participants} for the user on the board, or None if they aren't on it"""
+    score_data = db.leaderboard_scores.find_one({"_id": f"{key}:{user_id}"}, {"level": 1, metric: 1})
+    if not score_data or score_data['level'] != level:
+        return None
+    histogram = (db.leaderboard_histograms.find_one({"_id": f"{key}:{level}"}, {metric: 1}) or {}).get(metric, {})
+    score = score_data.get(metric, 0)
+    low, high = score_bounds(score)
+    ahead = sum(count for bucket, count in histogram.items() if int(bucket) > low)
+    if high - low > 1 or score != low:
+        # Only buckets wider than one point (or fractional scores) can hold higher scores than ours
+        ahead += db.leaderboard_scores.count_documents(
+            {"period": key, "level": level, metric: {"$gt": score, "$lt": high}})
+    return {'rank': ahead + 1, 'score': score, 'participants': sum(histogram.values())}
+
+
+def board(period, level, metric, user_id=None, limit=10, when=None):
+    """A board as served by /api/leaderboard; compacted boards come from their stored results"""
+    start = period_start(period, when or datetime.utcnow())
+    key = period_key(period, start)
+    result = {'period': period, 'start': start.isoformat(), 'end': period_end(period, start).isoformat(),
+              'level': level, 'metric': metric}
+    stored = db.leaderboard_results.find_one({"_id": f"{key}:{level}"}, {f"top.{metric}": 1, "participants": 1})
+    if stored:
+        entries = stored.get('top', {}).get(metric, [])
+        mine = next((entry for entry in entries if entry['user_id'] == user_id), None)
+        return dict(result, final=True, participants=stored.get('participants', 0), top=entries[:limit],
+                    me={'rank': mine['rank'], 'score': mine['score']} if mine else None)
+    mine = rank(key, level, metric, user_id) if user_id else None
+    if mine is None:
+        histogram = db.leaderboard_histograms.find_one({"_id": f"{key}:{level}"}, {metric: 1}) or {}
+        participants = sum(histogram.get(metric, {}).values())
+    else:
+        participants = mine.pop('participants')
+    return dict(result, final=False, participants=participants, top=top(key, level, metric, limit), me=mine)
+
+
+def compact(keep_days=None, now=None, log=None):
+    """Replace boards that ended more than `keep_days` ago with their final top RESULT_SIZE"""
+    keep_days = KEEP_DAYS if keep_days is None else keep_days
+    cutoff = (now or datetime.utcnow()) - timedelta(days=keep_days)
+    totals = {'boards': 0, 'scores': 0}
+    for histogram in db.leaderboard_histograms.find({"ends": {"$lte": cutoff}}):
+        key, level = histogram['period'], histogram['level']
+        db.leaderboard_results.replace_one(
+            {"_id": histogram['_id']},
+            {
+                "period": key,
+                "level": level,
+                "ends": histogram['ends'],
+                "participants": sum(histogram.get('workouts', {}).values()),
+                "top": {metric: top(key, level, metric, RESULT_SIZE) for metric in METRICS},
+                "compacted_at": datetime.utcnow()
+            },
+            upsert=True
+        )
+        totals['scores'] += db.leaderboard_scores.delete_many({"period": key, "level": level}).deleted_count
+        db.leaderboard_histograms.delete_one({"_id": histogram['_id']})
+        totals['boards'] += 1
+        if log:
+            log(f"Compacted {key} ({level})")
+    return totals
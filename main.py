@@ -1,4 +1,10 @@
-from app import app
+from app import create_app
+
+app = create_app()
 
 if __name__ == '__main__':
+    from google_auth import setup_instructions
+    print(setup_instructions())
+    from models import ensure_indexes
+    ensure_indexes()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,241 @@
+"""Request timing and per-route database metrics, exposed at /metrics.
+
+Every request is timed from before_request to teardown (which includes the
+session save), and the MongoDB commands it ran are collected by
+database.query_tracker. Per endpoint this keeps a duration histogram, a
+queries-per-request histogram, and query count, time and documents
+returned per command and collection. A request that runs the same command
+with the same filter shape N_PLUS_ONE_THRESHOLD or more times is counted
+(and logged) as an N+1 pattern; requests slower than SLOW_REQUEST_MS are
+logged with their query breakdown. With SERVER_TIMING set, responses carry a
+`Server-Timing` header with the app time and the database time and command
+count up to that point (the session save comes after), which
+benchmarks/runner.py reads per request. The scrape also reports the
+per-process user and session caches and the MongoDB connection pool.
+
+Counters are per process: with several gunicorn workers, each scrape sees
+the worker that answered it, labelled with `pid`, so sum across pids.
+"""
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from flask import Response, abort, current_app, g, request
+
+from database import pool_metrics, query_tracker
+
+logger = logging.getLogger(__name__)
+
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("N_PLUS_ONE_THRESHOLD", 5))
+# 0 disables the slow-request log
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 0))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "").lower() in ("1", "true", "yes")
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class RequestMetrics:
+    """Collects the metrics above and serves them in Prometheus text format at /metrics.
+
+    Set METRICS_TOKEN to require `Authorization: Bearer <token>` on scrapes.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.durations = {}
+        self.requests = Counter()
+        self.queries_per_request = {}
+        self.queries = Counter()
+        self.query_seconds = Counter()
+        self.documents = Counter()
+        self.n_plus_one = Counter()
+        self.slow_requests = Counter()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._status)
+        app.teardown_request(self._finish)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        app.extensions['request_metrics'] = self
+
+    def _start(self):
+        g.metrics_started = time.perf_counter()
+        query_tracker.start()
+
+    def _status(self, response):
+        g.metrics_status = response.status_code
+        started = g.get('metrics_started')
+        if SERVER_TIMING and started is not None:
+            queries = query_tracker.current()
+            db_ms = sum(q.seconds for q in queries) * 1000
+            response.headers.add('Server-Timing', f'app;dur={(time.perf_counter() - started) * 1000:.1f}')
+            response.headers.add('Server-Timing', f'db;dur={db_ms:.1f};desc="{len(queries)} queries"')
+        return response
+
+    def _finish(self, exc=None):
+        started = g.pop('metrics_started', None)
+        queries = query_tracker.stop()
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        # Unmatched URLs share one label so scanners can't blow up the series count
+        endpoint = request.endpoint or 'unmatched'
+        status = g.pop('metrics_status', 500 if exc else 200)
+        self.record(endpoint, request.method, status, seconds, queries)
+
+    def record(self, endpoint, method, status, seconds, queries):
+        repeated = Counter((q.command, q.collection, q.shape) for q in queries)
+        patterns = [(key, count) for key, count in repeated.items() if count >= N_PLUS_ONE_THRESHOLD]
+
+        with self._lock:
+            histogram = self.durations.get((endpoint, method))
+            if histogram is None:
+                histogram = self.durations[(endpoint, method)] = Histogram(DURATION_BUCKETS)
+            histogram.observe(seconds)
+            self.requests[(endpoint, method, str(status))] += 1
+
+            histogram = self.queries_per_request.get(endpoint)
+            if histogram is None:
+                histogram = self.queries_per_request[endpoint] = Histogram(QUERY_BUCKETS)
+            histogram.observe(len(queries))
+            for q in queries:
+                key = (endpoint, q.command, q.collection or '')
+                self.queries[key] += 1
+                self.query_seconds[key] += q.seconds
+                self.documents[key] += q.documents
+            for (command, collection, _), _ in patterns:
+                self.n_plus_one[(endpoint, command, collection or '')] += 1
+            slow = SLOW_REQUEST_MS and seconds * 1000 >= SLOW_REQUEST_MS
+            if slow:
+                self.slow_requests[endpoint] += 1
+
+        for (command, collection, shape), count in patterns:
+            logger.warning("N+1 on %s %s: %s %s by %s ran %d times",
+                           method, endpoint, command, collection, list(shape), count)
+        if slow:
+            logger.warning("Slow request %s %s %s: %.0f ms, %d queries%s", method, request.path, status,
+                           seconds * 1000, len(queries), '\n' + self.breakdown(queries) if queries else '')
+
+    @staticmethod
+    def breakdown(queries):
+        """One line per (command, collection, shape), most time first"""
+        totals = {}
+        for q in queries:
+            count, total, documents = totals.get((q.command, q.collection, q.shape), (0, 0.0, 0))
+            totals[(q.command, q.collection, q.shape)] = (count + 1, total + q.seconds, documents + q.documents)
+        lines = [
+            f"  {count:>4} x {command} {collection} {list(shape)}: {total * 1000:.1f} ms, {documents} docs"
+            for (command, collection, shape), (count, total, documents)
+            in sorted(totals.items(), key=lambda item: -item[1][1])
+        ]
+        return '\n'.join(lines)
+
+    def render(self):
+        pid = os.getpid()
+        lines = []
+
+        def histogram(name, help_text, histograms, label_names):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for key, h in sorted(histograms.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                labels = dict(zip(label_names, key), pid=pid)
+                cumulative = 0
+                for bound, count in zip(h.buckets + ('+Inf',), h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}')
+                lines.append(f'{name}_sum{_labels(**labels)} {_format_number(h.sum)}')
+                lines.append(f'{name}_count{_labels(**labels)} {h.count}')
+
+        def counter(name, help_text, values, label_names, kind='counter'):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(values.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                lines.append(f'{name}{_labels(**dict(zip(label_names, key), pid=pid))} {_format_number(value)}')
+
+        with self._lock:
+            histogram('fittracker_http_request_duration_seconds', 'Request time by endpoint.',
+                      self.durations, ('endpoint', 'method'))
+            counter('fittracker_http_requests_total', 'Requests by endpoint and status.',
+                    self.requests, ('endpoint', 'method', 'status'))
+            histogram('fittracker_db_queries_per_request', 'MongoDB commands run per request.',
+                      self.queries_per_request, ('endpoint',))
+            counter('fittracker_db_queries_total', 'MongoDB commands by endpoint.',
+                    self.queries, ('endpoint', 'command', 'collection'))
+            counter('fittracker_db_query_seconds_total', 'Time spent in MongoDB commands.',
+                    self.query_seconds, ('endpoint', 'command', 'collection'))
+            counter('fittracker_db_documents_returned_total', 'Documents returned by MongoDB commands.',
+                    self.documents, ('endpoint', 'command', 'collection'))
+            counter('fittracker_db_n_plus_one_total',
+                    f'Requests repeating one query shape {N_PLUS_ONE_THRESHOLD}+ times.',
+                    self.n_plus_one, ('endpoint', 'command', 'collection'))
+            counter('fittracker_http_slow_requests_total', f'Requests over {SLOW_REQUEST_MS:g} ms.',
+                    self.slow_requests, ('endpoint',))
+
+        # Per-process caches: the user loader's and, with SESSION_CACHE_TTL, the session store's
+        from models import User
+        caches = {'user': User.cache_stats()}
+        sessions = current_app.session_interface.stats() if hasattr(current_app.session_interface, 'stats') else None
+        if sessions and sessions['cache']:
+            caches['session'] = sessions['cache']
+        counter('fittracker_cache_entries', 'Entries in per-process caches.',
+                {(name,): stats['size'] for name, stats in caches.items()}, ('cache',), 'gauge')
+        counter('fittracker_cache_lookups_total', 'Cache lookups by result.',
+                {(name, result): stats[field] for name, stats in caches.items()
+                 for result, field in (('hit', 'hits'), ('miss', 'misses'))},
+                ('cache', 'result'))
+        counter('fittracker_cache_evictions_total', 'Entries dropped to make room.',
+                {(name,): stats['evictions'] for name, stats in caches.items()}, ('cache',))
+        if sessions:
+            counter('fittracker_session_store_operations_total', 'Session loads, saves and unchanged saves skipped.',
+                    {('read',): sessions['reads'], ('write',): sessions['writes'],
+                     ('skipped_write',): sessions['skipped_writes']}, ('operation',))
+
+        pool = pool_metrics.stats()
+        counter('fittracker_mongo_pool_connections', 'Open pooled connections.', {(): pool['open']}, (), 'gauge')
+        counter('fittracker_mongo_pool_in_use', 'Checked out connections.', {(): pool['in_use']}, (), 'gauge')
+        counter('fittracker_mongo_pool_checkout_wait_seconds_total', 'Time spent waiting for a connection.',
+                {(): pool['wait_seconds_total']}, ())
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        if METRICS_TOKEN:
+            supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+            if not hmac.compare_digest(supplied, METRICS_TOKEN):
+                abort(401)
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
@@ -1,67 +1,69 @@
 import os
 from flask_login import UserMixin
-from pymongo import MongoClient
-from datetime import datetime
+from pymongo import IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from datetime import datetime, date, timedelta
+import base64
+import heapq
+import importlib
+import itertools
+import json
+import re
+import time
 import uuid
+import zlib
+import bson
+from bson.binary import Binary
+from bson.int64 import Int64
 from bson.objectid import ObjectId
+from cache import TTLCache
+from series import lttb
 
-# MongoDB connection
-client = MongoClient(os.environ.get("MONGODB_URI"))
-db = client.fittracker
-
-# Exercise library data
-EXERCISE_LIBRARY = {
-    'push_ups': {
-        'name': 'Push-ups',
-        'muscle_groups': ['Chest', 'Shoulders', 'Triceps'],
-        'description': 'Classic bodyweight exercise for upper body strength',
-        'equipment': 'Bodyweight'
-    },
-    'squats': {
-        'name': 'Squats',
-        'muscle_groups': ['Quadriceps', 'Glutes', 'Hamstrings'],
-        'description': 'Fundamental lower body exercise',
-        'equipment': 'Bodyweight'
-    },
-    'deadlifts': {
-        'name': 'Deadlifts',
-        'muscle_groups': ['Hamstrings', 'Glutes', 'Back'],
-        'description': 'Compound movement for posterior chain',
-        'equipment': 'Barbell'
-    },
-    'bench_press': {
-        'name': 'Bench Press',
-        'muscle_groups': ['Chest', 'Shoulders', 'Triceps'],
-        'description': 'Classic upper body pressing movement',
-        'equipment': 'Barbell'
-    },
-    'pull_ups': {
-        'name': 'Pull-ups',
-        'muscle_groups': ['Back', 'Biceps'],
-        'description': 'Bodyweight pulling exercise',
-        'equipment': 'Pull-up bar'
-    },
-    'lunges': {
-        'name': 'Lunges',
-        'muscle_groups': ['Quadriceps', 'Glutes'],
-        'description': 'Single-leg strength exercise',
-        'equipment': 'Bodyweight'
-    },
-    'planks': {
-        'name': 'Planks',
-        'muscle_groups': ['Core', 'Shoulders'],
-        'description': 'Isometric core strengthening exercise',
-        'equipment': 'Bodyweight'
-    },
-    'rows': {
-        'name': 'Rows',
-        'muscle_groups': ['Back', 'Biceps'],
-        'description': 'Horizontal pulling movement',
-        'equipment': 'Dumbbells'
-    }
-}
+# MongoDB connection (one lazily created client per process, see database.py)
+from database import db
+
+# Indexes the queries below rely on, by collection. Each model declares its
+# own right after the class; ensure_indexes() applies them all, and
+# query_plans.py checks that every query the models run actually uses one.
+INDEXES = {}
+# Modules outside this one that declare indexes; ensure_indexes() imports
+# them so every caller applies the full set
+INDEX_MODULES = ('jobs', 'leaderboard')
+
+def declare_indexes(collection, *indexes):
+    """Register (keys, options) pairs, e.g. ([("user_id", 1), ("end_time", 1)], {"unique": True})"""
+    INDEXES.setdefault(collection, []).extend(IndexModel(keys, **options) for keys, options in indexes)
+
+def ensure_indexes(collections=None):
+    """Create any declared index that is missing; safe to run on every start.
+    
+    MongoDB treats re-creating an identical index as a no-op, and raises
+    OperationFailure if one with the same name exists with other options
+    (drop it and rerun). Returns {collection: [names of new indexes]}.
+    """
+    for module in INDEX_MODULES:
+        importlib.import_module(module)
+    created = {}
+    for collection, indexes in INDEXES.items():
+        if collections and collection not in collections:
+            continue
+        before = set(db[collection].index_information())
+        names = db[collection].create_indexes(indexes)
+        new = [name for name in names if name not in before]
+        if new:
+            created[collection] = new
+    return created
 
 class User(UserMixin):
+    # Per-process cache of loaded users, consulted by the login manager on every request.
+    # Entries are (user, version, checked_at); `version` is bumped by every save so
+    # workers can revalidate cheaply when USER_CACHE_REVALIDATE is set.
+    _cache = TTLCache(
+        maxsize=int(os.environ.get("USER_CACHE_SIZE", 10000)),
+        ttl=float(os.environ.get("USER_CACHE_TTL", 60))
+    )
+    REVALIDATE_AFTER = float(os.environ.get("USER_CACHE_REVALIDATE", 0))
+    
     def __init__(self, email, username, google_id=None, user_id=None, created_at=None, fitness_level='unspecified'):
         self.id = user_id or str(uuid.uuid4())
         self.email = email
@@ -72,9 +74,22 @@ class User(UserMixin):
         
     @staticmethod
     def get(user_id):
-        user_data = db.users.find_one({"_id": user_id})
+        cached = User._cache.get(user_id)
+        if cached is not None:
+            user, version, checked_at = cached
+            if not User.REVALIDATE_AFTER or time.monotonic() - checked_at < User.REVALIDATE_AFTER:
+                return user
+            
+            # Only transfers the document if another worker saved a newer version
+            user_data = db.users.find_one({"_id": user_id, "version": {"$ne": version}})
+            if user_data is None:
+                User._cache.set(user_id, (user, version, time.monotonic()))
+                return user
+        else:
+            user_data = db.users.find_one({"_id": user_id})
+        
         if user_data:
-            return User(
+            user = User(
                 email=user_data['email'],
                 username=user_data['username'],
                 google_id=user_data.get('google_id'),
@@ -82,8 +97,14 @@ class User(UserMixin):
                 created_at=user_data.get('created_at'),
                 fitness_level=user_data.get('fitness_level', 'unspecified')
             )
+            User._cache.set(user_id, (user, user_data.get('version', 0), time.monotonic()))
+            return user
         return None
     
+    @staticmethod
+    def cache_stats():
+        return User._cache.stats()
+    
     @staticmethod
     def get_by_email(email):
         user_data = db.users.find_one({"email": email})
@@ -121,13 +142,23 @@ class User(UserMixin):
             "fitness_level": self.fitness_level,
             "created_at": self.created_at
         }
-        db.users.update_one(
+        saved = db.users.find_one_and_update(
             {"_id": self.id},
-            {"$set": user_doc},
-            upsert=True
+            {"$set": user_doc, "$inc": {"version": 1}},
+            projection={"version": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
+        User._cache.set(self.id, (self, saved['version'], time.monotonic()))
+        DataVersion.bump(self.id)
         return self
 
+declare_indexes(
+    "users",
+    ([("email", 1)], {"unique": True}),
+    ([("google_id", 1)], {"unique": True, "sparse": True})
+)
+
 class WorkoutPlan:
     def __init__(self, name, user_id, exercises=None, level='unspecified', plan_id=None, created_at=None):
         self.id = plan_id or str(uuid.uuid4())
@@ -146,21 +177,38 @@ class WorkoutPlan:
             "level": self.level,
             "created_at": self.created_at
         }
-        db.workout_plans.update_one(
+        previous = db.workout_plans.find_one_and_update(
             {"_id": self.id},
             {"$set": plan_doc},
-            upsert=True
+            projection={"level": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
         )
+        if previous is None:
+            UserStats.plan_changed(self.user_id, new_level=self.level)
+        elif previous.get('level', 'unspecified') != self.level:
+            UserStats.plan_changed(self.user_id, old_level=previous.get('level', 'unspecified'), new_level=self.level)
+        DataVersion.bump(self.user_id)
         return self
     
+    def delete(self):
+        result = db.workout_plans.delete_one({"_id": self.id, "user_id": self.user_id})
+        if result.deleted_count:
+            UserStats.plan_changed(self.user_id, old_level=self.level)
+            DataVersion.bump(self.user_id)
+    
     @staticmethod
-    def get_by_user(user_id, level=None):
+    def get_by_user(user_id, level=None, limit=None, skip=0):
         query = {"user_id": user_id}
         if level:
             query["level"] = level
         
+        cursor = db.workout_plans.find(query).sort("created_at", -1).skip(skip)
+        if limit:
+            cursor = cursor.limit(limit)
+        
         plans = []
-        for plan_data in db.workout_plans.find(query).sort("created_at", -1):
+        for plan_data in cursor:
             plans.append(WorkoutPlan(
                 name=plan_data['name'],
                 user_id=plan_data['user_id'],
@@ -185,18 +233,83 @@ class WorkoutPlan:
             )
         return None
 
+declare_indexes(
+    "workout_plans",
+    # get_by_user with a level filter
+    ([("user_id", 1), ("level", 1), ("created_at", -1)], {}),
+    # get_by_user without one (the level index can't serve that sort)
+    ([("user_id", 1), ("created_at", -1)], {})
+)
+
+def encode_page_cursor(start_time, session_id):
+    """Opaque keyset cursor for the (start_time, _id) position of the last item on a page"""
+    raw = json.dumps({"t": start_time.isoformat(), "id": session_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_page_cursor(cursor):
+    """Inverse of encode_page_cursor; raises ValueError for malformed cursors"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(raw)
+        return datetime.fromisoformat(position["t"]), position["id"]
+    except (TypeError, KeyError, json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid page cursor: {cursor}") from e
+
 class WorkoutSession:
-    def __init__(self, plan_id, user_id, session_id=None, start_time=None, end_time=None, exercises_completed=None, notes=""):
+    # Projection for list views: everything except the potentially large sets array
+    SUMMARY_PROJECTION = {"exercises_completed": 0, "set_log": 0, "sync_keys": 0}
+    # Session arrays that offline clients may append to through bulk_append
+    APPENDABLE_FIELDS = ('exercises_completed', 'set_log')
+    
+    def __init__(self, plan_id, user_id, session_id=None, start_time=None, end_time=None, exercises_completed=None, notes="",
+                 load_exercises=False):
         self.id = session_id or str(uuid.uuid4())
         self.plan_id = plan_id
         self.user_id = user_id
         self.start_time = start_time or datetime.utcnow()
         self.end_time = end_time
-        self.exercises_completed = exercises_completed or []
+        # With load_exercises the sets array was projected out and is fetched on first access
+        self._exercises_completed = None if load_exercises else (exercises_completed or [])
         self.notes = notes
     
-    def save(self):
-        session_doc = {
+    @property
+    def exercises_completed(self):
+        if self._exercises_completed is None:
+            session_data = db.workout_sessions.find_one({"_id": self.id}, {"exercises_completed": 1})
+            if session_data is None and self.start_time < SessionArchive.horizon():
+                session_data = SessionArchive.get_session(self.id)
+            self._exercises_completed = (session_data or {}).get('exercises_completed', [])
+        return self._exercises_completed
+    
+    @exercises_completed.setter
+    def exercises_completed(self, value):
+        self._exercises_completed = value
+    
+    @staticmethod
+    def from_document(session_data, summary=False):
+        return WorkoutSession(
+            plan_id=session_data['plan_id'],
+            user_id=session_data['user_id'],
+            session_id=session_data['_id'],
+            start_time=session_data.get('start_time'),
+            end_time=session_data.get('end_time'),
+            exercises_completed=session_data.get('exercises_completed', []),
+            notes=session_data.get('notes', ""),
+            load_exercises=summary
+        )
+    
+    def to_summary(self):
+        """JSON-friendly view of the session without its sets"""
+        return {
+            'id': self.id,
+            'plan_id': self.plan_id,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'notes': self.notes
+        }
+    
+    def to_document(self):
+        return {
             "_id": self.id,
             "plan_id": self.plan_id,
             "user_id": self.user_id,
@@ -205,44 +318,1335 @@ class WorkoutSession:
             "exercises_completed": self.exercises_completed,
             "notes": self.notes
         }
+    
+    def save(self):
         db.workout_sessions.update_one(
             {"_id": self.id},
-            {"$set": session_doc},
+            {"$set": self.to_document()},
             upsert=True
         )
+        DataVersion.bump(self.user_id)
         return self
     
     def complete(self, notes=""):
         self.end_time = datetime.utcnow()
         self.notes = notes
-        return self.save()
-    
-    @staticmethod
-    def get_by_user(user_id):
-        sessions = []
-        for session_data in db.workout_sessions.find({"user_id": user_id}).sort("start_time", -1):
-            sessions.append(WorkoutSession(
-                plan_id=session_data['plan_id'],
-                user_id=session_data['user_id'],
-                session_id=session_data['_id'],
-                start_time=session_data.get('start_time'),
-                end_time=session_data.get('end_time'),
-                exercises_completed=session_data.get('exercises_completed', []),
-                notes=session_data.get('notes', "")
-            ))
-        return sessions
+        # Only touch the completion fields so concurrent set appends are never overwritten
+        previous = db.workout_sessions.find_one_and_update(
+            {"_id": self.id},
+            {
+                "$set": {"end_time": self.end_time, "notes": self.notes},
+                "$setOnInsert": {
+                    "plan_id": self.plan_id,
+                    "user_id": self.user_id,
+                    "start_time": self.start_time,
+                    "exercises_completed": self.exercises_completed
+                }
+            },
+            projection={"end_time": 1, "volume_by_exercise": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        # Only the first completion counts towards the user's stats
+        if not previous or not previous.get('end_time'):
+            UserStats.workout_completed(self.user_id, self.end_time)
+            ActivityIndex.mark(self.user_id, self.end_time.date())
+            import leaderboard
+            volume = leaderboard.session_volume(previous) if previous else sum(
+                PersonalRecords.volume(exercise.get('sets', [])) for exercise in self.exercises_completed
+                if PersonalRecords.is_trackable(exercise.get('exercise_key')))
+            leaderboard.record_workout(self.user_id, self.end_time, volume,
+                                       ActivityIndex.get(self.user_id).current_streak(self.end_time.date()))
+        DataVersion.bump(self.user_id)
+        ProgressSeries.invalidate(self.user_id)
+        return self
+    
+    def delete(self):
+        deleted = db.workout_sessions.find_one_and_delete(
+            {"_id": self.id, "user_id": self.user_id},
+            projection={"end_time": 1, "volume_by_exercise": 1}
+        )
+        if not deleted:
+            deleted = SessionArchive.remove_session(self.user_id, self.id)
+        if deleted and deleted.get('end_time'):
+            UserStats.workout_removed(self.user_id, deleted['end_time'])
+            ActivityIndex.unmark_if_inactive(self.user_id, deleted['end_time'].date())
+            import leaderboard
+            leaderboard.remove_workout(self.user_id, deleted['end_time'], leaderboard.session_volume(deleted))
+        if deleted:
+            # Records can't be decremented; recompute them (and bump the data version) without this session
+            PersonalRecords.rebuild(self.user_id)
+            ProgressSeries.invalidate(self.user_id)
+    
+    @staticmethod
+    def append_exercise(session_id, user_id, exercise_data, sync_key=None):
+        """Append one completed exercise in a single round trip.
+        
+        The ownership check is part of the filter, and `$push` never rewrites
+        what is already stored, so concurrent tabs or replayed offline posts
+        cannot drop each other's data. With a `sync_key` the append is
+        skipped if the session already holds that key (see bulk_append).
+        Returns False if the session does not exist or belongs to another user.
+        
+        Records and the data version are then updated with one write each.
+        They live in other collections, so no single command can cover them
+        (a transaction would add round trips, not save any), and the order
+        matters: records need the session's new running volume, and the
+        version is bumped last so a page cached in between is not stored
+        under the new ETag.
+        """
+        exercise_key = exercise_data.get('exercise_key')
+        update = {"$push": {"exercises_completed": exercise_data}}
+        if PersonalRecords.is_trackable(exercise_key):
+            update["$inc"] = {f"volume_by_exercise.{exercise_key}": PersonalRecords.volume(exercise_data['sets'])}
+        query = {"_id": session_id, "user_id": user_id}
+        if sync_key:
+            query["sync_keys"] = {"$ne": sync_key}
+            update["$push"]["sync_keys"] = sync_key
+        session_data = db.workout_sessions.find_one_and_update(
+            query,
+            update,
+            projection={"volume_by_exercise": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if session_data is None:
+            return bool(sync_key) and WorkoutSession._holds_sync_key(session_id, user_id, sync_key)
+        
+        if "$inc" in update:
+            PersonalRecords.record(user_id, session_id, exercise_key, exercise_data['sets'],
+                                   session_data['volume_by_exercise'][exercise_key])
+        DataVersion.bump(user_id)
+        return True
+    
+    @staticmethod
+    def log_set(session_id, user_id, set_data, sync_key=None):
+        """Record a single set in the session's append-only `set_log` as it happens, once per `sync_key`"""
+        query = {"_id": session_id, "user_id": user_id}
+        update = {"$push": {"set_log": set_data}}
+        if sync_key:
+            query["sync_keys"] = {"$ne": sync_key}
+            update["$push"]["sync_keys"] = sync_key
+        result = db.workout_sessions.update_one(query, update)
+        if result.matched_count:
+            DataVersion.bump(user_id)
+            return True
+        return bool(sync_key) and WorkoutSession._holds_sync_key(session_id, user_id, sync_key)
+    
+    @staticmethod
+    def _holds_sync_key(session_id, user_id, sync_key):
+        """Whether a keyed write that matched nothing was already applied (rather than the session missing)"""
+        return db.workout_sessions.count_documents(
+            {"_id": session_id, "user_id": user_id, "sync_keys": sync_key}, limit=1) > 0
+    
+    @staticmethod
+    def bulk_append(user_id, ops):
+        """Apply queued offline appends with one bulk_write, exactly once per key.
+        
+        Each op is a dict with `key` (client idempotency key), `session_id`,
+        `field` (one of APPENDABLE_FIELDS) and `value`. The key is pushed to
+        the session's `sync_keys` in the same update that appends the value,
+        and the filter skips sessions that already hold it, so replays are
+        no-ops. Returns {key: status} with status 'committed', 'duplicate',
+        'not_found' or 'error' (only 'error' is worth retrying).
+        """
+        statuses = {}
+        session_ids = list({op['session_id'] for op in ops})
+        applied = {}
+        for session_data in db.workout_sessions.find(
+                {"_id": {"$in": session_ids}, "user_id": user_id}, {"sync_keys": 1}):
+            applied[session_data['_id']] = set(session_data.get('sync_keys', []))
+        
+        pending = []
+        for op in ops:
+            if op['session_id'] not in applied:
+                statuses[op['key']] = 'not_found'
+            elif op['key'] in applied[op['session_id']]:
+                statuses[op['key']] = 'duplicate'
+            else:
+                # Guard against the same key appearing twice in one batch
+                applied[op['session_id']].add(op['key'])
+                pending.append(op)
+        
+        if not pending:
+            return statuses
+        
+        requests = [
+            UpdateOne(
+                {"_id": op['session_id'], "user_id": user_id, "sync_keys": {"$ne": op['key']}},
+                WorkoutSession._sync_update(op)
+            )
+            for op in pending
+        ]
+        failed = set()
+        try:
+            db.workout_sessions.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            failed = {error['index'] for error in e.details.get('writeErrors', [])}
+        
+        # A request that matched nothing lost a race with a concurrent replay
+        # of the same key, which stored the value once; both count as committed
+        for index, op in enumerate(pending):
+            statuses[op['key']] = 'error' if index in failed else 'committed'
+        if len(failed) < len(pending):
+            WorkoutSession._record_synced_exercises(
+                user_id, [op for index, op in enumerate(pending) if index not in failed])
+            DataVersion.bump(user_id)
+        return statuses
+    
+    @staticmethod
+    def _sync_update(op):
+        update = {"$push": {op['field']: op['value'], "sync_keys": op['key']}}
+        exercise_key = op['value'].get('exercise_key')
+        if op['field'] == 'exercises_completed' and PersonalRecords.is_trackable(exercise_key):
+            update["$inc"] = {f"volume_by_exercise.{exercise_key}": PersonalRecords.volume(op['value']['sets'])}
+        return update
+    
+    @staticmethod
+    def _record_synced_exercises(user_id, ops):
+        """Feed exercises that arrived through bulk_append into the record index"""
+        ops = [op for op in ops
+               if op['field'] == 'exercises_completed' and PersonalRecords.is_trackable(op['value'].get('exercise_key'))]
+        if not ops:
+            return
+        volumes = {
+            session_data['_id']: session_data.get('volume_by_exercise', {})
+            for session_data in db.workout_sessions.find(
+                {"_id": {"$in": list({op['session_id'] for op in ops})}}, {"volume_by_exercise": 1})
+        }
+        for op in ops:
+            exercise_key = op['value']['exercise_key']
+            PersonalRecords.record(user_id, op['session_id'], exercise_key, op['value']['sets'],
+                                   volumes.get(op['session_id'], {}).get(exercise_key, 0))
+    
+    @staticmethod
+    def get_by_user(user_id, limit=None, summary=False):
+        projection = WorkoutSession.SUMMARY_PROJECTION if summary else None
+        cursor = db.workout_sessions.find({"user_id": user_id}, projection).sort([("start_time", -1), ("_id", -1)])
+        if limit:
+            cursor = cursor.limit(limit)
+        documents = WorkoutSession.newest_first(cursor, SessionArchive.sessions(user_id, newest_first=True, summary=summary))
+        return [WorkoutSession.from_document(session_data, summary)
+                for session_data in itertools.islice(documents, limit or None)]
+    
+    @staticmethod
+    def newest_first(hot, cold):
+        """Merge hot and archived sessions, each already sorted newest first, on (start_time, _id)"""
+        return heapq.merge(hot, cold, key=lambda s: (s['start_time'], s['_id']), reverse=True)
+    
+    @staticmethod
+    def get_page(user_id, limit=20, cursor=None, completed_only=False, summary=True):
+        """One page of a user's sessions, newest first, using keyset pagination.
+        
+        Pages are positioned on (start_time, _id) rather than skipped over, so
+        every page is a bounded walk of the user_id/start_time index. Returns
+        the sessions and the cursor for the next page (None on the last page).
+        """
+        query = {"user_id": user_id}
+        if completed_only:
+            query["end_time"] = {"$ne": None}
+        if cursor:
+            start_time, session_id = decode_page_cursor(cursor)
+            query["$or"] = [
+                {"start_time": {"$lt": start_time}},
+                {"start_time": start_time, "_id": {"$lt": session_id}}
+            ]
+        
+        projection = WorkoutSession.SUMMARY_PROJECTION if summary else None
+        results = list(db.workout_sessions.find(query, projection).sort([("start_time", -1), ("_id", -1)]).limit(limit + 1))
+        # Archived sessions all started before the horizon, so recent pages never look at them
+        if len(results) <= limit or results[-1]['start_time'] < SessionArchive.horizon():
+            cold = SessionArchive.sessions(user_id, before=(start_time, session_id) if cursor else None,
+                                           newest_first=True, summary=summary)
+            if completed_only:
+                cold = (session_data for session_data in cold if session_data.get('end_time'))
+            results = itertools.islice(WorkoutSession.newest_first(results, cold), limit + 1)
+        sessions = [WorkoutSession.from_document(session_data, summary) for session_data in results]
+        
+        next_cursor = None
+        if len(sessions) > limit:
+            sessions = sessions[:limit]
+            next_cursor = encode_page_cursor(sessions[-1].start_time, sessions[-1].id)
+        return sessions, next_cursor
+    
+    @staticmethod
+    def get_recent_completed(user_id, since=None, limit=5):
+        """Most recently started completed sessions (started at or after `since`), newest first, without their sets.
+        
+        Bounding start_time rather than end_time keeps this a range walk of
+        the (user_id, start_time, _id) history index, already in sort order.
+        """
+        query = {"user_id": user_id, "end_time": {"$ne": None}}
+        if since:
+            query["start_time"] = {"$gte": since}
+        cursor = db.workout_sessions.find(query, WorkoutSession.SUMMARY_PROJECTION) \
+            .sort([("start_time", -1), ("_id", -1)]).limit(limit)
+        if SessionArchive.reaches(since):
+            cold = (session_data for session_data in SessionArchive.sessions(user_id, newest_first=True, summary=True)
+                    if session_data['end_time'] and (since is None or session_data['start_time'] >= since))
+            cursor = itertools.islice(WorkoutSession.newest_first(cursor, cold), limit)
+        return [WorkoutSession.from_document(session_data, summary=True) for session_data in cursor]
+    
+    @staticmethod
+    def completed_query(user_id, start=None, end=None):
+        """Filter for a user's finished sessions, optionally bounded by end_time [start, end)"""
+        end_time = {"$ne": None}
+        if start:
+            end_time["$gte"] = start
+        if end:
+            end_time["$lt"] = end
+        return {"user_id": user_id, "end_time": end_time}
+    
+    @staticmethod
+    def monthly_counts(user_id, start=None, end=None):
+        """Number of completed workouts per 'YYYY-MM', computed server-side"""
+        pipeline = [
+            {"$match": WorkoutSession.completed_query(user_id, start, end)},
+            {"$group": {
+                "_id": {"$dateToString": {"format": "%Y-%m", "date": "$end_time"}},
+                "count": {"$sum": 1}
+            }},
+            {"$sort": {"_id": 1}}
+        ]
+        counts = {row['_id']: row['count'] for row in db.workout_sessions.aggregate(pipeline)}
+        archived = SessionArchive.completed_days(user_id, start, end)
+        if archived:
+            for day_key, count in archived.items():
+                counts[day_key[:7]] = counts.get(day_key[:7], 0) + count
+            counts = dict(sorted(counts.items()))
+        return counts
+    
+    @staticmethod
+    def exercise_volume(user_id, start=None, end=None, exercise_keys=None, bucket=None):
+        """Per-exercise volume series ({exercise_key: [{date, volume}, ...]}), oldest first"""
+        return {
+            exercise_key: [{'date': day.isoformat(), 'volume': volume} for day, volume in points]
+            for exercise_key, points in WorkoutSession.volume_points(user_id, start, end, exercise_keys, bucket).items()
+        }
+    
+    @staticmethod
+    def volume_points(user_id, start=None, end=None, exercise_keys=None, bucket=None):
+        """Per-exercise volume as {exercise_key: [(datetime, volume), ...]}, oldest first.
+        
+        With `bucket` ('day', 'week' or 'month') volume is summed per period
+        and dated at the period start (weeks start on Monday); otherwise there
+        is one point per session.
+        """
+        time_key = "$end_time"
+        if bucket:
+            time_key = {"$dateTrunc": {"date": "$end_time", "unit": bucket, "startOfWeek": "monday"}}
+        pipeline = [
+            {"$match": WorkoutSession.completed_query(user_id, start, end)},
+            {"$project": {"end_time": 1, "exercises_completed": 1}},
+            {"$unwind": "$exercises_completed"}
+        ]
+        if exercise_keys:
+            pipeline.append({"$match": {"exercises_completed.exercise_key": {"$in": list(exercise_keys)}}})
+        pipeline += [
+            {"$project": {
+                "end_time": 1,
+                "exercise_key": "$exercises_completed.exercise_key",
+                "volume": {"$sum": {"$map": {
+                    "input": {"$ifNull": ["$exercises_completed.sets", []]},
+                    "as": "set",
+                    "in": {"$multiply": ["$$set.reps", "$$set.weight"]}
+                }}}
+            }},
+            {"$group": {
+                "_id": {"exercise_key": "$exercise_key", "end_time": time_key},
+                "volume": {"$sum": "$volume"}
+            }},
+            {"$sort": {"_id.end_time": 1}},
+            {"$group": {
+                "_id": "$_id.exercise_key",
+                "points": {"$push": {"date": "$_id.end_time", "volume": "$volume"}}
+            }}
+        ]
+        
+        series = {
+            row['_id']: [(point['date'], point['volume']) for point in row['points']]
+            for row in db.workout_sessions.aggregate(pipeline)
+        }
+        # Archived sessions contribute from their bucket summaries, without decompressing the sets
+        archived = {}
+        for summary in SessionArchive.completed_summaries(user_id, start, end):
+            at = truncate_time(summary['end_time'], bucket) if bucket else summary['end_time']
+            for exercise_key, volume in summary['volumes']:
+                if not exercise_keys or exercise_key in exercise_keys:
+                    points = archived.setdefault(exercise_key, {})
+                    points[at] = points.get(at, 0) + volume
+        for exercise_key, points in archived.items():
+            for at, volume in series.get(exercise_key, []):
+                points[at] = points.get(at, 0) + volume
+            series[exercise_key] = sorted(points.items())
+        return series
+    
+    @staticmethod
+    def exercise_keys(user_id, start=None, end=None):
+        """Distinct exercises the user has logged in completed sessions"""
+        query = WorkoutSession.completed_query(user_id, start, end)
+        keys = set(db.workout_sessions.distinct("exercises_completed.exercise_key", query))
+        keys.update(key for summary in SessionArchive.completed_summaries(user_id, start, end)
+                    for key, _ in summary['volumes'])
+        return sorted(k for k in keys if k)
     
     @staticmethod
     def get(session_id):
         session_data = db.workout_sessions.find_one({"_id": session_id})
         if session_data:
-            return WorkoutSession(
-                plan_id=session_data['plan_id'],
-                user_id=session_data['user_id'],
-                session_id=session_data['_id'],
-                start_time=session_data.get('start_time'),
-                end_time=session_data.get('end_time'),
-                exercises_completed=session_data.get('exercises_completed', []),
-                notes=session_data.get('notes', "")
+            return WorkoutSession.from_document(session_data)
+        return None
+
+declare_indexes(
+    "workout_sessions",
+    # History pages, newest first, keyset-paginated on (start_time, _id); also get_recent_completed
+    ([("user_id", 1), ("start_time", -1), ("_id", -1)], {}),
+    # completed_query: finished sessions, optionally in an end_time range
+    ([("user_id", 1), ("end_time", 1)], {})
+)
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def truncate_time(value, bucket):
+    """Start of the day, Monday-start week or month containing `value` (as $dateTrunc)"""
+    day = datetime(value.year, value.month, value.day)
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return month_start(value)
+    return day
+
+class SessionArchive:
+    """Cold workout history: one `workout_archive` document per user and month.
+    
+    `archive` moves sessions started before a whole-month cutoff out of
+    `workout_sessions` into buckets keyed by the month of their start_time.
+    A bucket keeps precomputed counts (sessions, completed sessions per day,
+    sets), volume per exercise for the month, a small summary of each
+    session (times, plan, notes, per-exercise volume) and the complete
+    session documents as zlib-compressed BSON, so `restore` can put every
+    session back exactly as it was.
+    
+    Only sessions older than HORIZON_DAYS are ever archived. Reads whose
+    window starts after that (the dashboard, training reports, recent
+    sessions, the first history pages) therefore only query hot sessions;
+    full-history reads merge in the buckets' summaries, and only the few
+    that need every set (record rebuilds, exports) decompress them.
+    """
+    # Floor on the archive age; the analytics window (13 weeks) must stay hot
+    HORIZON_DAYS = 120
+    ARCHIVE_AFTER_DAYS = max(HORIZON_DAYS, int(os.environ.get("ARCHIVE_AFTER_DAYS", 365)))
+    COMPRESSION_LEVEL = 6
+    # Everything but the compressed sessions and records, for reads that only need the summaries
+    SUMMARY_PROJECTION = {"payload": 0, "records": 0}
+    
+    @staticmethod
+    def horizon():
+        return datetime.utcnow() - timedelta(days=SessionArchive.HORIZON_DAYS)
+    
+    @staticmethod
+    def reaches(start):
+        """Whether a read of sessions from `start` (None: all history) can find archived ones"""
+        return start is None or start < SessionArchive.horizon()
+    
+    @staticmethod
+    def bucket_id(user_id, month):
+        return f"{user_id}:{month:%Y-%m}"
+    
+    @staticmethod
+    def session_volumes(session_data):
+        """[(exercise_key, volume)] for each exercise logged in the session"""
+        volumes = {}
+        for exercise in session_data.get('exercises_completed', []):
+            key = exercise.get('exercise_key')
+            volumes[key] = volumes.get(key, 0) + PersonalRecords.volume(exercise.get('sets', []))
+        return [[key, volume] for key, volume in volumes.items() if key]
+    
+    @staticmethod
+    def build(user_id, month, sessions):
+        """The bucket document for a user's sessions started in `month`"""
+        sessions = sorted(sessions, key=lambda s: (s['start_time'], s['_id']))
+        raw = bson.encode({"sessions": sessions})
+        payload = zlib.compress(raw, SessionArchive.COMPRESSION_LEVEL)
+        completed_by_day = {}
+        volume_by_exercise = {}
+        summaries = []
+        for session_data in sessions:
+            end_time = session_data.get('end_time')
+            volumes = SessionArchive.session_volumes(session_data)
+            if end_time:
+                day_key = end_time.date().isoformat()
+                completed_by_day[day_key] = completed_by_day.get(day_key, 0) + 1
+                for key, volume in volumes:
+                    if PersonalRecords.is_trackable(key):
+                        volume_by_exercise[key] = volume_by_exercise.get(key, 0) + volume
+            summaries.append({
+                "_id": session_data['_id'],
+                "user_id": user_id,
+                "plan_id": session_data.get('plan_id'),
+                "start_time": session_data['start_time'],
+                "end_time": end_time,
+                "notes": session_data.get('notes', ""),
+                "volumes": volumes
+            })
+        return {
+            "_id": SessionArchive.bucket_id(user_id, month),
+            "user_id": user_id,
+            "month": month,
+            "session_count": len(sessions),
+            "completed_count": sum(completed_by_day.values()),
+            "set_count": sum(len(e.get('sets', [])) for s in sessions for e in s.get('exercises_completed', [])),
+            "completed_by_day": completed_by_day,
+            "volume_by_exercise": volume_by_exercise,
+            "last_end": max((s['end_time'] for s in summaries if s['end_time']), default=None),
+            # The month's personal records, so PersonalRecords.rebuild needn't decompress anything
+            "records": PersonalRecords.from_sessions(sessions),
+            "sessions": summaries,
+            "payload": Binary(payload),
+            "raw_bytes": len(raw),
+            "compressed_bytes": len(payload),
+            "archived_at": datetime.utcnow()
+        }
+    
+    @staticmethod
+    def decode(bucket):
+        """The complete session documents stored in a bucket, oldest first"""
+        return bson.decode(zlib.decompress(bucket['payload']))['sessions']
+    
+    @staticmethod
+    def buckets(user_id, first_month=None, last_month=None, newest_first=False, projection=SUMMARY_PROJECTION):
+        """The user's buckets for months in [first_month, last_month], in month order"""
+        query = {"user_id": user_id}
+        if first_month or last_month:
+            query["month"] = {}
+            if first_month:
+                query["month"]["$gte"] = first_month
+            if last_month:
+                query["month"]["$lte"] = last_month
+        return db.workout_archive.find(query, projection).sort("month", -1 if newest_first else 1)
+    
+    @staticmethod
+    def completed_summaries(user_id, start=None, end=None):
+        """Summaries of archived sessions that ended in [start, end), as completed_query selects hot ones"""
+        if not SessionArchive.reaches(start):
+            return
+        # A session ending in range may have started the month before
+        first_month = add_months(month_start(start), -1) if start else None
+        last_month = month_start(end) if end else None
+        for bucket in SessionArchive.buckets(user_id, first_month, last_month):
+            for summary in bucket['sessions']:
+                end_time = summary['end_time']
+                if end_time and (start is None or end_time >= start) and (end is None or end_time < end):
+                    yield summary
+    
+    @staticmethod
+    def sessions(user_id, before=None, after=None, newest_first=False, summary=False):
+        """Archived sessions in start_time order, optionally only those before a (start_time, _id) position.
+        
+        `after` skips the months that can't hold sessions ending after it.
+        Yields summaries with `summary`, else complete documents (one
+        bucket decompressed at a time).
+        """
+        first_month = add_months(month_start(after), -1) if after else None
+        last_month = month_start(before[0]) if before else None
+        projection = SessionArchive.SUMMARY_PROJECTION if summary else None
+        for bucket in SessionArchive.buckets(user_id, first_month, last_month, newest_first=newest_first,
+                                             projection=projection):
+            items = bucket['sessions'] if summary else SessionArchive.decode(bucket)
+            if newest_first:
+                items = reversed(items)
+            for item in items:
+                if before is None or (item['start_time'], item['_id']) < before:
+                    yield item
+    
+    @staticmethod
+    def completed_days(user_id, start=None, end=None):
+        """{'YYYY-MM-DD': completed sessions} from the precomputed bucket counts, for days in [start, end)"""
+        days = {}
+        if not SessionArchive.reaches(start):
+            return days
+        first_month = add_months(month_start(start), -1) if start else None
+        last_month = month_start(end) if end else None
+        first_day = start.date().isoformat() if start else None
+        last_day = end.date().isoformat() if end else None
+        for bucket in SessionArchive.buckets(user_id, first_month, last_month, projection={"completed_by_day": 1}):
+            for day_key, count in bucket['completed_by_day'].items():
+                if (first_day is None or day_key >= first_day) and (last_day is None or day_key < last_day):
+                    days[day_key] = days.get(day_key, 0) + count
+        return days
+    
+    @staticmethod
+    def get_session(session_id):
+        bucket = db.workout_archive.find_one({"sessions._id": session_id})
+        if bucket:
+            for session_data in SessionArchive.decode(bucket):
+                if session_data['_id'] == session_id:
+                    return session_data
+        return None
+    
+    @staticmethod
+    def archived_ids(session_ids):
+        """Which of `session_ids` are in a bucket"""
+        session_ids = set(session_ids)
+        if not session_ids:
+            return set()
+        buckets = db.workout_archive.find({"sessions._id": {"$in": list(session_ids)}}, {"sessions._id": 1})
+        return {s['_id'] for bucket in buckets for s in bucket['sessions'] if s['_id'] in session_ids}
+    
+    @staticmethod
+    def _replace(bucket_data, sessions):
+        """Rewrite a bucket with `sessions` (deleting it when empty) unless it changed since it was read"""
+        query = {"_id": bucket_data['_id'], "version": bucket_data['version']}
+        if not sessions:
+            return db.workout_archive.delete_one(query).deleted_count > 0
+        bucket = SessionArchive.build(bucket_data['user_id'], bucket_data['month'], sessions)
+        bucket["version"] = bucket_data['version'] + 1
+        return db.workout_archive.replace_one(query, bucket).matched_count > 0
+    
+    @staticmethod
+    def remove_session(user_id, session_id):
+        """Delete one archived session; returns its document, or None if it isn't archived"""
+        for _ in range(3):
+            bucket_data = db.workout_archive.find_one({"user_id": user_id, "sessions._id": session_id})
+            if not bucket_data:
+                return None
+            sessions = SessionArchive.decode(bucket_data)
+            removed = next(s for s in sessions if s['_id'] == session_id)
+            if SessionArchive._replace(bucket_data, [s for s in sessions if s['_id'] != session_id]):
+                return removed
+        raise RuntimeError(f"Archive bucket for session {session_id} kept changing")
+    
+    @staticmethod
+    def archive_user(user_id, cutoff):
+        """Move the user's sessions started before `cutoff` into their monthly buckets.
+        
+        The bucket is written before the hot sessions are deleted, so an
+        interrupted run leaves sessions in both places until it is rerun,
+        never in neither. Returns (sessions archived, buckets written).
+        """
+        archived = written = 0
+        cursor = db.workout_sessions.find({"user_id": user_id, "start_time": {"$lt": cutoff}}) \
+            .sort([("start_time", 1), ("_id", 1)])
+        for month, group in itertools.groupby(cursor, key=lambda s: month_start(s['start_time'])):
+            hot = list(group)
+            for _ in range(3):
+                existing = db.workout_archive.find_one({"_id": SessionArchive.bucket_id(user_id, month)})
+                sessions = {s['_id']: s for s in SessionArchive.decode(existing)} if existing else {}
+                sessions.update((s['_id'], s) for s in hot)
+                if existing:
+                    stored = SessionArchive._replace(existing, list(sessions.values()))
+                else:
+                    try:
+                        bucket = SessionArchive.build(user_id, month, sessions.values())
+                        db.workout_archive.insert_one(dict(bucket, version=1))
+                        stored = True
+                    except DuplicateKeyError:
+                        stored = False
+                if stored:
+                    break
+            else:
+                raise RuntimeError(f"Archive bucket {SessionArchive.bucket_id(user_id, month)} kept changing")
+            db.workout_sessions.delete_many({"_id": {"$in": [s['_id'] for s in hot]}, "user_id": user_id})
+            archived += len(hot)
+            written += 1
+        return archived, written
+    
+    @staticmethod
+    def archive(older_than_days=None, user_id=None, progress=None):
+        """Archive every user's (or one user's) sessions started before the month `older_than_days` ago falls in.
+        
+        `progress(done, total)` is called after each user (see jobs.py).
+        """
+        older_than_days = older_than_days or SessionArchive.ARCHIVE_AFTER_DAYS
+        if older_than_days < SessionArchive.HORIZON_DAYS:
+            raise ValueError(f"Sessions younger than {SessionArchive.HORIZON_DAYS} days are never archived")
+        cutoff = month_start(datetime.utcnow() - timedelta(days=older_than_days))
+        totals = {'users': 0, 'sessions': 0, 'buckets': 0, 'cutoff': cutoff.isoformat()}
+        user_ids = [user_id] if user_id else (u['_id'] for u in db.users.find({}, {"_id": 1}))
+        total = 1 if user_id else db.users.estimated_document_count() if progress else None
+        for uid in user_ids:
+            archived, written = SessionArchive.archive_user(uid, cutoff)
+            totals['users'] += 1
+            totals['sessions'] += archived
+            totals['buckets'] += written
+            if progress:
+                progress(totals['users'], total)
+        return totals
+    
+    @staticmethod
+    def restore(user_id):
+        """Move all of a user's archived sessions back into `workout_sessions`; returns how many"""
+        restored = 0
+        for bucket_data in SessionArchive.buckets(user_id, projection=None):
+            sessions = SessionArchive.decode(bucket_data)
+            try:
+                db.workout_sessions.insert_many(sessions, ordered=False)
+            except BulkWriteError as e:
+                # Left behind by an interrupted archive run
+                if any(error['code'] != 11000 for error in e.details.get('writeErrors', [])):
+                    raise
+            db.workout_archive.delete_one({"_id": bucket_data['_id']})
+            restored += len(sessions)
+        return restored
+    
+    @staticmethod
+    def stats(user_id=None):
+        """Bucket, session and byte totals, for reporting what archiving saved"""
+        match = {"user_id": user_id} if user_id else {}
+        rows = list(db.workout_archive.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": None,
+                "buckets": {"$sum": 1},
+                "sessions": {"$sum": "$session_count"},
+                "raw_bytes": {"$sum": "$raw_bytes"},
+                "compressed_bytes": {"$sum": "$compressed_bytes"}
+            }}
+        ]))
+        totals = rows[0] if rows else {"buckets": 0, "sessions": 0, "raw_bytes": 0, "compressed_bytes": 0}
+        totals.pop("_id", None)
+        return totals
+
+declare_indexes(
+    "workout_archive",
+    # Month ranges of one user's history
+    ([("user_id", 1), ("month", 1)], {}),
+    # Archived session lookups by id (get_session, remove_session, import de-duplication)
+    ([("sessions._id", 1)], {})
+)
+
+class ProgressSeries:
+    """Per-user cache of full-history volume series, one entry per bucket size.
+    
+    Entries are tagged with the user's DataVersion, which every workout write
+    (including finishing one) bumps, so a stale entry is recomputed on the
+    next read in every worker. Date-range filtering and downsampling are
+    applied to the cached series.
+    """
+    BUCKETS = ('day', 'week', 'month')
+    _cache = TTLCache(
+        maxsize=int(os.environ.get("PROGRESS_CACHE_SIZE", 2048)),
+        ttl=float(os.environ.get("PROGRESS_CACHE_TTL", 600))
+    )
+    
+    @staticmethod
+    def get(user_id, bucket=None, version=None):
+        """{exercise_key: [(datetime, volume), ...]} for the user's whole history"""
+        if version is None:
+            version = DataVersion.get(user_id)[0]
+        cached = ProgressSeries._cache.get((user_id, bucket))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        
+        series = WorkoutSession.volume_points(user_id, bucket=bucket)
+        ProgressSeries._cache.set((user_id, bucket), (version, series))
+        return series
+    
+    @staticmethod
+    def chart_data(user_id, exercise_keys, start=None, end=None, bucket=None, max_points=None, version=None):
+        """Series for the requested exercises within [start, end), LTTB-downsampled to `max_points`.
+        
+        Returns ({exercise_key: [{date, volume}, ...]}, {exercise_key: points before downsampling}).
+        """
+        series = ProgressSeries.get(user_id, bucket, version)
+        exercise_data = {}
+        sizes = {}
+        for exercise_key in exercise_keys:
+            points = [
+                (day.timestamp(), volume, day) for day, volume in series.get(exercise_key, [])
+                if (start is None or day >= start) and (end is None or day < end)
+            ]
+            sizes[exercise_key] = len(points)
+            if max_points:
+                points = lttb(points, max_points)
+            exercise_data[exercise_key] = [{'date': day.isoformat(), 'volume': volume} for _, volume, day in points]
+        return exercise_data, sizes
+    
+    @staticmethod
+    def invalidate(user_id):
+        for bucket in (None,) + ProgressSeries.BUCKETS:
+            ProgressSeries._cache.invalidate((user_id, bucket))
+    
+    @staticmethod
+    def cache_stats():
+        return ProgressSeries._cache.stats()
+
+class PersonalRecords:
+    """Per-user personal records for every exercise, kept in one `personal_records` document.
+    
+    For each exercise it holds the heaviest set (`best_weight`), the most
+    reps done at each weight (`reps_at_weight`, keyed by the weight with '.'
+    written as '_'), the highest volume in one session (`best_volume`) and
+    the best estimated one-rep max by the Epley and Brzycki formulas. Records
+    are raised with a single conditional pipeline update as exercises are
+    logged, so reading them never touches the sessions; `rebuild` recomputes
+    them from history.
+    """
+    # Estimated 1RM formulas get unreliable on long sets; ignore sets above this
+    E1RM_MAX_REPS = 12
+    TRACKED = ('best_weight', 'best_volume', 'e1rm_epley', 'e1rm_brzycki')
+    FIELD_KEY = re.compile(r"^[A-Za-z0-9_-]+$")
+    
+    def __init__(self, user_id, exercises=None):
+        self.user_id = user_id
+        self.exercises = exercises or {}
+    
+    @staticmethod
+    def is_trackable(exercise_key):
+        """Exercise keys are used as field names, so only plain identifiers are indexed"""
+        return isinstance(exercise_key, str) and bool(PersonalRecords.FIELD_KEY.match(exercise_key))
+    
+    @staticmethod
+    def volume(sets):
+        return sum(s.get('reps', 0) * s.get('weight', 0) for s in sets)
+    
+    @staticmethod
+    def weight_key(weight):
+        return f"{weight:g}".replace('.', '_')
+    
+    @staticmethod
+    def epley(weight, reps):
+        return round(weight * (1 + reps / 30), 1) if reps > 1 else weight
+    
+    @staticmethod
+    def brzycki(weight, reps):
+        return round(weight * 36 / (37 - reps), 1) if reps > 1 else weight
+    
+    @staticmethod
+    def candidates(sets, session_volume, session_id, at):
+        """The best values a group of sets (plus its session's volume) can set as records"""
+        found = {'reps_at_weight': {}}
+        for s in sets:
+            reps, weight = s.get('reps', 0), s.get('weight', 0)
+            if reps <= 0:
+                continue
+            weight_key = PersonalRecords.weight_key(weight)
+            found['reps_at_weight'][weight_key] = max(found['reps_at_weight'].get(weight_key, 0), reps)
+            
+            best = found.get('best_weight')
+            if best is None or weight > best['value'] or (weight == best['value'] and reps > best['reps']):
+                found['best_weight'] = {'value': weight, 'reps': reps, 'at': at, 'session_id': session_id}
+            
+            if weight > 0 and reps <= PersonalRecords.E1RM_MAX_REPS:
+                for name, formula in (('e1rm_epley', PersonalRecords.epley), ('e1rm_brzycki', PersonalRecords.brzycki)):
+                    value = formula(weight, reps)
+                    if name not in found or value > found[name]['value']:
+                        found[name] = {'value': value, 'weight': weight, 'reps': reps, 'at': at, 'session_id': session_id}
+        
+        if session_volume > 0:
+            found['best_volume'] = {'value': session_volume, 'at': at, 'session_id': session_id}
+        return found
+    
+    @staticmethod
+    def record(user_id, session_id, exercise_key, sets, session_volume, at=None):
+        """Raise the user's records for one logged exercise in a single atomic update"""
+        at = at or datetime.utcnow()
+        found = PersonalRecords.candidates(sets, session_volume, session_id, at)
+        prefix = f"exercises.{exercise_key}"
+        
+        fields = {f"{prefix}.updated_at": at}
+        for name in PersonalRecords.TRACKED:
+            if name not in found:
+                continue
+            path = f"{prefix}.{name}"
+            fields[path] = {"$cond": [
+                {"$gt": [found[name]['value'], {"$ifNull": [f"${path}.value", -1]}]},
+                {"$literal": found[name]},
+                f"${path}"
+            ]}
+        for weight_key, reps in found['reps_at_weight'].items():
+            path = f"{prefix}.reps_at_weight.{weight_key}"
+            fields[path] = {"$max": [reps, f"${path}"]}
+        
+        db.personal_records.update_one({"_id": user_id}, [{"$set": fields}], upsert=True)
+    
+    @staticmethod
+    def get(user_id):
+        records_data = db.personal_records.find_one({"_id": user_id})
+        return PersonalRecords(user_id, (records_data or {}).get('exercises', {}))
+    
+    def for_exercise(self, exercise_key):
+        return self.exercises.get(exercise_key, {})
+    
+    def recent(self, limit=5):
+        """(exercise_key, records) for the exercises whose records changed most recently"""
+        items = sorted(self.exercises.items(), key=lambda item: item[1].get('updated_at') or datetime.min, reverse=True)
+        return items[:limit]
+    
+    def to_json(self):
+        """JSON-friendly records, with weights in reps_at_weight turned back into numbers"""
+        exercises = {}
+        for exercise_key, records in self.exercises.items():
+            item = {}
+            for name in PersonalRecords.TRACKED:
+                if name in records:
+                    at = records[name].get('at')
+                    item[name] = dict(records[name], at=at.isoformat() if at else None)
+            item['reps_at_weight'] = {
+                weight_key.replace('_', '.'): reps for weight_key, reps in records.get('reps_at_weight', {}).items()
+            }
+            exercises[exercise_key] = item
+        return exercises
+    
+    @staticmethod
+    def merge(exercises, exercise_key, found, at):
+        """Fold one exercise's candidates (or a partial record set) into `exercises`"""
+        records = exercises.setdefault(exercise_key, {'reps_at_weight': {}})
+        for name in PersonalRecords.TRACKED:
+            if name in found and found[name]['value'] > records.get(name, {}).get('value', -1):
+                records[name] = found[name]
+        for weight_key, reps in found['reps_at_weight'].items():
+            records['reps_at_weight'][weight_key] = max(records['reps_at_weight'].get(weight_key, 0), reps)
+        if at and (records.get('updated_at') is None or at > records['updated_at']):
+            records['updated_at'] = at
+    
+    @staticmethod
+    def from_sessions(sessions, backfill=None):
+        """Records computed from session documents.
+        
+        With a `backfill` list, appends an update for every session whose
+        stored `volume_by_exercise` running totals are missing or wrong.
+        """
+        exercises = {}
+        for session_data in sessions:
+            at = session_data.get('end_time') or session_data.get('start_time')
+            sets_by_exercise = {}
+            for exercise in session_data.get('exercises_completed', []):
+                if PersonalRecords.is_trackable(exercise.get('exercise_key')):
+                    sets_by_exercise.setdefault(exercise['exercise_key'], []).extend(exercise.get('sets', []))
+            
+            volumes = {key: PersonalRecords.volume(sets) for key, sets in sets_by_exercise.items()}
+            if backfill is not None and session_data.get('volume_by_exercise') != volumes:
+                backfill.append(UpdateOne({"_id": session_data['_id']}, {"$set": {"volume_by_exercise": volumes}}))
+            
+            for exercise_key, sets in sets_by_exercise.items():
+                found = PersonalRecords.candidates(sets, volumes[exercise_key], session_data['_id'], at)
+                PersonalRecords.merge(exercises, exercise_key, found, at)
+        return exercises
+    
+    @staticmethod
+    def rebuild(user_id):
+        """Recompute the user's records from every logged exercise.
+        
+        Archived months contribute the records stored with their bucket, so
+        only hot sessions are read. Also backfills each hot session's
+        `volume_by_exercise` running totals, which sessions logged before the
+        index existed don't have.
+        """
+        exercises = {}
+        for bucket in SessionArchive.buckets(user_id, projection={"records": 1}):
+            for exercise_key, found in bucket.get('records', {}).items():
+                PersonalRecords.merge(exercises, exercise_key, found, found.get('updated_at'))
+        
+        backfill = []
+        cursor = db.workout_sessions.find(
+            {"user_id": user_id}, {"exercises_completed": 1, "start_time": 1, "end_time": 1, "volume_by_exercise": 1})
+        for exercise_key, found in PersonalRecords.from_sessions(cursor, backfill).items():
+            PersonalRecords.merge(exercises, exercise_key, found, found.get('updated_at'))
+        
+        if backfill:
+            db.workout_sessions.bulk_write(backfill, ordered=False)
+        db.personal_records.replace_one({"_id": user_id}, {"exercises": exercises}, upsert=True)
+        DataVersion.bump(user_id)
+        return PersonalRecords(user_id, exercises)
+    
+    @staticmethod
+    def rebuild_all():
+        count = 0
+        for user_data in db.users.find({}, {"_id": 1}):
+            PersonalRecords.rebuild(user_data['_id'])
+            count += 1
+        return count
+
+class DataVersion:
+    """Per-user counter bumped by every write to the user's profile, plans or sessions.
+    
+    Pages and API responses derive their ETag and Last-Modified from it (see
+    http_cache.py), so an unchanged page costs one point read instead of its
+    queries and template render.
+    """
+    
+    @staticmethod
+    def get(user_id):
+        """(version, updated_at) for the user; (0, None) before the first write"""
+        version_data = db.data_versions.find_one({"_id": user_id})
+        if version_data:
+            return version_data.get('version', 0), version_data.get('updated_at')
+        return 0, None
+    
+    @staticmethod
+    def bump(user_id):
+        db.data_versions.update_one(
+            {"_id": user_id},
+            {"$inc": {"version": 1}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+class UserStats:
+    """Per-user dashboard counters, kept up to date on every write.
+    
+    The dashboard reads this single document instead of scanning the user's
+    plans and sessions. `rebuild` recomputes it from the raw collections to
+    repair any drift.
+    """
+    RECENT_DAYS = 30
+    
+    def __init__(self, user_id, plans_by_level=None, total_workouts=0, daily_workouts=None,
+                 last_workout_at=None, updated_at=None):
+        self.user_id = user_id
+        self.plans_by_level = plans_by_level or {}
+        self.total_workouts = total_workouts
+        self.daily_workouts = daily_workouts or {}
+        self.last_workout_at = last_workout_at
+        self.updated_at = updated_at
+    
+    def total_plans(self, level=None):
+        if level:
+            return self.plans_by_level.get(level, 0)
+        return sum(self.plans_by_level.values())
+    
+    @property
+    def this_month(self):
+        """Workouts completed in the last RECENT_DAYS days"""
+        cutoff = UserStats.recent_cutoff()
+        return sum(count for day, count in self.daily_workouts.items() if day >= cutoff)
+    
+    @staticmethod
+    def recent_cutoff():
+        return (datetime.utcnow().date() - timedelta(days=UserStats.RECENT_DAYS)).isoformat()
+    
+    @staticmethod
+    def get(user_id):
+        stats_data = db.user_stats.find_one({"_id": user_id})
+        if stats_data:
+            return UserStats(
+                user_id=stats_data['_id'],
+                plans_by_level=stats_data.get('plans_by_level', {}),
+                total_workouts=stats_data.get('total_workouts', 0),
+                daily_workouts=stats_data.get('daily_workouts', {}),
+                last_workout_at=stats_data.get('last_workout_at'),
+                updated_at=stats_data.get('updated_at')
             )
-        return None
\ No newline at end of file
+        return UserStats(user_id=user_id)
+    
+    @staticmethod
+    def plan_changed(user_id, old_level=None, new_level=None):
+        increments = {}
+        if old_level:
+            increments[f"plans_by_level.{old_level}"] = -1
+        if new_level:
+            key = f"plans_by_level.{new_level}"
+            increments[key] = increments.get(key, 0) + 1
+        increments = {key: value for key, value in increments.items() if value}
+        if not increments:
+            return
+        db.user_stats.update_one(
+            {"_id": user_id},
+            {"$inc": increments, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+    
+    @staticmethod
+    def workout_completed(user_id, end_time):
+        day_key = end_time.date().isoformat()
+        
+        # Pipeline update so days that fell out of the recent window are pruned
+        # in the same atomic write that records the new workout
+        db.user_stats.update_one(
+            {"_id": user_id},
+            [
+                {"$set": {
+                    "daily_workouts": {"$arrayToObject": {"$filter": {
+                        "input": {"$objectToArray": {"$ifNull": ["$daily_workouts", {}]}},
+                        "as": "day",
+                        "cond": {"$gte": ["$$day.k", UserStats.recent_cutoff()]}
+                    }}},
+                    "total_workouts": {"$add": [{"$ifNull": ["$total_workouts", 0]}, 1]},
+                    "last_workout_at": {"$max": ["$last_workout_at", end_time]},
+                    "updated_at": datetime.utcnow()
+                }},
+                {"$set": {
+                    f"daily_workouts.{day_key}": {"$add": [{"$ifNull": [f"$daily_workouts.{day_key}", 0]}, 1]}
+                }}
+            ],
+            upsert=True
+        )
+    
+    @staticmethod
+    def workout_removed(user_id, end_time):
+        increments = {"total_workouts": -1}
+        day_key = end_time.date().isoformat()
+        if day_key >= UserStats.recent_cutoff():
+            increments[f"daily_workouts.{day_key}"] = -1
+        db.user_stats.update_one(
+            {"_id": user_id},
+            {"$inc": increments, "$set": {"updated_at": datetime.utcnow()}}
+        )
+    
+    @staticmethod
+    def rebuild(user_id):
+        """Recompute the stats document (plus activity index and leaderboard scores) from the user's plans and sessions"""
+        plans_by_level = {}
+        for row in db.workout_plans.aggregate([
+            {"$match": {"user_id": user_id}},
+            {"$group": {"_id": {"$ifNull": ["$level", "unspecified"]}, "count": {"$sum": 1}}}
+        ]):
+            plans_by_level[row['_id']] = row['count']
+        
+        cutoff = UserStats.recent_cutoff()
+        total_workouts = 0
+        daily_workouts = {}
+        last_workout_at = None
+        
+        cursor = db.workout_sessions.find(WorkoutSession.completed_query(user_id), {"end_time": 1})
+        for session_data in cursor.sort("end_time", -1):
+            end_time = session_data['end_time']
+            day_key = end_time.date().isoformat()
+            total_workouts += 1
+            
+            if last_workout_at is None:
+                last_workout_at = end_time
+            
+            if day_key >= cutoff:
+                daily_workouts[day_key] = daily_workouts.get(day_key, 0) + 1
+        
+        # Archived months are older than the recent window; they only add to the totals
+        for bucket in SessionArchive.buckets(user_id, projection={"completed_count": 1, "last_end": 1}):
+            total_workouts += bucket['completed_count']
+            if bucket.get('last_end') and (last_workout_at is None or bucket['last_end'] > last_workout_at):
+                last_workout_at = bucket['last_end']
+        
+        stats = UserStats(
+            user_id=user_id,
+            plans_by_level=plans_by_level,
+            total_workouts=total_workouts,
+            daily_workouts=daily_workouts,
+            last_workout_at=last_workout_at,
+            updated_at=datetime.utcnow()
+        )
+        db.user_stats.replace_one(
+            {"_id": user_id},
+            {
+                "plans_by_level": stats.plans_by_level,
+                "total_workouts": stats.total_workouts,
+                "daily_workouts": stats.daily_workouts,
+                "last_workout_at": stats.last_workout_at,
+                "updated_at": stats.updated_at
+            },
+            upsert=True
+        )
+        ActivityIndex.rebuild(user_id)
+        import leaderboard
+        leaderboard.rebuild(user_id)
+        DataVersion.bump(user_id)
+        return stats
+    
+    @staticmethod
+    def rebuild_all():
+        count = 0
+        for user_data in db.users.find({}, {"_id": 1}):
+            UserStats.rebuild(user_data['_id'])
+            count += 1
+        return count
+
+class ActivityIndex:
+    """Day-granular bitset of the days on which a user finished a workout.
+    
+    Stored as one `activity_days` document per user and year, with the year
+    split over 32-bit words `w0`..`w11` so a single day can be set atomically
+    with `$bit`. In process the whole history is a single int where bit N
+    means EPOCH + N days, so streaks, counts and heatmaps cost time
+    proportional to the days covered rather than to the number of sessions.
+    Cached entries are tagged with the user's DataVersion, like
+    ProgressSeries, so a day marked in another worker is seen on the next read.
+    """
+    EPOCH = date(2000, 1, 1)
+    WORD_BITS = 32
+    WORDS_PER_YEAR = 12
+    _cache = TTLCache(maxsize=1024, ttl=60)
+    
+    def __init__(self, user_id, bits=0):
+        self.user_id = user_id
+        self.bits = bits
+    
+    @staticmethod
+    def position(day):
+        return (day - ActivityIndex.EPOCH).days
+    
+    def is_active(self, day):
+        position = ActivityIndex.position(day)
+        return position >= 0 and bool(self.bits >> position & 1)
+    
+    def active_days(self, start, end):
+        """Number of active days in [start, end], both inclusive"""
+        first = max(ActivityIndex.position(start), 0)
+        last = ActivityIndex.position(end)
+        if last < first:
+            return 0
+        return (self.bits >> first & ((1 << (last - first + 1)) - 1)).bit_count()
+    
+    def current_streak(self, today=None):
+        """Consecutive active days ending today, or yesterday if today is still open"""
+        today = today or datetime.utcnow().date()
+        position = ActivityIndex.position(today)
+        if not self.is_active(today):
+            position -= 1
+        if position < 0 or not self.bits >> position & 1:
+            return 0
+        
+        gaps = ~self.bits & ((1 << (position + 1)) - 1)
+        if not gaps:
+            return position + 1
+        return position - (gaps.bit_length() - 1)
+    
+    def longest_streak(self):
+        longest = 0
+        bits = self.bits
+        while bits:
+            # Drop the inactive days below the next run, then measure the run
+            bits >>= (bits & -bits).bit_length() - 1
+            run = (~bits & (bits + 1)).bit_length() - 1
+            longest = max(longest, run)
+            bits >>= run
+        return longest
+    
+    def weekly_active_days(self, weeks=12, today=None):
+        """Active days per ISO week (Monday start) for the last `weeks` weeks, oldest first"""
+        today = today or datetime.utcnow().date()
+        week_start = today - timedelta(days=today.weekday())
+        result = []
+        for offset in range(weeks - 1, -1, -1):
+            start = week_start - timedelta(weeks=offset)
+            result.append({
+                'week_start': start.isoformat(),
+                'active_days': self.active_days(start, start + timedelta(days=6))
+            })
+        return result
+    
+    def monthly_active_days(self, months=12, today=None):
+        """Active days per 'YYYY-MM' for the last `months` months, oldest first"""
+        today = today or datetime.utcnow().date()
+        result = {}
+        year, month = today.year, today.month
+        for offset in range(months - 1, -1, -1):
+            y, m = divmod(year * 12 + month - 1 - offset, 12)
+            start = date(y, m + 1, 1)
+            y, m = divmod(year * 12 + month - offset, 12)
+            end = date(y, m + 1, 1) - timedelta(days=1)
+            result[start.strftime('%Y-%m')] = self.active_days(start, end)
+        return result
+    
+    def heatmap(self, days=365, today=None):
+        """Calendar heatmap as a '0'/'1' string, one character per day from `start`"""
+        today = today or datetime.utcnow().date()
+        start = today - timedelta(days=days - 1)
+        first = ActivityIndex.position(start)
+        if first >= 0:
+            window = self.bits >> first
+        else:
+            window = self.bits << -first
+        window &= (1 << days) - 1
+        return {
+            'start': start.isoformat(),
+            'days': format(window, f'0{days}b')[::-1]
+        }
+    
+    @staticmethod
+    def _year_word(day):
+        index = (day - date(day.year, 1, 1)).days
+        return f"w{index // ActivityIndex.WORD_BITS}", 1 << (index % ActivityIndex.WORD_BITS)
+    
+    @staticmethod
+    def _year_document_id(user_id, year):
+        return f"{user_id}:{year}"
+    
+    @staticmethod
+    def load(user_id):
+        bits = 0
+        for year_data in db.activity_days.find({"user_id": user_id}):
+            base = ActivityIndex.position(date(year_data['year'], 1, 1))
+            for i in range(ActivityIndex.WORDS_PER_YEAR):
+                word = int(year_data.get(f"w{i}", 0)) & 0xFFFFFFFF
+                shift = base + i * ActivityIndex.WORD_BITS
+                if word and shift >= 0:
+                    bits |= word << shift
+        return ActivityIndex(user_id, bits)
+    
+    @staticmethod
+    def get(user_id, version=None):
+        if version is None:
+            version = DataVersion.get(user_id)[0]
+        cached = ActivityIndex._cache.get(user_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        index = ActivityIndex.load(user_id)
+        ActivityIndex._cache.set(user_id, (version, index))
+        return index
+    
+    @staticmethod
+    def mark(user_id, day):
+        field, mask = ActivityIndex._year_word(day)
+        db.activity_days.update_one(
+            {"_id": ActivityIndex._year_document_id(user_id, day.year)},
+            {
+                "$bit": {field: {"or": Int64(mask)}},
+                "$setOnInsert": {"user_id": user_id, "year": day.year}
+            },
+            upsert=True
+        )
+        ActivityIndex._cache.invalidate(user_id)
+    
+    @staticmethod
+    def unmark_if_inactive(user_id, day):
+        """Clear a day after a deletion unless another completed session remains on it"""
+        start = datetime.combine(day, datetime.min.time())
+        query = WorkoutSession.completed_query(user_id, start, start + timedelta(days=1))
+        if db.workout_sessions.find_one(query, {"_id": 1}):
+            return
+        if SessionArchive.reaches(start) and SessionArchive.completed_days(user_id, start, start + timedelta(days=1)):
+            return
+        
+        field, mask = ActivityIndex._year_word(day)
+        db.activity_days.update_one(
+            {"_id": ActivityIndex._year_document_id(user_id, day.year)},
+            {"$bit": {field: {"and": Int64(~mask & 0xFFFFFFFF)}}}
+        )
+        ActivityIndex._cache.invalidate(user_id)
+    
+    @staticmethod
+    def rebuild(user_id):
+        years = {}
+        days = set()
+        for row in db.workout_sessions.aggregate([
+            {"$match": WorkoutSession.completed_query(user_id)},
+            {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$end_time"}}}}
+        ]):
+            days.add(row['_id'])
+        days.update(SessionArchive.completed_days(user_id))
+        for day_key in days:
+            day = date.fromisoformat(day_key)
+            field, mask = ActivityIndex._year_word(day)
+            words = years.setdefault(day.year, {})
+            words[field] = words.get(field, 0) | mask
+        
+        db.activity_days.delete_many({"user_id": user_id})
+        if years:
+            db.activity_days.insert_many([
+                dict(
+                    {f: Int64(word) for f, word in words.items()},
+                    _id=ActivityIndex._year_document_id(user_id, year),
+                    user_id=user_id,
+                    year=year
+                )
+                for year, words in years.items()
+            ])
+        ActivityIndex._cache.invalidate(user_id)
+
+declare_indexes(
+    "activity_days",
+    ([("user_id", 1), ("year", 1)], {})
+)
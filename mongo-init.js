@@ -20,10 +20,7 @@ db.createUser({
   ]
 });
 
-// Create indexes for performance
-db.workout_plans.createIndex({ "user_id": 1, "level": 1, "created_at": -1 });
-db.workout_sessions.createIndex({ "user_id": 1, "start_time": -1 });
-db.users.createIndex({ "email": 1 }, { unique: true });
-db.users.createIndex({ "google_id": 1 }, { unique: true, sparse: true });
+// Indexes are declared next to the models (models.py, jobs.py) and created
+// by the app at startup or with `flask ensure-indexes`
 
 print('FitTracker database initialized successfully');
\ No newline at end of file
@@ -0,0 +1,214 @@
+"""Query plan regression check (`flask check-query-plans`).
+
+Records every command the models send to MongoDB while a scripted user
+creates a plan, logs and syncs workouts, loads every page and API, exports
+and re-imports their history, and runs the archive, the job queue and the
+maintenance rebuilds. Each distinct query is then explained, and the
+check fails if a winning plan scans a whole collection (COLLSCAN) or sorts
+documents in memory (a SORT stage that is not ordering $group output).
+Whole-collection reads that are scans by design (batch rebuilds, loading
+the catalog) are listed in INTENTIONAL_SCANS.
+
+Run it against a scratch database after ensure_indexes(): it writes and
+then deletes its own user's data. tests/test_query_plans.py does both when
+MONGODB_URI is set.
+"""
+import copy
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import monitoring
+
+from database import get_client, DATABASE_NAME
+
+EXPLAINABLE = {'find', 'aggregate', 'count', 'distinct', 'update', 'delete', 'findAndModify'}
+# Sent with every command by the driver, not part of the query
+DRIVER_FIELDS = {'lsid', 'txnNumber', 'autocommit', 'startTransaction', 'readConcern', 'writeConcern'}
+# (collection, command) pairs whose empty-filter scans are the point of the query
+INTENTIONAL_SCANS = {('users', 'find'), ('exercises', 'find')}
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """Keeps the first command of every (command, collection, filter shape)"""
+
+    def __init__(self):
+        self.commands = {}
+
+    def started(self, event):
+        if event.command_name not in EXPLAINABLE or event.database_name != DATABASE_NAME:
+            return
+        command = {k: v for k, v in event.command.items() if not k.startswith('$') and k not in DRIVER_FIELDS}
+        key = (event.command_name, command.get(event.command_name), _shape(command))
+        self.commands.setdefault(key, copy.deepcopy(command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _shape(value):
+    """Field names and operators only, so queries that differ in values compare equal"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _shape(v)) for k, v in value.items() if k not in ('limit', 'skip', 'batchSize')))
+    if isinstance(value, list):
+        return tuple(_shape(v) for v in value[:1])
+    return None
+
+
+def _plan_nodes(plan):
+    """Every stage node in a winning plan tree"""
+    if isinstance(plan, list):
+        for item in plan:
+            yield from _plan_nodes(item)
+        return
+    if not isinstance(plan, dict):
+        return
+    if plan.get('stage'):
+        yield plan
+    for value in plan.values():
+        if isinstance(value, (dict, list)):
+            yield from _plan_nodes(value)
+
+
+def _winning_plans(explain_output):
+    """Winning plans of an explain result, including each $cursor stage of an aggregate"""
+    if 'queryPlanner' in explain_output:
+        yield explain_output['queryPlanner']['winningPlan']
+    for stage in explain_output.get('stages', []):
+        cursor = stage.get('$cursor')
+        if cursor and 'queryPlanner' in cursor:
+            yield cursor['queryPlanner']['winningPlan']
+
+
+def problems_in(explain_output):
+    problems = set()
+    for plan in _winning_plans(explain_output):
+        for node in _plan_nodes(plan):
+            if node['stage'] == 'COLLSCAN':
+                problems.add('COLLSCAN')
+            # A SORT fed by a GROUP orders grouped results; otherwise it sorts the documents themselves
+            elif node['stage'] == 'SORT' and not any(
+                    child['stage'] == 'GROUP' for child in _plan_nodes(node.get('inputStage'))):
+                problems.add('in-memory SORT')
+    return sorted(problems)
+
+
+def explain(command):
+    database = get_client()[DATABASE_NAME]
+    name = next(iter(command))
+    if name in ('update', 'delete'):
+        # Explain takes one statement; the first stands for the rest
+        key = name + 's'
+        command = dict(command, **{key: command[key][:1]})
+    return database.command({'explain': command, 'verbosity': 'queryPlanner'})
+
+
+def exercise_app(app):
+    """Drive the models and routes as a user would; returns nothing, the recorder keeps the commands"""
+    import jobs
+    import leaderboard
+    from analytics import write_user_report
+    from catalog import get_catalog
+    from models import (ActivityIndex, DataVersion, PersonalRecords, SessionArchive, User, UserStats, WorkoutPlan,
+                        WorkoutSession, db)
+
+    keys = list(get_catalog().exercises)[:3]
+    user = User(email=f'plan-check-{uuid.uuid4().hex[:8]}@example.com', username='Plan check').save()
+    try:
+        User._cache.invalidate(user.id)
+        User.get(user.id)
+        User.get_by_email(user.email)
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = user.id
+            session['_fresh'] = True
+
+        client.post('/create_plan', data={'name': 'Plan check', 'exercises': keys, 'level': 'beginner'})
+        plan = WorkoutPlan.get_by_user(user.id)[0]
+        # The oldest session is old enough to be archived
+        for days_ago in (400, 40, 10, 1):
+            session = WorkoutSession(plan_id=plan.id, user_id=user.id,
+                                     start_time=datetime.utcnow() - timedelta(days=days_ago, hours=1)).save()
+            form = {'session_id': session.id, 'exercise_key': keys[0], 'sets_completed[]': ['true', 'true'],
+                    'reps_completed[]': ['5', '5'], 'weights_used[]': ['100', '100']}
+            client.post('/complete_exercise', data=form)
+            client.post('/log_set', data={'session_id': session.id, 'exercise_key': keys[1], 'reps': 8, 'weight': 20})
+            client.post('/sync', json={'items': [{'id': uuid.uuid4().hex, 'type': 'log_set', 'sessionId': session.id,
+                                                  'exerciseKey': keys[1], 'reps': 8, 'weight': 20}]})
+            client.post('/finish_workout', data={'session_id': session.id})
+        client.get(f'/start_workout/{plan.id}')
+        SessionArchive.archive(SessionArchive.HORIZON_DAYS, user_id=user.id)
+
+        for path in ('/dashboard', '/dashboard?level=beginner', '/progress', '/exercise_library',
+                     '/api/exercises?q=press', '/api/activity', '/api/records', f'/api/records?exercise={keys[0]}',
+                     '/api/training_load', '/api/sessions?limit=1', '/api/sessions?completed=1&include=exercises',
+                     f'/api/progress?exercise={keys[0]}', f'/api/progress?exercise={keys[0]}&bucket=week',
+                     '/api/leaderboard', '/api/leaderboard?period=month&metric=workouts&previous=1'):
+            response = client.get(path)
+            next_cursor = (response.get_json(silent=True) or {}).get('next_cursor')
+            if next_cursor:
+                client.get(f'/api/sessions?limit=1&cursor={next_cursor}')
+
+        # History export reads hot sessions and archive buckets; the import runs as a job
+        exported = client.get('/api/export').get_data()
+        client.get('/api/export?format=csv').get_data()
+        queued = client.post('/api/import?format=ndjson', data=exported, content_type='application/x-ndjson')
+        jobs.enqueue('rebuild_stats', {'user_id': user.id}, user_id=user.id, dedupe_key=f'rebuild_stats:{user.id}')
+        jobs.enqueue('rebuild_stats', {'user_id': user.id}, user_id=user.id, dedupe_key=f'rebuild_stats:{user.id}')
+        # A scratch database holds no other jobs; bounded in case it does
+        for _ in range(10):
+            job_doc = jobs.claim('plan-check')
+            if not job_doc:
+                break
+            jobs.execute(job_doc, 'plan-check')
+        client.get(queued.get_json()['status_url'])
+
+        UserStats.rebuild(user.id)
+        ActivityIndex.rebuild(user.id)
+        PersonalRecords.rebuild(user.id)
+        write_user_report(user.id)
+        leaderboard.compact()
+        SessionArchive.restore(user.id)
+        DataVersion.get(user.id)
+        WorkoutSession.get_by_user(user.id)[0].delete()
+        plan.delete()
+    finally:
+        for collection in ('workout_sessions', 'workout_archive', 'workout_plans', 'activity_days'):
+            db[collection].delete_many({"user_id": user.id})
+        # With no sessions left this takes the user off the current boards and their histograms
+        leaderboard.rebuild(user.id)
+        for collection in ('user_stats', 'personal_records', 'data_versions', 'training_reports', 'users'):
+            db[collection].delete_many({"_id": user.id})
+        db.jobs.delete_many({"user_id": user.id})
+
+
+def run_check(app, log=print):
+    """Record, explain and report; returns [(command, collection, problems)] for the failures"""
+    recorder = CommandRecorder()
+    # Global listeners only attach to clients created afterwards
+    monitoring.register(recorder)
+    client = get_client()
+    if recorder not in client.options.event_listeners:
+        raise RuntimeError("The MongoClient existed before the recorder was registered; run in a fresh process")
+
+    exercise_app(app)
+
+    failures = []
+    for (name, collection, _), command in sorted(recorder.commands.items(), key=lambda item: repr(item[0])):
+        query = command.get('filter') or command.get('query') or command.get('pipeline') or command.get(name + 's')
+        problems = problems_in(explain(command))
+        if problems and (collection, name) in INTENTIONAL_SCANS and not command.get('filter'):
+            problems = []
+        log(f"{'FAIL' if problems else 'ok':<5}{name} {collection} {_summary(query)}"
+            + (f"  <- {', '.join(problems)}" if problems else ''))
+        if problems:
+            failures.append((name, collection, problems))
+    log(f"{len(recorder.commands)} distinct queries, {len(failures)} without a usable index")
+    return failures
+
+
+def _summary(query, limit=100):
+    text = repr(query)
+    return text if len(text) <= limit else text[:limit - 3] + '...'
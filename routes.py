@@ -1,39 +1,70 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import (Blueprint, Response, g, render_template, request, redirect, url_for, flash, jsonify,
+                   stream_with_context)
 from flask_login import login_required, current_user
-from models import WorkoutPlan, WorkoutSession
+import math
+import os
+import history
+import jobs
+import leaderboard
+from catalog import get_catalog
+from http_cache import conditional
+from models import User, WorkoutPlan, WorkoutSession, UserStats, ActivityIndex, ProgressSeries, PersonalRecords
 from datetime import datetime, timedelta
-import json
 
 main_routes = Blueprint('main_routes', __name__)
 
+# Upper bound on queued offline writes accepted by a single /sync call
+MAX_SYNC_ITEMS = 500
+
+# Exercises rendered into the library and plan pages; the rest are fetched from /api/exercises
+EXERCISE_PAGE_SIZE = 24
+
+# Point budget for progress chart series (default and upper bound)
+CHART_POINTS = 200
+MAX_CHART_POINTS = 2000
+
+# Latest offline timestamp accepted by /sync (ms since the epoch, year 9999)
+MAX_TIMESTAMP_MS = 253402300799999
+
+# Largest history upload accepted by /api/import
+MAX_IMPORT_BYTES = int(os.environ.get("IMPORT_MAX_MB", 50)) * 1024 * 1024
+
 @main_routes.route('/')
 def index():
     return render_template('index.html')
 
 @main_routes.route('/health')
 def health():
-    """Health check endpoint for Docker containers"""
-    return jsonify({"status": "healthy", "timestamp": datetime.utcnow().isoformat()}), 200
+    """Liveness check for Docker containers; cache and pool numbers are on the token-guarded /metrics"""
+    return jsonify({
+        "status": "healthy",
+        "timestamp": datetime.utcnow().isoformat()
+    }), 200
 
 @main_routes.route('/dashboard')
 @login_required
+@conditional()
 def dashboard():
     level_filter = request.args.get('level')
     plans = WorkoutPlan.get_by_user(current_user.id, level=level_filter)
-    sessions = WorkoutSession.get_by_user(current_user.id)
+    user_stats = UserStats.get(current_user.id)
     
-    # Get recent sessions for stats
-    recent_sessions = [s for s in sessions if s.end_time and 
-                      s.end_time > datetime.now() - timedelta(days=30)]
+    # Get recent sessions for the activity list
+    recent_sessions = WorkoutSession.get_recent_completed(
+        current_user.id, since=datetime.utcnow() - timedelta(days=UserStats.RECENT_DAYS), limit=5)
     
     stats = {
-        'total_plans': len(plans),
-        'total_workouts': len([s for s in sessions if s.end_time]),
-        'this_month': len(recent_sessions),
-        'streak': calculate_streak(sessions)
+        'total_plans': user_stats.total_plans(level_filter),
+        'total_workouts': user_stats.total_workouts,
+        'this_month': user_stats.this_month,
+        'streak': ActivityIndex.get(current_user.id, g.get('data_version')).current_streak()
     }
     
-    return render_template('dashboard.html', plans=plans, stats=stats, recent_sessions=recent_sessions[:5])
+    records = PersonalRecords.get(current_user.id).recent(5)
+    exercises = get_catalog().subset(exercise_key for exercise_key, _ in records)
+    
+    return render_template('dashboard.html', plans=plans, stats=stats, recent_sessions=recent_sessions,
+                           records=records, exercises=exercises)
 
 @main_routes.route('/create_plan', methods=['GET', 'POST'])
 @login_required
@@ -52,8 +83,11 @@ def create_plan():
             flash("Workout plan name is required.", "error")
             return redirect(url_for('main_routes.create_plan'))
         
+        catalog = get_catalog()
         exercises = []
         for exercise_key in selected_exercises:
+            if exercise_key not in catalog:
+                continue
             sets = request.form.get(f'sets_{exercise_key}', 3, type=int)
             reps = request.form.get(f'reps_{exercise_key}', 10, type=int)
             weight = request.form.get(f'weight_{exercise_key}', 0, type=float)
@@ -71,22 +105,55 @@ def create_plan():
         flash(f"Workout plan '{name}' created successfully!", "success")
         return redirect(url_for('main_routes.dashboard'))
     
-    from models import EXERCISE_LIBRARY
-    exercises = EXERCISE_LIBRARY
-    return render_template('workout_plan.html', exercises=exercises)
+    return render_exercise_page('workout_plan.html')
 
 @main_routes.route('/exercise_library')
 @login_required
+@conditional(lambda: get_catalog().version)
 def exercise_library():
-    from models import EXERCISE_LIBRARY
-    exercises = EXERCISE_LIBRARY
-    return render_template('exercise_library.html', exercises=exercises)
+    return render_exercise_page('exercise_library.html')
+
+def render_exercise_page(template):
+    """Render a page listing the first page of the catalog plus its facets"""
+    catalog = get_catalog()
+    first_page = catalog.search(per_page=EXERCISE_PAGE_SIZE)
+    exercises = {item['key']: item for item in first_page['results']}
+    return render_template(template, exercises=exercises, total_exercises=first_page['total'],
+                           facets=catalog.facets(), catalog_version=catalog.version,
+                           page_size=EXERCISE_PAGE_SIZE)
+
+@main_routes.route('/api/exercises')
+@login_required
+def api_exercises():
+    """Search the exercise catalog.
+    
+    Query args: q (name prefix words), any number of muscle=<group> and
+    equipment=<name> filters, page and per_page (1-100). Responses carry the
+    catalog version as their ETag; requests that pass v=<version> may be
+    cached by the client for as long as it likes.
+    """
+    catalog = get_catalog()
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = max(1, min(request.args.get('per_page', EXERCISE_PAGE_SIZE, type=int), 100))
+    
+    response = jsonify(catalog.search(
+        q=request.args.get('q'),
+        muscles=request.args.getlist('muscle'),
+        equipment=request.args.getlist('equipment'),
+        page=page,
+        per_page=per_page
+    ))
+    response.set_etag(catalog.version)
+    if request.args.get('v') == catalog.version:
+        response.cache_control.max_age = 86400
+    else:
+        response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response.make_conditional(request)
 
 @main_routes.route('/start_workout/<plan_id>')
 @login_required
 def start_workout(plan_id):
-    from models import EXERCISES
-    
     plan = WorkoutPlan.get(plan_id)
     
     if not plan or plan.user_id != current_user.id:
@@ -96,7 +163,8 @@ def start_workout(plan_id):
     session = WorkoutSession(plan_id=plan_id, user_id=current_user.id)
     session.save()
     
-    return render_template('track_workout.html', plan=plan, session=session, exercises=EXERCISES)
+    exercises = get_catalog().subset(exercise['exercise_key'] for exercise in plan.exercises)
+    return render_template('track_workout.html', plan=plan, session=session, exercises=exercises)
 
 @main_routes.route('/complete_exercise', methods=['POST'])
 @login_required
@@ -107,27 +175,134 @@ def complete_exercise():
     reps_completed = request.form.getlist('reps_completed[]')
     weights_used = request.form.getlist('weights_used[]')
     
-    session = WorkoutSession.get(session_id)
+    try:
+        exercise_data = build_exercise_data(exercise_key, sets_completed, reps_completed, weights_used)
+    except (ValueError, IndexError):
+        return jsonify({'error': f'Reps (0-{history.MAX_REPS}) and weights (0-{history.MAX_WEIGHT}) are required for each set'}), 400
     
-    if not session or session.user_id != current_user.id:
+    # The same key goes with the offline copy if this response never arrives, so a replay is a no-op
+    sync_key = request.form.get('sync_key')
+    if not WorkoutSession.append_exercise(session_id, current_user.id, exercise_data, sync_key):
         return jsonify({'error': 'Session not found'}), 404
     
+    return jsonify({'success': True})
+
+@main_routes.route('/log_set', methods=['POST'])
+@login_required
+def log_set():
+    session_id = request.form.get('session_id')
+    exercise_key = request.form.get('exercise_key')
+    
+    if not exercise_key:
+        return jsonify({'error': 'Exercise is required'}), 400
+    
+    try:
+        set_data = {
+            'exercise_key': exercise_key,
+            'set_index': bounded_number(request.form.get('set_index'), history.MAX_SETS, int),
+            'reps': bounded_number(request.form.get('reps'), history.MAX_REPS, int),
+            'weight': bounded_number(request.form.get('weight'), history.MAX_WEIGHT),
+            'logged_at': datetime.utcnow()
+        }
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if not WorkoutSession.log_set(session_id, current_user.id, set_data, request.form.get('sync_key')):
+        return jsonify({'error': 'Session not found'}), 404
+    
+    return jsonify({'success': True})
+
+@main_routes.route('/sync', methods=['POST'])
+@login_required
+def sync_offline_data():
+    """Apply the client's queued offline writes in one batch.
+    
+    Expects {"items": [...]} as stored in localStorage by workout.js; every
+    item carries a client-generated `id` used as its idempotency key. The
+    response maps each id to its status so the client only clears what the
+    server has durably accepted.
+    """
+    payload = request.get_json(silent=True) or {}
+    items = payload.get('items')
+    if not isinstance(items, list):
+        return jsonify({'error': 'Expected a JSON object with an items list'}), 400
+    if len(items) > MAX_SYNC_ITEMS:
+        return jsonify({'error': f'At most {MAX_SYNC_ITEMS} items can be synced at once'}), 413
+    
+    statuses = {}
+    ops = []
+    for item in items:
+        key = item.get('id') if isinstance(item, dict) else None
+        if not key or not isinstance(key, str):
+            continue
+        try:
+            ops.append(parse_sync_item(key, item))
+        except (KeyError, IndexError, TypeError, ValueError):
+            statuses[key] = 'invalid'
+    
+    if ops:
+        statuses.update(WorkoutSession.bulk_append(current_user.id, ops))
+    
+    return jsonify({'results': statuses})
+
+def parse_sync_item(key, item):
+    """Turn one queued offline item into a WorkoutSession.bulk_append op"""
+    session_id = str(item['sessionId'])
+    exercise_key = str(item['exerciseKey'])
+    
+    if item.get('type') == 'complete_exercise':
+        sets_data = item['setsData']
+        value = build_exercise_data(
+            exercise_key,
+            sets_data['sets_completed'],
+            sets_data['reps_completed'],
+            sets_data['weights_used']
+        )
+        return {'key': key, 'session_id': session_id, 'field': 'exercises_completed', 'value': value}
+    
+    if item.get('type') == 'log_set':
+        value = {
+            'exercise_key': exercise_key,
+            'set_index': bounded_number(item.get('setIndex'), history.MAX_SETS, int),
+            'reps': bounded_number(item.get('reps'), history.MAX_REPS, int),
+            'weight': bounded_number(item.get('weight'), history.MAX_WEIGHT),
+            'logged_at': timestamp_datetime(item['timestamp']) if item.get('timestamp') else datetime.utcnow()
+        }
+        return {'key': key, 'session_id': session_id, 'field': 'set_log', 'value': value}
+    
+    raise ValueError(f"Unknown sync item type: {item.get('type')}")
+
+def bounded_number(value, limit, cast=float):
+    """`value` as an int or float in [0, limit], 0 when empty; ValueError otherwise.
+    
+    The same bounds as imported history (history.MAX_REPS etc.): anything
+    larger is a typo, and values past 8 bytes can't even be stored in BSON.
+    """
+    if not value:
+        return 0
+    number = float(value)
+    if not math.isfinite(number) or not 0 <= number <= limit:
+        raise ValueError(f"Expected a number between 0 and {limit}, got {value!r}")
+    return cast(value)
+
+def timestamp_datetime(milliseconds):
+    """UTC datetime for a client timestamp in ms since the epoch; ValueError when out of range"""
+    return datetime(1970, 1, 1) + timedelta(milliseconds=bounded_number(milliseconds, MAX_TIMESTAMP_MS))
+
+def build_exercise_data(exercise_key, sets_completed, reps_completed, weights_used):
+    """Completed sets of one exercise, from the tracker's parallel per-set lists"""
     exercise_data = {
         'exercise_key': exercise_key,
         'sets': []
     }
     
     for i in range(len(sets_completed)):
-        if sets_completed[i] == 'true':
+        if sets_completed[i] in (True, 'true'):
             exercise_data['sets'].append({
-                'reps': int(reps_completed[i]) if reps_completed[i] else 0,
-                'weight': float(weights_used[i]) if weights_used[i] else 0
+                'reps': bounded_number(reps_completed[i], history.MAX_REPS, int),
+                'weight': bounded_number(weights_used[i], history.MAX_WEIGHT)
             })
-    
-    session.exercises_completed.append(exercise_data)
-    session.save()
-    
-    return jsonify({'success': True})
+    return exercise_data
 
 @main_routes.route('/finish_workout', methods=['POST'])
 @login_required
@@ -142,39 +317,227 @@ def finish_workout():
         return redirect(url_for('main_routes.dashboard'))
     
     session.complete(notes)
+    # Recompute the training report off the request; finishing several workouts in a row queues it once
+    jobs.enqueue('training_report', {'user_id': current_user.id}, user_id=current_user.id,
+                 dedupe_key=f'training_report:{current_user.id}')
     flash("Workout completed! Great job!", "success")
     return redirect(url_for('main_routes.dashboard'))
 
 @main_routes.route('/progress')
 @login_required
+@conditional()
 def progress():
-    sessions = WorkoutSession.get_by_user(current_user.id)
-    completed_sessions = [s for s in sessions if s.end_time]
+    # Chart data is loaded from /api/progress so history is not inlined into the page
+    return render_template('progress.html')
+
+@main_routes.route('/api/progress')
+@login_required
+@conditional()
+def api_progress():
+    """Monthly workout counts and per-exercise volume for a date range.
     
-    # Prepare data for charts
-    monthly_data = {}
-    exercise_data = {}
+    Query args: start/end (YYYY-MM-DD, end inclusive) and any number of
+    exercise=<key> filters. Volume series are only returned for the requested
+    exercises, so clients fetch them incrementally as they are charted.
+    bucket=day|week|month sums volume per period instead of per session, and
+    points=N (default CHART_POINTS) caps each series with LTTB downsampling;
+    `exercise_points` reports each series' size before downsampling.
+    """
+    try:
+        start = parse_date_arg('start')
+        end = parse_date_arg('end')
+    except ValueError:
+        return jsonify({'error': 'Dates must be formatted as YYYY-MM-DD'}), 400
     
-    for session in completed_sessions:
-        month_key = session.end_time.strftime('%Y-%m')
-        monthly_data[month_key] = monthly_data.get(month_key, 0) + 1
-        
-        for exercise in session.exercises_completed:
-            exercise_key = exercise['exercise_key']
-            total_volume = sum(set_data['reps'] * set_data['weight'] for set_data in exercise['sets'])
-            if exercise_key not in exercise_data:
-                exercise_data[exercise_key] = []
-            exercise_data[exercise_key].append({
-                'date': session.end_time.isoformat(),
-                'volume': total_volume
-            })
+    bucket = request.args.get('bucket') or None
+    if bucket and bucket not in ProgressSeries.BUCKETS:
+        return jsonify({'error': f"bucket must be one of {', '.join(ProgressSeries.BUCKETS)}"}), 400
+    max_points = max(3, min(request.args.get('points', CHART_POINTS, type=int), MAX_CHART_POINTS))
+    
+    if end:
+        end += timedelta(days=1)
+    
+    exercise_keys = request.args.getlist('exercise')
+    exercise_data, exercise_points = {}, {}
+    if exercise_keys:
+        exercise_data, exercise_points = ProgressSeries.chart_data(
+            current_user.id, exercise_keys, start, end,
+            bucket=bucket, max_points=max_points, version=g.get('data_version')
+        )
+    
+    return jsonify({
+        'monthly_data': WorkoutSession.monthly_counts(current_user.id, start, end),
+        'exercise_keys': WorkoutSession.exercise_keys(current_user.id, start, end),
+        'exercise_data': exercise_data,
+        'exercise_points': exercise_points,
+        'bucket': bucket,
+        'points': max_points
+    })
+
+@main_routes.route('/api/activity')
+@login_required
+@conditional()
+def api_activity():
+    """Streaks, active-day counts and a calendar heatmap from the activity index"""
+    days = max(1, min(request.args.get('days', 365, type=int), 366 * 5))
+    activity = ActivityIndex.get(current_user.id, g.get('data_version'))
+    today = datetime.utcnow().date()
     
-    return render_template('progress.html', 
-                         monthly_data=json.dumps(monthly_data),
-                         exercise_data=json.dumps(exercise_data))
+    return jsonify({
+        'current_streak': activity.current_streak(today),
+        'longest_streak': activity.longest_streak(),
+        'this_week': activity.active_days(today - timedelta(days=today.weekday()), today),
+        'this_month': activity.active_days(today.replace(day=1), today),
+        'weekly': activity.weekly_active_days(today=today),
+        'monthly': activity.monthly_active_days(today=today),
+        'heatmap': activity.heatmap(days, today)
+    })
+
+@main_routes.route('/api/records')
+@login_required
+@conditional()
+def api_records():
+    """Personal records per exercise; exercise=<key> (repeatable) limits the response"""
+    records = PersonalRecords.get(current_user.id).to_json()
+    exercise_keys = request.args.getlist('exercise')
+    if exercise_keys:
+        records = {key: records[key] for key in exercise_keys if key in records}
+    return jsonify({'records': records})
+
+@main_routes.route('/api/leaderboard')
+@login_required
+def api_leaderboard():
+    """Top entries and the user's rank; period=week|month, metric=volume|workouts|streak, level defaults to the user's"""
+    period = request.args.get('period', 'week')
+    metric = request.args.get('metric', 'volume')
+    level = request.args.get('level', current_user.fitness_level)
+    if period not in leaderboard.PERIODS or metric not in leaderboard.METRICS or level not in leaderboard.LEVELS:
+        return jsonify({'error': 'Unknown period, metric or level'}), 400
+    limit = max(1, min(request.args.get('limit', 10, type=int), leaderboard.RESULT_SIZE))
+    when = datetime.utcnow()
+    if request.args.get('previous'):
+        # The period before the current one (last week or last month)
+        when = leaderboard.period_start(period, when) - timedelta(days=1)
+    return jsonify(leaderboard.board(period, level, metric, user_id=current_user.id, limit=limit, when=when))
+
+@main_routes.route('/api/training_load')
+@login_required
+@conditional()
+def api_training_load():
+    """Acute:chronic load, weekly volume per muscle group and session density (see analytics.py)"""
+    from analytics import stored_user_report, user_report
+    version = g.get('data_version')
+    report = stored_user_report(current_user.id, version) if version is not None else None
+    if report is None:
+        # The background job hasn't caught up with the latest write yet
+        report = user_report(current_user.id)
+    return jsonify({'report': report})
+
+@main_routes.route('/api/jobs/<job_id>')
+@login_required
+def api_job(job_id):
+    """Status and progress of one of the current user's background jobs"""
+    job_data = jobs.get(job_id, user_id=current_user.id)
+    if not job_data:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({
+        'id': job_data['_id'],
+        'name': job_data['name'],
+        'status': job_data['status'],
+        'attempts': job_data['attempts'],
+        'progress': job_data.get('progress'),
+        'result': job_data.get('result'),
+        'created_at': job_data['created_at'].isoformat(),
+        'finished_at': job_data['finished_at'].isoformat() if job_data.get('finished_at') else None
+    })
+
+@main_routes.route('/api/sessions')
+@login_required
+@conditional()
+def api_sessions():
+    """Paginated session history, newest first.
+    
+    Query args: limit (1-100), cursor (next_cursor from the previous page),
+    completed=1 to skip unfinished sessions and include=exercises to return
+    the logged sets along with each session summary.
+    """
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    include_exercises = 'exercises' in request.args.getlist('include')
+    
+    try:
+        sessions, next_cursor = WorkoutSession.get_page(
+            current_user.id,
+            limit=limit,
+            cursor=request.args.get('cursor'),
+            completed_only=request.args.get('completed') == '1',
+            summary=not include_exercises
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    items = []
+    for session in sessions:
+        item = session.to_summary()
+        if include_exercises:
+            item['exercises_completed'] = session.exercises_completed
+        items.append(item)
+    
+    return jsonify({'sessions': items, 'next_cursor': next_cursor})
+
+@main_routes.route('/api/export')
+@login_required
+def api_export():
+    """Download the full session history as NDJSON (default) or CSV (?format=csv), streamed"""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in history.FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(history.FORMATS)}"}), 400
+    filename = f"fittracker-history-{datetime.utcnow():%Y-%m-%d}.{fmt}"
+    # Keep the request context (and its metrics) open until the last chunk is sent
+    return Response(stream_with_context(history.export(fmt, current_user.id)), mimetype=history.FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                             'Cache-Control': 'private, no-store'})
+
+@main_routes.route('/api/import', methods=['POST'])
+@login_required
+def api_import():
+    """Queue an import of sessions from an NDJSON or CSV body (or a `file` upload) in the /api/export format.
+    
+    The format comes from ?format=, else the content type. The upload is
+    stored and imported by the `import_history` job, so large files don't run
+    into the worker timeout; responds 202 with the job id. The job's result is
+    the import report, in which invalid records are skipped and listed by line.
+    """
+    if request.content_length is None:
+        return jsonify({'error': 'Content-Length required'}), 411
+    if request.content_length > MAX_IMPORT_BYTES:
+        return jsonify({'error': f'Imports are limited to {MAX_IMPORT_BYTES // (1024 * 1024)} MB'}), 413
+    
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    stream = upload.stream if upload else request.stream
+    mimetype = upload.mimetype if upload else request.mimetype
+    fmt = request.args.get('format') or ('csv' if mimetype == 'text/csv' else 'ndjson')
+    if fmt not in history.FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(history.FORMATS)}"}), 400
+    
+    file_id = history.store_upload(current_user.id, stream, fmt)
+    # A retry would find the upload deleted; importing again is harmless but needs a new upload
+    job_id = jobs.enqueue('import_history', {'user_id': current_user.id, 'file_id': file_id, 'format': fmt},
+                          user_id=current_user.id, max_attempts=1)
+    return jsonify({'job_id': job_id, 'status_url': url_for('main_routes.api_job', job_id=job_id)}), 202
+
+def parse_date_arg(name):
+    """Parse an optional YYYY-MM-DD query argument into a datetime"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d')
 
 def calculate_streak(sessions):
-    """Calculate current workout streak"""
+    """Calculate current workout streak by walking every completed session.
+    
+    Superseded by ActivityIndex.current_streak on the dashboard; kept as the
+    reference implementation to check the index against.
+    """
     completed_sessions = [s for s in sessions if s.end_time]
     if not completed_sessions:
         return 0
@@ -0,0 +1,49 @@
+"""Downsampling for chart series.
+
+Points are tuples whose first two items are a numeric x (e.g. a timestamp)
+and y, sorted by x; any further items are carried along untouched.
+"""
+
+
+def lttb(points, threshold):
+    """Largest-Triangle-Three-Buckets downsampling to at most `threshold` points.
+
+    Keeps the first and last points and, from each of the threshold - 2
+    equal-width buckets in between, the point forming the largest triangle
+    with the previously kept point and the average of the next bucket. Peaks
+    and troughs survive, which plain every-Nth sampling loses.
+    """
+    n = len(points)
+    if threshold >= n:
+        return list(points)
+    if threshold < 3:
+        return [points[0], points[-1]][:threshold]
+
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket (the last point for the final bucket)
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        if next_start >= next_end:
+            avg_x, avg_y = points[-1][0], points[-1][1]
+        else:
+            count = next_end - next_start
+            avg_x = sum(point[0] for point in points[next_start:next_end]) / count
+            avg_y = sum(point[1] for point in points[next_start:next_end]) / count
+
+        ax, ay = points[a][0], points[a][1]
+        best_area = -1
+        best = None
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = points[j][0], points[j][1]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
@@ -0,0 +1,128 @@
+import threading
+from datetime import datetime
+
+from flask_session.base import ServerSideSessionInterface
+from flask_session.mongodb import MongoDBSessionInterface
+from itsdangerous import want_bytes
+
+from cache import TTLCache
+from database import get_client
+
+
+class CachedMongoDBSessionInterface(MongoDBSessionInterface):
+    """Flask-Session MongoDB backend that avoids redundant session round trips.
+
+    - Unchanged sessions are not written back. A write only happens when the
+      serialized session differs from what was loaded, or when less than
+      `refresh_threshold` of the lifetime is left on the stored expiration,
+      so sliding expiry still works without a write per request.
+    - Recently read sessions can be served from a per-process cache for
+      `cache_ttl` seconds. Only enable this with a single worker or sticky
+      routing: another worker's writes (e.g. flash messages) are not seen
+      until the entry expires.
+    - Expired sessions are removed by the TTL index on `expiration` and
+      ignored on read until the TTL monitor reaps them; lookups use an index
+      on `id`.
+    - The collection is resolved through database.get_client() on use, so
+      the interface can be built before gunicorn forks without sharing a
+      MongoClient across processes.
+    """
+
+    def __init__(self, app, key_prefix='session:', use_signer=False, permanent=True,
+                 sid_length=32, serialization_format='msgpack', db='flask_session',
+                 collection='sessions', cache_ttl=0, cache_size=10000, refresh_threshold=0.5):
+        # Skip MongoDBSessionInterface.__init__, which needs a connected client up front
+        ServerSideSessionInterface.__init__(self, app, key_prefix, use_signer, permanent, sid_length,
+                                            serialization_format)
+        self.db_name = db
+        self.collection_name = collection
+        self.use_deprecated_method = False
+        self._indexed_client = None
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl) if cache_ttl > 0 else None
+        self.refresh_threshold = refresh_threshold
+        self._loaded = threading.local()
+        self.reads = 0
+        self.writes = 0
+        self.skipped_writes = 0
+
+    @property
+    def client(self):
+        return get_client()
+
+    @property
+    def store(self):
+        client = get_client()
+        store = client[self.db_name][self.collection_name]
+        if self._indexed_client is not client:
+            # Once per process: TTL expiry on `expiration` and the lookup key
+            store.create_index("expiration", expireAfterSeconds=0)
+            store.create_index("id")
+            self._indexed_client = client
+        return store
+
+    def open_session(self, app, request):
+        self._loaded.value = None
+        session = super().open_session(app, request)
+        loaded = self._loaded.value
+        self._loaded.value = None
+
+        # Remember what storage holds so save_session can tell if a write is needed
+        if loaded and loaded[0] == self._get_store_id(session.sid):
+            session.stored_value, session.stored_expiration = loaded[1], loaded[2]
+        return session
+
+    def _retrieve_session_data(self, store_id):
+        cached = self.cache.get(store_id) if self.cache is not None else None
+        if cached is None:
+            self.reads += 1
+            document = self.store.find_one({"id": store_id, "expiration": {"$gt": datetime.utcnow()}})
+            if not document:
+                return None
+            cached = (want_bytes(document["val"]), document["expiration"])
+            if self.cache is not None:
+                self.cache.set(store_id, cached)
+
+        self._loaded.value = (store_id, cached[0], cached[1])
+        return self.serializer.decode(cached[0])
+
+    def _delete_session(self, store_id):
+        if self.cache is not None:
+            self.cache.invalidate(store_id)
+        super()._delete_session(store_id)
+
+    def _upsert_session(self, session_lifetime, session, store_id):
+        serialized_session_data = self.serializer.encode(session)
+        now = datetime.utcnow()
+
+        stored_expiration = getattr(session, 'stored_expiration', None)
+        if (getattr(session, 'stored_value', None) == serialized_session_data
+                and stored_expiration is not None
+                and stored_expiration - now > session_lifetime * self.refresh_threshold):
+            self.skipped_writes += 1
+            return
+
+        storage_expiration_datetime = now + session_lifetime
+        self.store.update_one(
+            {"id": store_id},
+            {
+                "$set": {
+                    "id": store_id,
+                    "val": serialized_session_data,
+                    "expiration": storage_expiration_datetime,
+                }
+            },
+            True,
+        )
+        self.writes += 1
+        session.stored_value = serialized_session_data
+        session.stored_expiration = storage_expiration_datetime
+        if self.cache is not None:
+            self.cache.set(store_id, (serialized_session_data, storage_expiration_datetime))
+
+    def stats(self):
+        return {
+            'reads': self.reads,
+            'writes': self.writes,
+            'skipped_writes': self.skipped_writes,
+            'cache': self.cache.stats() if self.cache is not None else None
+        }
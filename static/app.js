@@ -104,6 +104,11 @@ class FitTrackerApp {
     }
 
     setupOfflineHandling() {
+        // Flush anything left over from a previous offline session
+        if (navigator.onLine) {
+            this.syncOfflineData();
+        }
+
         // Handle online/offline status
         window.addEventListener('online', () => {
             this.showNetworkStatus('Back online! Your data will sync now.', 'success');
@@ -142,18 +147,56 @@ class FitTrackerApp {
         if (offlineData) {
             try {
                 const data = JSON.parse(offlineData);
-                // Send offline data to server
-                this.sendOfflineData(data);
-                localStorage.removeItem('fittracker_offline_data');
+                if (data.length > 0) {
+                    this.sendOfflineData(data);
+                }
             } catch (error) {
                 console.error('Error syncing offline data:', error);
             }
         }
     }
 
-    sendOfflineData(data) {
-        // Implementation for sending offline data to server
-        console.log('Syncing offline data:', data);
+    async sendOfflineData(data) {
+        // Items queued before idempotency keys existed get one now, persisted
+        // so a retry after a lost response reuses the same key
+        const missingIds = data.filter(item => !item.id);
+        if (missingIds.length > 0) {
+            missingIds.forEach(item => {
+                item.id = `${item.timestamp || Date.now()}-${Math.random().toString(36).slice(2)}`;
+            });
+            localStorage.setItem('fittracker_offline_data', JSON.stringify(data));
+        }
+
+        try {
+            const response = await fetch('/sync', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ items: data })
+            });
+            if (!response.ok) {
+                throw new Error(`Sync failed with status ${response.status}`);
+            }
+            const results = (await response.json()).results || {};
+
+            // Keep only what the server did not accept; items queued while the
+            // request was in flight are preserved as well
+            const sentIds = new Set(data.map(item => item.id));
+            const current = JSON.parse(localStorage.getItem('fittracker_offline_data') || '[]');
+            const remaining = current.filter(item => {
+                if (!sentIds.has(item.id)) {
+                    return true;
+                }
+                return results[item.id] === undefined || results[item.id] === 'error';
+            });
+
+            if (remaining.length > 0) {
+                localStorage.setItem('fittracker_offline_data', JSON.stringify(remaining));
+            } else {
+                localStorage.removeItem('fittracker_offline_data');
+            }
+        } catch (error) {
+            console.error('Error sending offline data:', error);
+        }
     }
 
     setupTouchOptimizations() {
@@ -1,39 +1,18 @@
-const CACHE_NAME = 'fittracker-v1';
-const urlsToCache = [
-  '/',
-  '/dashboard',
-  '/exercise_library',
-  '/static/app.js',
-  '/static/workout.js',
-  '/static/timer.js',
-  '/static/manifest.json',
-  'https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css',
-  'https://unpkg.com/feather-icons',
-  'https://cdn.jsdelivr.net/npm/chart.js',
-  'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js'
-];
+// CACHE_VERSION and PRECACHE_URLS are prepended by the server from the
+// static asset manifest (see static_assets.py), so a deploy that changes
+// any asset installs a new worker with fresh caches.
+const ASSET_CACHE = `fittracker-assets-${CACHE_VERSION}`;
+const PAGE_CACHE = `fittracker-pages-${CACHE_VERSION}`;
 
 self.addEventListener('install', function(event) {
   event.waitUntil(
-    caches.open(CACHE_NAME)
+    caches.open(ASSET_CACHE)
       .then(function(cache) {
-        console.log('Opened cache');
-        return cache.addAll(urlsToCache);
+        return cache.addAll(PRECACHE_URLS);
+      })
+      .then(function() {
+        return self.skipWaiting();
       })
-  );
-});
-
-self.addEventListener('fetch', function(event) {
-  event.respondWith(
-    caches.match(event.request)
-      .then(function(response) {
-        // Return cached version or fetch from network
-        if (response) {
-          return response;
-        }
-        return fetch(event.request);
-      }
-    )
   );
 });
 
@@ -42,15 +21,124 @@ self.addEventListener('activate', function(event) {
     caches.keys().then(function(cacheNames) {
       return Promise.all(
         cacheNames.map(function(cacheName) {
-          if (cacheName !== CACHE_NAME) {
+          if (cacheName !== ASSET_CACHE && cacheName !== PAGE_CACHE) {
             return caches.delete(cacheName);
           }
         })
       );
+    }).then(function() {
+      return self.clients.claim();
     })
   );
 });
 
+// Fingerprinted and third-party assets never change under a URL: cache first
+function cacheFirst(request) {
+  return caches.match(request).then(function(cached) {
+    if (cached) {
+      return cached;
+    }
+    return fetch(request).then(function(response) {
+      if (response.ok) {
+        const copy = response.clone();
+        caches.open(ASSET_CACHE).then(function(cache) { cache.put(request, copy); });
+      }
+      return response;
+    });
+  });
+}
+
+// Read APIs whose responses are per-user views of the user's own data (and
+// revalidated by ETag). Job polling, exports and cross-user boards such as
+// /api/leaderboard always go to the network.
+const CACHED_API_PATHS = ['/api/activity', '/api/records', '/api/progress', '/api/training_load',
+                          '/api/sessions', '/api/exercises'];
+
+function isCacheable(response) {
+  // Redirects (e.g. to the login page), errors and no-store responses are never cached
+  const cacheControl = response.headers.get('Cache-Control') || '';
+  return response.ok && !response.redirected && response.type === 'basic' && !/no-store/i.test(cacheControl);
+}
+
+// API reads: answer from cache straight away when possible and refresh the
+// cached copy in the background (the server answers unchanged data with a
+// cheap 304). Falls back to the network, then the cache offline.
+function staleWhileRevalidate(event) {
+  const request = event.request;
+  const network = fetch(request).then(function(response) {
+    if (isCacheable(response)) {
+      const copy = response.clone();
+      event.waitUntil(caches.open(PAGE_CACHE).then(function(cache) { return cache.put(request, copy); }));
+    }
+    return response;
+  });
+
+  return caches.open(PAGE_CACHE).then(function(cache) {
+    return cache.match(request).then(function(cached) {
+      if (cached) {
+        event.waitUntil(network.catch(function() {}));
+        return cached;
+      }
+      return network;
+    });
+  });
+}
+
+// Pages: always ask the network, so flash messages and fresh markup are
+// shown once and in order; the cached copy only serves offline visits.
+function networkFirst(event) {
+  const request = event.request;
+  return fetch(request).then(function(response) {
+    if (isCacheable(response)) {
+      const copy = response.clone();
+      event.waitUntil(caches.open(PAGE_CACHE).then(function(cache) { return cache.put(request, copy); }));
+    }
+    return response;
+  }).catch(function(error) {
+    return caches.open(PAGE_CACHE).then(function(cache) {
+      return cache.match(request).then(function(cached) {
+        if (cached) {
+          return cached;
+        }
+        throw error;
+      });
+    });
+  });
+}
+
+self.addEventListener('fetch', function(event) {
+  const request = event.request;
+  if (request.method !== 'GET') {
+    return;
+  }
+
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin) {
+    if (PRECACHE_URLS.includes(request.url)) {
+      event.respondWith(cacheFirst(request));
+    }
+    return;
+  }
+
+  if (url.pathname.startsWith('/assets/')) {
+    event.respondWith(cacheFirst(request));
+  } else if (url.pathname.startsWith('/api/')) {
+    // Includes navigations to /api/ URLs, e.g. the history download link
+    if (CACHED_API_PATHS.includes(url.pathname) && request.mode !== 'navigate') {
+      event.respondWith(staleWhileRevalidate(event));
+    }
+  } else if (request.mode === 'navigate') {
+    event.respondWith(networkFirst(event));
+  }
+});
+
+// Signed-out pages ask for cached per-user pages to be dropped
+self.addEventListener('message', function(event) {
+  if (event.data && event.data.type === 'clear-pages') {
+    event.waitUntil(caches.delete(PAGE_CACHE));
+  }
+});
+
 // Handle push notifications
 self.addEventListener('push', function(event) {
   if (event.data) {
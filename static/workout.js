@@ -100,9 +100,13 @@ class WorkoutTracker {
     }
 
     async sendExerciseData(exerciseKey, setsData) {
+        // One key per write, sent now and reused if it has to be queued, so a
+        // request that reached the server before the connection dropped isn't applied twice
+        const syncId = this.generateSyncId();
         const formData = new FormData();
         formData.append('session_id', this.sessionId);
         formData.append('exercise_key', exerciseKey);
+        formData.append('sync_key', syncId);
         
         setsData.sets_completed.forEach(completed => {
             formData.append('sets_completed[]', completed);
@@ -124,16 +128,66 @@ class WorkoutTracker {
             console.error('Network error:', error);
             
             // Store offline for later sync
-            this.storeOfflineData(exerciseKey, setsData);
+            this.storeOfflineData(syncId, exerciseKey, setsData);
             
             return { success: true }; // Assume success for offline handling
         }
     }
 
-    storeOfflineData(exerciseKey, setsData) {
+    async logSet(exerciseKey, setIndex, reps, weight) {
+        // Record a single set as soon as it is ticked off
+        const syncId = this.generateSyncId();
+        const formData = new FormData();
+        formData.append('session_id', this.sessionId);
+        formData.append('exercise_key', exerciseKey);
+        formData.append('sync_key', syncId);
+        formData.append('set_index', setIndex);
+        formData.append('reps', reps);
+        formData.append('weight', weight);
+
+        try {
+            const response = await fetch('/log_set', {
+                method: 'POST',
+                body: formData
+            });
+            return await response.json();
+        } catch (error) {
+            console.error('Network error logging set:', error);
+            this.storeOfflineSet(syncId, exerciseKey, setIndex, reps, weight);
+            return { success: true };
+        }
+    }
+
+    generateSyncId() {
+        // Idempotency key so the server applies each queued write exactly once
+        if (window.crypto && typeof window.crypto.randomUUID === 'function') {
+            return window.crypto.randomUUID();
+        }
+        return `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    }
+
+    storeOfflineSet(syncId, exerciseKey, setIndex, reps, weight) {
+        const offlineData = JSON.parse(localStorage.getItem('fittracker_offline_data') || '[]');
+
+        offlineData.push({
+            id: syncId,
+            type: 'log_set',
+            sessionId: this.sessionId,
+            exerciseKey: exerciseKey,
+            setIndex: setIndex,
+            reps: reps,
+            weight: weight,
+            timestamp: Date.now()
+        });
+
+        localStorage.setItem('fittracker_offline_data', JSON.stringify(offlineData));
+    }
+
+    storeOfflineData(syncId, exerciseKey, setsData) {
         const offlineData = JSON.parse(localStorage.getItem('fittracker_offline_data') || '[]');
         
         offlineData.push({
+            id: syncId,
             type: 'complete_exercise',
             sessionId: this.sessionId,
             exerciseKey: exerciseKey,
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+
+from flask import abort, current_app, send_from_directory, url_for
+
+# Fingerprinted assets never change under a given URL
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Source of the service worker; served from /sw.js (so its scope is the whole
+# app) with the precache list prepended, never fingerprinted itself
+SERVICE_WORKER = 'sw.js'
+
+# Third-party assets the pages load, precached alongside our own
+EXTERNAL_PRECACHE_URLS = [
+    'https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css',
+    'https://unpkg.com/feather-icons',
+    'https://cdn.jsdelivr.net/npm/chart.js',
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js'
+]
+
+
+class AssetManifest:
+    """Content-hash fingerprints for everything under static/.
+
+    Built once at startup: `app.js` is served as /assets/app.<hash>.js with
+    `Cache-Control: immutable`, and templates link it through the
+    `asset_url('app.js')` helper, so a deploy changes the URL of exactly the
+    files that changed. The same manifest feeds the service worker's precache
+    list and cache name. With app.debug the manifest is rebuilt on every
+    lookup so edits show up without a restart.
+    """
+
+    def __init__(self, app=None, url_prefix='/assets'):
+        self.url_prefix = url_prefix
+        self.files = {}
+        self.reverse = {}
+        self.version = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.build()
+        app.add_url_rule(f'{self.url_prefix}/<path:filename>', 'assets', self.send_asset)
+        app.add_url_rule('/sw.js', 'service_worker', self.service_worker)
+        app.jinja_env.globals['asset_url'] = self.url_for
+        app.extensions['asset_manifest'] = self
+
+    def build(self):
+        """Hash every static file into {logical name: fingerprinted name}"""
+        files = {}
+        static_folder = self.app.static_folder
+        for root, dirs, names in os.walk(static_folder):
+            dirs.sort()
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+                if filename == SERVICE_WORKER:
+                    continue
+                with open(path, 'rb') as f:
+                    digest = hashlib.sha1(f.read()).hexdigest()[:10]
+                stem, ext = os.path.splitext(filename)
+                files[filename] = f'{stem}.{digest}{ext}'
+
+        self.files = files
+        self.reverse = {hashed: filename for filename, hashed in files.items()}
+        self.version = hashlib.sha1(json.dumps(files, sort_keys=True).encode()).hexdigest()[:10]
+
+    def _refresh(self):
+        if self.app.debug:
+            self.build()
+
+    def url_for(self, filename):
+        """URL of the fingerprinted copy of a static file (plain /static/ if unknown)"""
+        self._refresh()
+        hashed = self.files.get(filename)
+        if hashed is None:
+            return url_for('static', filename=filename)
+        return url_for('assets', filename=hashed)
+
+    def send_asset(self, filename):
+        self._refresh()
+        source = self.reverse.get(filename)
+        if source is None:
+            abort(404)
+        response = send_from_directory(current_app.static_folder, source, max_age=IMMUTABLE_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    def precache_urls(self):
+        return [self.url_for(filename) for filename in self.files] + EXTERNAL_PRECACHE_URLS
+
+    def service_worker(self):
+        """static/sw.js with the cache version and precache list prepended"""
+        self._refresh()
+        with open(os.path.join(current_app.static_folder, SERVICE_WORKER)) as f:
+            source = f.read()
+        body = (
+            f"const CACHE_VERSION = {json.dumps(self.version)};\n"
+            f"const PRECACHE_URLS = {json.dumps(self.precache_urls(), indent=2)};\n\n"
+            + source
+        )
+        response = current_app.response_class(body, mimetype='application/javascript')
+        # Browsers byte-compare the worker on navigation; never serve it from HTTP cache
+        response.cache_control.no_cache = True
+        return response
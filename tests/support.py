@@ -0,0 +1,56 @@
+"""Shared setup for the tests that need a MongoDB server.
+
+Point MONGODB_URI at a scratch database; every test user (and everything
+they write) is removed again in tearDown.
+"""
+import os
+import sys
+import unittest
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SESSION_SECRET", "test")
+
+needs_mongo = unittest.skipUnless(os.environ.get("MONGODB_URI"), "needs a MongoDB server in MONGODB_URI")
+
+USER_COLLECTIONS = ('workout_sessions', 'workout_plans', 'activity_days', 'jobs', 'workout_archive')
+USER_DOCUMENTS = ('user_stats', 'personal_records', 'data_versions', 'training_reports', 'users')
+
+
+class AppTestCase(unittest.TestCase):
+    """A test app with `self.user` logged in on `self.client`"""
+
+    @classmethod
+    def setUpClass(cls):
+        from app import create_app
+        cls.app = create_app({'TESTING': True})
+
+    def setUp(self):
+        self.users = []
+        self.user = self.new_user()
+        self.client = self.login(self.user)
+
+    def tearDown(self):
+        import leaderboard
+        from models import db
+        for user in self.users:
+            for collection in USER_COLLECTIONS:
+                db[collection].delete_many({"user_id": user.id})
+            # With no sessions left this takes the user off the current boards
+            leaderboard.rebuild(user.id)
+            for collection in USER_DOCUMENTS:
+                db[collection].delete_many({"_id": user.id})
+
+    def new_user(self, **fields):
+        from models import User
+        user = User(email=f'test-{uuid.uuid4().hex[:8]}@example.com', username='Test', **fields).save()
+        self.users.append(user)
+        return user
+
+    def login(self, user):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = user.id
+            session['_fresh'] = True
+        return client
@@ -0,0 +1,62 @@
+"""ActivityIndex streaks against the session-walking reference in routes.calculate_streak."""
+import random
+import unittest
+from datetime import datetime, time, timedelta
+from types import SimpleNamespace
+
+from support import AppTestCase, needs_mongo
+from models import ActivityIndex
+from routes import calculate_streak
+
+
+def longest_run(days):
+    longest = run = 0
+    previous = None
+    for day in sorted(days):
+        run = run + 1 if previous and (day - previous).days == 1 else 1
+        longest = max(longest, run)
+        previous = day
+    return longest
+
+
+class StreakTest(unittest.TestCase):
+
+    def test_matches_reference_on_random_histories(self):
+        rng = random.Random(3)
+        today = datetime.now().date()
+        for _ in range(200):
+            # The reference counts sessions, so keep to one session per active day
+            density = rng.random()
+            days = {today - timedelta(days=offset) for offset in range(rng.randint(0, 120))
+                    if rng.random() < density}
+            sessions = [SimpleNamespace(end_time=datetime.combine(day, time(rng.randint(0, 23))))
+                        for day in days]
+            # Unfinished sessions never count
+            sessions.append(SimpleNamespace(end_time=None))
+            rng.shuffle(sessions)
+
+            index = ActivityIndex('user', sum(1 << ActivityIndex.position(day) for day in days))
+            self.assertEqual(index.current_streak(today), calculate_streak(sessions), sorted(days))
+            self.assertEqual(index.longest_streak(), longest_run(days), sorted(days))
+
+    def test_yesterday_keeps_the_streak_open(self):
+        today = datetime.now().date()
+        index = ActivityIndex('user')
+        for offset in (1, 2, 3, 5):
+            index.bits |= 1 << ActivityIndex.position(today - timedelta(days=offset))
+        self.assertEqual(index.current_streak(today), 3)
+        self.assertEqual(index.longest_streak(), 3)
+
+
+@needs_mongo
+class ActivityApiTest(AppTestCase):
+
+    def test_days_is_clamped(self):
+        for days, length in (('-1', 1), ('0', 1), ('7', 7), ('100000', 366 * 5)):
+            response = self.client.get(f'/api/activity?days={days}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.get_json()['heatmap']['days']), length)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+"""ID token verification against a stand-in OpenID provider serving discovery and JWKS."""
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import support  # noqa: F401 (puts the app on sys.path)
+import google_auth
+
+CLIENT_ID = 'test-client.apps.example.com'
+
+
+def new_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def public_jwk(private_key, kid):
+    return dict(json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key())), kid=kid, use='sig')
+
+
+class IdentityProvider:
+    """Serves /.well-known/openid-configuration and /jwks; `keys` can change while it runs"""
+
+    def __init__(self):
+        self.keys = []
+        self.jwks_requests = 0
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/jwks':
+                    provider.jwks_requests += 1
+                    document = {'keys': provider.keys}
+                else:
+                    document = provider.configuration
+                body = json.dumps(document).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', 'max-age=3600')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.issuer = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.configuration = {'issuer': self.issuer, 'jwks_uri': f'{self.issuer}/jwks'}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class VerifyIdTokenTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.provider = IdentityProvider()
+        cls.key = new_key()
+        cls.other_key = new_key()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.provider.close()
+
+    def setUp(self):
+        self.provider.keys = [public_jwk(self.key, 'current')]
+        patcher = mock.patch.object(google_auth, 'GOOGLE_CLIENT_ID', CLIENT_ID)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        google_auth._cache.clear()
+
+    def token(self, key=None, kid='current', **claims):
+        now = int(time.time())
+        claims = dict({'iss': self.provider.issuer, 'aud': CLIENT_ID, 'sub': '1234', 'email': 'a@example.com',
+                       'email_verified': True, 'given_name': 'A', 'iat': now, 'exp': now + 3600}, **claims)
+        return jwt.encode(claims, key or self.key, algorithm='RS256', headers={'kid': kid})
+
+    def verify(self, token):
+        return google_auth.verify_id_token(token, self.provider.configuration)
+
+    def test_good_token(self):
+        claims = self.verify(self.token())
+        self.assertEqual(claims['sub'], '1234')
+        self.assertEqual(claims['email'], 'a@example.com')
+
+    def test_issuer_without_scheme(self):
+        configuration = dict(self.provider.configuration, issuer='https://accounts.example.com')
+        for issuer in ('https://accounts.example.com', 'accounts.example.com'):
+            self.assertIsNotNone(google_auth.verify_id_token(self.token(iss=issuer), configuration))
+
+    def test_bad_signature(self):
+        self.assertIsNone(self.verify(self.token(key=self.other_key)))
+        header, payload, signature = self.token().split('.')
+        tampered = jwt.utils.base64url_encode(json.dumps({'sub': 'someone-else'}).encode()).decode()
+        self.assertIsNone(self.verify(f'{header}.{tampered}.{signature}'))
+
+    def test_wrong_audience(self):
+        self.assertIsNone(self.verify(self.token(aud='another-client')))
+        self.assertIsNone(self.verify(self.token(aud=None)))
+
+    def test_wrong_issuer(self):
+        self.assertIsNone(self.verify(self.token(iss='https://accounts.example.org')))
+
+    def test_expired(self):
+        now = int(time.time())
+        self.assertIsNone(self.verify(self.token(iat=now - 7200, exp=now - google_auth.CLOCK_SKEW_SECONDS - 10)))
+        # Within the allowed clock skew
+        self.assertIsNotNone(self.verify(self.token(exp=now - 10)))
+
+    def test_issued_in_the_future(self):
+        self.assertIsNone(self.verify(self.token(iat=int(time.time()) + 3600)))
+
+    def test_unknown_kid(self):
+        self.assertIsNone(self.verify(self.token(kid='retired')))
+
+    def test_rotated_key_is_fetched_once(self):
+        self.assertIsNotNone(self.verify(self.token()))
+        requests_before = self.provider.jwks_requests
+        self.provider.keys.append(public_jwk(self.other_key, 'next'))
+        self.assertIsNotNone(self.verify(self.token(key=self.other_key, kid='next')))
+        self.assertEqual(self.provider.jwks_requests, requests_before + 1)
+
+    def test_other_algorithms_are_refused(self):
+        now = int(time.time())
+        claims = {'iss': self.provider.issuer, 'aud': CLIENT_ID, 'sub': '1234', 'iat': now, 'exp': now + 3600}
+        unsigned = jwt.encode(claims, None, algorithm='none', headers={'kid': 'current'})
+        self.assertIsNone(self.verify(unsigned))
+        hmac_signed = jwt.encode(claims, 'a shared secret of at least 32 bytes', algorithm='HS256',
+                                 headers={'kid': 'current'})
+        self.assertIsNone(self.verify(hmac_signed))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+"""Conditional GETs and caching headers on the user's pages."""
+import unittest
+
+from support import AppTestCase, needs_mongo
+
+
+@needs_mongo
+class FlashCachingTest(AppTestCase):
+
+    def test_pages_showing_flashes_are_not_stored(self):
+        with self.client.session_transaction() as session:
+            session['_flashes'] = [('success', 'Workout plan created!')]
+        response = self.client.get('/dashboard')
+        self.assertIn(b'Workout plan created!', response.data)
+        self.assertTrue(response.cache_control.no_store)
+
+        response = self.client.get('/dashboard')
+        self.assertNotIn(b'Workout plan created!', response.data)
+        self.assertFalse(response.cache_control.no_store)
+        self.assertTrue(response.get_etag()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""Leaderboard ranks from the bucketed histogram, checked against brute force."""
+import random
+import unittest
+import uuid
+from datetime import datetime, timedelta
+
+from support import needs_mongo
+import leaderboard
+
+# A week long past, so nothing else writes to its boards
+WEEK = datetime(2020, 1, 6)
+
+
+class ScoreBoundsTest(unittest.TestCase):
+
+    def test_buckets_hold_their_scores(self):
+        rng = random.Random(25)
+        for score in [0, 1, 99, 99.5, 100, 109, 110, 999, 1000, 1234567] + [rng.uniform(0, 1e7) for _ in range(500)]:
+            low, high = leaderboard.score_bounds(score)
+            self.assertLessEqual(low, score)
+            self.assertLess(score, high)
+            # Two significant digits, and exact below 100
+            self.assertEqual(high - low, 1 if score < 100 else 10 ** (len(str(int(score))) - 2))
+
+    def test_negative_scores_share_the_zero_bucket(self):
+        self.assertEqual(leaderboard.score_bounds(-3), (0, 1))
+
+
+@needs_mongo
+class RankTest(unittest.TestCase):
+
+    def setUp(self):
+        from models import db
+        self.db = db
+        self.key = leaderboard.period_key('week', WEEK)
+        self.cleanup()
+        self.addCleanup(self.cleanup)
+
+    def cleanup(self):
+        keys = [self.key, leaderboard.period_key('month', WEEK.replace(day=1))]
+        self.db.leaderboard_scores.delete_many({"period": {"$in": keys}})
+        self.db.leaderboard_histograms.delete_many({"period": {"$in": keys}})
+
+    def expected_rank(self, scores, user_id):
+        return 1 + sum(1 for score in scores.values() if score > scores[user_id])
+
+    def test_ranks_match_brute_force(self):
+        rng = random.Random(25)
+        users = [f'rank-test-{uuid.uuid4().hex[:8]}' for _ in range(60)]
+        for user_id in users:
+            for _ in range(rng.randint(1, 4)):
+                # Ties, single-point buckets and wide ones
+                volume = rng.choice([0, 50, 50, 99, rng.randint(100, 999), round(rng.uniform(1000, 250000), 1)])
+                leaderboard.record_workout(user_id, WEEK + timedelta(days=rng.randint(0, 6), hours=12),
+                                           volume, rng.randint(1, 7))
+
+        for metric in leaderboard.METRICS:
+            scores = {score_data['user_id']: score_data[metric]
+                      for score_data in self.db.leaderboard_scores.find({"period": self.key})}
+            self.assertEqual(len(scores), len(users))
+            for user_id in users:
+                mine = leaderboard.rank(self.key, 'unspecified', metric, user_id)
+                self.assertEqual(mine['rank'], self.expected_rank(scores, user_id), (metric, user_id))
+                self.assertEqual(mine['score'], scores[user_id])
+                self.assertEqual(mine['participants'], len(users))
+
+            top = leaderboard.top(self.key, 'unspecified', metric, limit=len(users))
+            self.assertEqual([entry['rank'] for entry in top],
+                             [self.expected_rank(scores, entry['user_id']) for entry in top])
+
+    def test_rebuilt_histogram_matches_the_incremental_one(self):
+        rng = random.Random(7)
+        for index in range(30):
+            leaderboard.record_workout(f'rank-test-{index}', WEEK + timedelta(hours=index),
+                                       rng.choice([5, 120, 4400, 98765]), 1)
+        histogram_id = f"{self.key}:unspecified"
+        incremental = self.db.leaderboard_histograms.find_one({"_id": histogram_id})
+        leaderboard.rebuild_histogram(self.key, 'unspecified', incremental['ends'])
+        rebuilt = self.db.leaderboard_histograms.find_one({"_id": histogram_id})
+        for metric in leaderboard.METRICS:
+            self.assertEqual({bucket: count for bucket, count in incremental[metric].items() if count},
+                             rebuilt[metric], metric)
+
+    def test_removing_workouts_recomputes_the_streak_and_drops_empty_entries(self):
+        from models import ActivityIndex
+        user_id = f'rank-test-{uuid.uuid4().hex[:8]}'
+        self.addCleanup(self.db.activity_days.delete_many, {"user_id": user_id})
+        monday, tuesday = WEEK + timedelta(hours=18), WEEK + timedelta(days=1, hours=18)
+        for when, volume, streak in ((monday, 100, 1), (tuesday, 50, 2)):
+            ActivityIndex.mark(user_id, when.date())
+            leaderboard.record_workout(user_id, when, volume, streak)
+        self.assertEqual(leaderboard.rank(self.key, 'unspecified', 'streak', user_id)['score'], 2)
+
+        # As WorkoutSession.delete does: unmark the day, then take the workout off the boards
+        after = WEEK + timedelta(days=30)
+        ActivityIndex.unmark_if_inactive(user_id, tuesday.date())
+        leaderboard.remove_workout(user_id, tuesday, 50, now=after)
+        score_data = self.db.leaderboard_scores.find_one({"_id": f"{self.key}:{user_id}"})
+        self.assertEqual((score_data['volume'], score_data['workouts'], score_data['streak']), (100, 1, 1))
+
+        ActivityIndex.unmark_if_inactive(user_id, monday.date())
+        leaderboard.remove_workout(user_id, monday, 100, now=after)
+        self.assertIsNone(self.db.leaderboard_scores.find_one({"_id": f"{self.key}:{user_id}"}))
+        self.assertIsNone(leaderboard.rank(self.key, 'unspecified', 'workouts', user_id))
+        histogram = self.db.leaderboard_histograms.find_one({"_id": f"{self.key}:unspecified"})
+        for metric in leaderboard.METRICS:
+            self.assertEqual(sum(histogram[metric].values()), 0, metric)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+"""/health liveness and the token-guarded /metrics scrape."""
+import unittest
+from unittest import mock
+
+import support  # noqa: F401 (puts the app on sys.path)
+import metrics
+from app import create_app
+
+
+class HealthAndMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = create_app({'TESTING': True}).test_client()
+
+    def test_health_is_liveness_only(self):
+        response = self.client.get('/health')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.get_json()), {'status', 'timestamp'})
+
+    def test_metrics_need_the_token(self):
+        with mock.patch.object(metrics, 'METRICS_TOKEN', 'scrape-token'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 401)
+            response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-token'})
+        self.assertEqual(response.status_code, 200)
+        body = response.get_data(as_text=True)
+        for name in ('fittracker_cache_lookups_total{cache="user",result="hit"', 'fittracker_mongo_pool_in_use',
+                     'fittracker_session_store_operations_total{operation="read"'):
+            self.assertIn(name, body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+"""Runs `flask check-query-plans` against the database in MONGODB_URI.
+
+Skipped without MONGODB_URI. Point it at a scratch database: the check
+applies the declared indexes and creates (then removes) its own user.
+CI runs it against a mongo service (.github/workflows/tests.yml).
+
+    MONGODB_URI=mongodb://localhost:27017/fittracker_test SESSION_SECRET=test \\
+        python -m unittest discover tests
+"""
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@unittest.skipUnless(os.environ.get("MONGODB_URI"), "needs a MongoDB server in MONGODB_URI")
+class QueryPlanTest(unittest.TestCase):
+
+    def flask(self, *args):
+        # A fresh process each time: the recorder must be registered before the MongoClient exists
+        env = dict(os.environ, FLASK_APP='main.py', SESSION_SECRET=os.environ.get('SESSION_SECRET', 'test'))
+        return subprocess.run([sys.executable, '-m', 'flask', *args], cwd=ROOT, env=env,
+                              capture_output=True, text=True, timeout=300)
+
+    def test_every_query_uses_an_index(self):
+        indexes = self.flask('ensure-indexes')
+        self.assertEqual(indexes.returncode, 0, indexes.stderr)
+        check = self.flask('check-query-plans')
+        self.assertEqual(check.returncode, 0, check.stdout + check.stderr)
+        self.assertIn('0 without a usable index', check.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""Personal records: 1RM estimates, candidate sets and keeping the best of them."""
+import unittest
+from datetime import datetime, timedelta
+
+from support import AppTestCase, needs_mongo
+from models import PersonalRecords
+
+AT = datetime(2026, 3, 1, 8, 0)
+
+
+class EstimateTest(unittest.TestCase):
+
+    def test_epley(self):
+        self.assertEqual(PersonalRecords.epley(100, 5), 116.7)
+        self.assertEqual(PersonalRecords.epley(60, 10), 80.0)
+        self.assertEqual(PersonalRecords.epley(100, 1), 100)
+
+    def test_brzycki(self):
+        self.assertEqual(PersonalRecords.brzycki(100, 5), 112.5)
+        self.assertEqual(PersonalRecords.brzycki(60, 10), 80.0)
+        self.assertEqual(PersonalRecords.brzycki(100, 1), 100)
+
+
+class CandidatesTest(unittest.TestCase):
+
+    def candidates(self, sets, volume=None):
+        volume = PersonalRecords.volume(sets) if volume is None else volume
+        return PersonalRecords.candidates(sets, volume, 'session', AT)
+
+    def test_best_sets(self):
+        found = self.candidates([{'reps': 5, 'weight': 100}, {'reps': 8, 'weight': 100}, {'reps': 3, 'weight': 90},
+                                 {'reps': 0, 'weight': 140}])
+        # Ties on weight go to the set with more reps; sets with no reps don't count
+        self.assertEqual((found['best_weight']['value'], found['best_weight']['reps']), (100, 8))
+        self.assertEqual(found['e1rm_epley']['value'], PersonalRecords.epley(100, 8))
+        self.assertEqual(found['e1rm_brzycki']['value'], PersonalRecords.brzycki(100, 8))
+        self.assertEqual(found['best_volume']['value'], 1570)
+        self.assertEqual(found['reps_at_weight'], {'100': 8, '90': 3})
+
+    def test_long_and_bodyweight_sets_have_no_estimate(self):
+        found = self.candidates([{'reps': 20, 'weight': 40}, {'reps': 15, 'weight': 0}])
+        self.assertNotIn('e1rm_epley', found)
+        self.assertNotIn('e1rm_brzycki', found)
+        self.assertEqual(found['best_weight']['value'], 40)
+        self.assertEqual(found['reps_at_weight'], {'40': 20, '0': 15})
+
+    def test_fractional_weights_make_safe_field_names(self):
+        found = self.candidates([{'reps': 5, 'weight': 62.5}])
+        self.assertEqual(found['reps_at_weight'], {'62_5': 5})
+
+
+class MergeTest(unittest.TestCase):
+
+    def test_only_better_sets_replace_records(self):
+        exercises = {}
+        first = PersonalRecords.candidates([{'reps': 5, 'weight': 100}], 500, 'first', AT)
+        PersonalRecords.merge(exercises, 'squat', first, AT)
+
+        later = AT + timedelta(days=7)
+        second = PersonalRecords.candidates([{'reps': 10, 'weight': 90}], 900, 'second', later)
+        PersonalRecords.merge(exercises, 'squat', second, later)
+
+        records = exercises['squat']
+        # Lighter, so the heaviest set stays; more volume and a higher Epley estimate replace theirs
+        self.assertEqual(records['best_weight']['session_id'], 'first')
+        self.assertEqual(records['best_volume']['session_id'], 'second')
+        self.assertEqual(records['e1rm_epley']['session_id'], 'second')
+        self.assertEqual(records['e1rm_brzycki']['session_id'], 'second')
+        self.assertEqual(records['reps_at_weight'], {'100': 5, '90': 10})
+        self.assertEqual(records['updated_at'], later)
+
+        # An equal set is not a new record
+        PersonalRecords.merge(exercises, 'squat', PersonalRecords.candidates(
+            [{'reps': 5, 'weight': 100}], 500, 'third', later + timedelta(days=1)), None)
+        self.assertEqual(records['best_weight']['session_id'], 'first')
+
+
+@needs_mongo
+class RecordTest(AppTestCase):
+
+    def test_stored_records_match_a_rebuild(self):
+        from models import WorkoutSession
+        workouts = [
+            [{'reps': 5, 'weight': 100}, {'reps': 5, 'weight': 100}],
+            [{'reps': 10, 'weight': 90}],
+            [{'reps': 3, 'weight': 110}, {'reps': 12, 'weight': 60}],
+            [{'reps': 5, 'weight': 100}],
+        ]
+        for days_ago, sets in zip((9, 6, 3, 1), workouts):
+            session = WorkoutSession(plan_id='test-plan', user_id=self.user.id,
+                                     start_time=datetime.utcnow() - timedelta(days=days_ago)).save()
+            self.assertTrue(WorkoutSession.append_exercise(session.id, self.user.id,
+                                                           {'exercise_key': 'squat', 'sets': sets}))
+        stored = PersonalRecords.get(self.user.id).for_exercise('squat')
+        rebuilt = PersonalRecords.rebuild(self.user.id).for_exercise('squat')
+
+        self.assertEqual(stored['best_weight']['value'], 110)
+        self.assertEqual(stored['best_volume']['value'], 1050)
+        self.assertEqual(stored['e1rm_epley']['value'], PersonalRecords.epley(110, 3))
+        self.assertEqual(stored['reps_at_weight'], {'100': 5, '90': 10, '110': 3, '60': 12})
+        for name in PersonalRecords.TRACKED:
+            self.assertEqual((stored[name]['value'], stored[name]['session_id']),
+                             (rebuilt[name]['value'], rebuilt[name]['session_id']), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""LTTB downsampling (series.py)."""
+import math
+import random
+import unittest
+
+import support  # noqa: F401 (puts the app on sys.path)
+from series import lttb
+
+
+def wave(n):
+    return [(x, math.sin(x / 7) * 100 + x, f'label-{x}') for x in range(n)]
+
+
+class LttbTest(unittest.TestCase):
+
+    def test_threshold_at_or_above_length_returns_every_point(self):
+        points = wave(50)
+        for threshold in (50, 51, 1000):
+            sampled = lttb(points, threshold)
+            self.assertEqual(sampled, points)
+            self.assertIsNot(sampled, points)
+        self.assertEqual(lttb([], 10), [])
+
+    def test_keeps_the_endpoints_and_the_threshold(self):
+        rng = random.Random(14)
+        for _ in range(200):
+            n = rng.randint(3, 400)
+            points = sorted((rng.uniform(0, 1e6), rng.uniform(-50, 50)) for _ in range(n))
+            threshold = rng.randint(3, n)
+            sampled = lttb(points, threshold)
+            self.assertEqual(len(sampled), threshold)
+            self.assertEqual(sampled[0], points[0])
+            self.assertEqual(sampled[-1], points[-1])
+            # A subsequence of the input, still in x order
+            positions = [points.index(point) for point in sampled]
+            self.assertEqual(positions, sorted(set(positions)))
+
+    def test_tiny_thresholds(self):
+        points = wave(10)
+        self.assertEqual(lttb(points, 2), [points[0], points[-1]])
+        self.assertEqual(lttb(points, 1), [points[0]])
+        self.assertEqual(lttb(points, 0), [])
+
+    def test_keeps_a_spike(self):
+        points = [(x, 0) for x in range(1000)]
+        points[637] = (637, 500)
+        self.assertIn((637, 500), lttb(points, 20))
+
+    def test_extra_items_are_carried_along(self):
+        for point in lttb(wave(300), 30):
+            self.assertEqual(point[2], f'label-{point[0]}')
+
+
+if __name__ == '__main__':
+    unittest.main()
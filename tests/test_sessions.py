@@ -0,0 +1,76 @@
+"""Session history: keyset pagination through /api/sessions."""
+import base64
+import json
+import unittest
+from datetime import datetime, timedelta
+
+from support import AppTestCase, needs_mongo
+from models import decode_page_cursor, encode_page_cursor
+
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+
+class PageCursorTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        position = (datetime(2026, 3, 1, 7, 30, 15, 250000), 'b6d0c5a4')
+        self.assertEqual(decode_page_cursor(encode_page_cursor(*position)), position)
+
+    def test_malformed_cursors_raise_value_error(self):
+        for cursor in ('', 'not a cursor!', raw_cursor([1, 2]), raw_cursor({'t': 5, 'id': 'x'}),
+                       raw_cursor({'t': 'yesterday', 'id': 'x'}), raw_cursor({'id': 'x'}),
+                       base64.urlsafe_b64encode(b'\xff\xfe').decode()):
+            with self.assertRaises(ValueError, msg=cursor):
+                decode_page_cursor(cursor)
+
+
+@needs_mongo
+class SessionPagesTest(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        from models import WorkoutSession
+        base = datetime(2026, 3, 1, 7, 0)
+        # Three sessions share a start time, so the _id tie-break decides their order
+        starts = [base - timedelta(days=days) for days in (0, 1, 1, 1, 2, 3, 5)]
+        self.sessions = [WorkoutSession(plan_id='test-plan', user_id=self.user.id, start_time=start).save()
+                         for start in starts]
+        self.expected = [s.id for s in sorted(self.sessions, key=lambda s: (s.start_time, s.id), reverse=True)]
+
+    def pages(self, limit, extra=''):
+        ids, cursor = [], None
+        while True:
+            path = f'/api/sessions?limit={limit}{extra}' + (f'&cursor={cursor}' if cursor else '')
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            page = response.get_json()
+            self.assertLessEqual(len(page['sessions']), limit)
+            ids.extend(item['id'] for item in page['sessions'])
+            cursor = page['next_cursor']
+            if not cursor:
+                return ids
+
+    def test_pages_cover_every_session_once_in_order(self):
+        for limit in (1, 2, 3, 7, 100):
+            self.assertEqual(self.pages(limit), self.expected, limit)
+
+    def test_tampered_cursor_is_rejected(self):
+        for cursor in ('garbage', raw_cursor({'t': 'yesterday', 'id': 'x'}), raw_cursor([])):
+            response = self.client.get(f'/api/sessions?cursor={cursor}')
+            self.assertEqual(response.status_code, 400)
+
+    def test_recent_completed(self):
+        from models import WorkoutSession
+        for session in self.sessions[1:5]:
+            session.complete('')
+        since = self.sessions[0].start_time - timedelta(days=1, minutes=30)
+        recent = WorkoutSession.get_recent_completed(self.user.id, since=since, limit=5)
+        # Unfinished sessions and those started before `since` are left out
+        self.assertEqual([s.id for s in recent], [i for i in self.expected if i in {s.id for s in self.sessions[1:4]}])
+        self.assertEqual(len(WorkoutSession.get_recent_completed(self.user.id, limit=2)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
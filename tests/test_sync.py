@@ -0,0 +1,63 @@
+"""Offline sync: the /sync batch endpoint."""
+import unittest
+
+from support import AppTestCase, needs_mongo
+
+
+@needs_mongo
+class SyncTest(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        from models import WorkoutSession
+        self.session = WorkoutSession(plan_id='test-plan', user_id=self.user.id).save()
+
+    def logged_sets(self):
+        from models import db
+        return db.workout_sessions.find_one({"_id": self.session.id}).get('set_log', [])
+
+    def log_set(self, key, **fields):
+        return dict({'id': key, 'type': 'log_set', 'sessionId': self.session.id, 'exerciseKey': 'bench_press',
+                     'reps': 5, 'weight': 60, 'timestamp': 1760000000000}, **fields)
+
+    def test_out_of_range_values_are_invalid(self):
+        items = [self.log_set('ok'), self.log_set('reps', reps=10 ** 30), self.log_set('weight', weight=1e9),
+                 self.log_set('negative', weight=-1), self.log_set('nan', weight='nan'),
+                 self.log_set('timestamp', timestamp=1e20)]
+        response = self.client.post('/sync', json={'items': items})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['results'], {'ok': 'committed', 'reps': 'invalid', 'weight': 'invalid',
+                                                          'negative': 'invalid', 'nan': 'invalid',
+                                                          'timestamp': 'invalid'})
+        self.assertEqual(len(self.logged_sets()), 1)
+
+    def test_replayed_items_apply_once(self):
+        for status in ('committed', 'duplicate'):
+            response = self.client.post('/sync', json={'items': [self.log_set('once')]})
+            self.assertEqual(response.get_json()['results'], {'once': status})
+        self.assertEqual(len(self.logged_sets()), 1)
+
+    def test_online_writes_and_their_offline_copies_apply_once(self):
+        from models import db
+        form = {'session_id': self.session.id, 'exercise_key': 'bench_press', 'reps': 5, 'weight': 60,
+                'sync_key': 'set-1'}
+        for _ in range(2):
+            self.assertEqual(self.client.post('/log_set', data=form).status_code, 200)
+        response = self.client.post('/sync', json={'items': [self.log_set('set-1')]})
+        self.assertEqual(response.get_json()['results'], {'set-1': 'duplicate'})
+        self.assertEqual(len(self.logged_sets()), 1)
+
+        form = {'session_id': self.session.id, 'exercise_key': 'bench_press', 'sets_completed[]': ['true'],
+                'reps_completed[]': ['5'], 'weights_used[]': ['60'], 'sync_key': 'exercise-1'}
+        for _ in range(2):
+            self.assertEqual(self.client.post('/complete_exercise', data=form).status_code, 200)
+        completed = db.workout_sessions.find_one({"_id": self.session.id})['exercises_completed']
+        self.assertEqual(len(completed), 1)
+
+    def test_unknown_session_is_not_found(self):
+        form = {'session_id': 'missing', 'exercise_key': 'bench_press', 'reps': 5, 'weight': 60, 'sync_key': 'k'}
+        self.assertEqual(self.client.post('/log_set', data=form).status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()